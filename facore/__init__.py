@@ -1,5 +1,14 @@
-__all__ = ['Collocator', 'Downloader', 'Fuzzifier', 'Utilities']
+__all__ = ['Bathymetry', 'Collocator', 'Downloader', 'Fuzzifier', 'Inference', 'LookupTable', 'Memo', 'Metrics', 'Profiler', 'Regridder', 'RuleTable', 'Scheduler', 'Utilities']
+from .bathymetry import Bathymetry
 from .collocator import Collocator
 from .downloader import Downloader
 from .fuzzifier import Fuzzifier
+from .inference import Inference
+from .lookup import LookupTable
+from .memo import Memo
+from .metrics import Metrics
+from .profiler import Profiler
+from .regrid import Regridder
+from .ruletable import RuleTable
+from .scheduler import Scheduler
 from .utilities import Utilities
@@ -0,0 +1,89 @@
+import os
+import json
+import shutil
+import argparse
+import tempfile
+import numpy as np
+import netCDF4 as cdf
+from utilities import Utilities
+
+class Bathymetry:
+    '''
+    Shared, read-only bathymetry of the target grid. prepare() converts the
+    NetCDF asset once into a directory of .npy arrays, the depth (NaN on
+    land) and the ocean mask, which every run and worker memory-maps instead
+    of each date keeping a copy, and the lat and lon axes it is on. The
+    content hash of the asset is kept with them for the manifests.
+    '''
+    def __init__(self, directory):
+        self.directory = directory
+        with open(os.path.join(directory, 'source.json')) as f:
+            self.source = json.load(f)
+        self.file = self.source['file']
+        self.signature = self.source['signature']
+        self.maskFile = os.path.join(directory, 'ocean.npy')
+        self.depth = np.load(os.path.join(directory, 'depth.npy'), mmap_mode='r')
+        self.ocean = np.load(self.maskFile, mmap_mode='r')
+        self.lat = np.load(os.path.join(directory, 'lat.npy'))
+        self.lon = np.load(os.path.join(directory, 'lon.npy'))
+
+    def matches(self, lat, lon):
+        # on the grid of the given axes, in the same order; the same shape
+        # is not enough, a file may be flipped or of another region
+        return all(np.shape(axis) == np.shape(own) and np.allclose(axis, own) for axis, own in ((lat, self.lat), (lon, self.lon)))
+
+    @staticmethod
+    def prepare(file, directory, variable='bathymetry'):
+        '''
+        Bathymetry of the NetCDF file, converted into directory unless it
+        already holds a conversion of the same file (path, size and
+        modification time).
+        '''
+        stat = os.stat(file)
+        source = {'file': os.path.abspath(file), 'size': stat.st_size, 'mtime': stat.st_mtime}
+        try:
+            bathymetry = Bathymetry(directory)
+            if all(bathymetry.source.get(key) == value for key, value in source.items()):
+                return bathymetry
+        except (IOError, OSError, ValueError, KeyError):
+            pass
+
+        # convert into a new directory and swap it in, runs that still map
+        # the old arrays keep them until they exit
+        parent = os.path.dirname(os.path.abspath(directory))
+        if not os.path.exists(parent):
+            os.makedirs(parent)
+        temp = tempfile.mkdtemp(dir=parent)
+        with Utilities.netcdfLock:
+            dataset = cdf.Dataset(file, 'r')
+            try:
+                values = np.ma.asarray(dataset[variable][:])
+                lat = np.ma.filled(dataset['lat'][:], np.nan)
+                lon = np.ma.filled(dataset['lon'][:], np.nan)
+            finally:
+                dataset.close()
+        depth = np.ma.filled(values.astype(values.dtype if values.dtype.kind == 'f' else np.float32), np.nan)
+        np.save(os.path.join(temp, 'depth.npy'), depth)
+        np.save(os.path.join(temp, 'ocean.npy'), ~np.isnan(depth))
+        np.save(os.path.join(temp, 'lat.npy'), lat)
+        np.save(os.path.join(temp, 'lon.npy'), lon)
+        source['signature'] = Utilities.contentHash(file)
+        with open(os.path.join(temp, 'source.json'), 'w') as f:
+            json.dump(source, f, indent=2, sort_keys=True)
+        if os.path.exists(directory):
+            shutil.rmtree(directory, ignore_errors=True)
+        try:
+            os.rename(temp, directory)
+        except OSError:
+            # a concurrent run swapped in its own conversion first
+            shutil.rmtree(temp, ignore_errors=True)
+        return Bathymetry(directory)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Prepare the shared bathymetry of the target grid')
+    parser.add_argument('-i', '--input', required=True, help='path to bathymetry.nc')
+    parser.add_argument('-d', '--directory', required=True, help='directory of the prepared arrays')
+    args = parser.parse_args()
+
+    bathymetry = Bathymetry.prepare(args.input, args.directory)
+    print 'Bathymetry of {0} by {1} pixels, {2} ocean, in {3}'.format(bathymetry.depth.shape[0], bathymetry.depth.shape[1], int(bathymetry.ocean.sum()), args.directory)
@@ -0,0 +1,203 @@
+from __future__ import division
+import os
+import sys
+import time
+import json
+import shutil
+import argparse
+import tempfile
+import subprocess
+import numpy as np
+import netCDF4 as cdf
+from collocator import Collocator
+from checks import fakeMotu
+from downloader import Downloader
+from fuzzifier import Fuzzifier
+from ruletable import RuleTable
+
+# Slow imports that a pipeline run should only pay for when it uses them
+HEAVY_MODULES = ['matplotlib', 'skfuzzy', 'networkx', 'snappy']
+
+IMPORT_SCRIPT = '''import sys, time, json
+start = time.time()
+import {0}
+print json.dumps([time.time() - start, sorted(m for m in {1!r} if m in sys.modules)])
+'''
+
+def importTimes(modules=('facore', 'fishalert', 'fuzzifier', 'downloader', 'collocator'), repeat=3):
+    '''
+    Seconds to import each module in a fresh interpreter, best of repeat,
+    and the HEAVY_MODULES the import loaded. The repository and facore are
+    both on the path, so 'downloader' is imported as the script would be.
+    '''
+    directory = os.path.dirname(os.path.abspath(__file__))
+    environment = dict(os.environ, PYTHONPATH=os.pathsep.join([os.path.dirname(directory), directory]))
+    records = []
+    for module in modules:
+        best = None
+        for _ in range(repeat):
+            output = subprocess.check_output([sys.executable, '-c', IMPORT_SCRIPT.format(module, HEAVY_MODULES)], env=environment, cwd=os.path.dirname(directory))
+            seconds, loaded = json.loads(output.splitlines()[-1])
+            best = seconds if best is None else min(best, seconds)
+        records.append({'stage': 'import', 'module': module, 'seconds': best, 'loaded': loaded})
+    return records
+
+def _smooth(random, X, Y, scale=8):
+    # low frequency noise in [0, 1]: random coarse grid, bilinearly upsampled
+    coarse = random.rand(scale + 1, scale + 1)
+    y = np.linspace(0, scale, X)
+    x = np.linspace(0, scale, Y)
+    i = np.minimum(y.astype(int), scale - 1)
+    j = np.minimum(x.astype(int), scale - 1)
+    wy = (y - i)[:, np.newaxis]
+    wx = (x - j)[np.newaxis, :]
+    field = (coarse[i][:, j] * (1 - wy) * (1 - wx) + coarse[i + 1][:, j] * wy * (1 - wx) +
+             coarse[i][:, j + 1] * (1 - wy) * wx + coarse[i + 1][:, j + 1] * wy * wx)
+    return (field - field.min()) / (field.max() - field.min())
+
+def _write(file, lat, lon, variables, latName='lat', lonName='lon', time=False):
+    ds = cdf.Dataset(file, 'w')
+    if time:
+        ds.createDimension('time', 1)
+        ds.createVariable('time', 'f8', ('time',))[:] = 0
+    ds.createDimension(latName, len(lat))
+    ds.createDimension(lonName, len(lon))
+    ds.createVariable(latName, 'f4', (latName,))[:] = lat
+    ds.createVariable(lonName, 'f4', (lonName,))[:] = lon
+    dimensions = (('time',) if time else ()) + (latName, lonName)
+    for name, values in variables.items():
+        variable = ds.createVariable(name, 'f4', dimensions, fill_value=np.nan)
+        variable[:] = np.ma.masked_invalid(values.reshape(variable.shape))
+    ds.close()
+
+def syntheticInputs(directory, X, Y, land=0.3, seed=0):
+    '''
+    Writes a master bathymetry grid of X by Y pixels over the Mediterranean
+    box, with about `land` of it land, and CHL, SST and SLA products on
+    their own coarser or finer grids, like the CMEMS ones.
+    '''
+    if not os.path.exists(directory):
+        os.makedirs(directory)
+    random = np.random.RandomState(seed)
+    lat = np.linspace(30.2, 45.8, X)
+    lon = np.linspace(-5.5, 36, Y)
+    # land is the highest `land` fraction of a smooth height field
+    height = _smooth(random, X, Y)
+    coast = max(np.percentile(height, 100 * (1 - land)), 1e-9)
+    depth = np.where(height < coast, -5000 * (coast - height) / coast, np.nan)
+    _write(os.path.join(directory, 'bathymetry.nc'), lat, lon, {'bathymetry': depth})
+
+    files = {}
+    for product, scale, variables in [('SST', 1.0, ['analysed_sst']), ('CHL', 1.5, ['CHL']), ('SLA', 0.5, ['sla'])]:
+        sx, sy = max(2, int(X * scale)), max(2, int(Y * scale))
+        plat = np.linspace(30, 46, sx)
+        plon = np.linspace(-6, 36.5, sy)
+        field = _smooth(random, sx, sy, 12)
+        sea = _smooth(np.random.RandomState(seed), sx, sy) < coast
+        values = {'analysed_sst': 285 + 15 * field, 'CHL': np.exp(4 * field - 3), 'sla': 0.4 * field - 0.2}
+        fields = dict((name, np.where(sea, values[name], np.nan)) for name in variables)
+        files[product] = os.path.join(directory, '{0}.nc'.format(product))
+        _write(files[product], plat, plon, fields, time=True)
+    return os.path.join(directory, 'bathymetry.nc'), files
+
+class Benchmark:
+    '''
+    Times the PFZ pipeline stages on synthetic inputs and collects one
+    record (a dict) per measurement.
+    '''
+    def __init__(self, directory, repeat=1):
+        self.directory = directory
+        self.repeat = repeat
+        self.records = []
+
+    def measure(self, stage, function, **fields):
+        # best of `repeat` runs, wall and CPU seconds (with child processes);
+        # a failing stage is recorded with its error instead of ending the run
+        best = None
+        result = None
+        for _ in range(self.repeat):
+            wall, cpu = time.time(), sum(os.times()[:4])
+            try:
+                result = function()
+            except Exception as e:
+                self.records.append(dict(fields, stage=stage, error='{0}: {1}'.format(type(e).__name__, e)))
+                return None
+            elapsed = (time.time() - wall, sum(os.times()[:4]) - cpu)
+            if best is None or elapsed[0] < best[0]:
+                best = elapsed
+        self.records.append(dict(fields, stage=stage, seconds=best[0], cpu_seconds=best[1]))
+        return result
+
+    def run(self, X, Y, land=0.3, backends=('numpy',), collocator='numpy', seed=0):
+        grid = {'grid': [X, Y], 'land': land}
+        directory = os.path.join(self.directory, '{0}x{1}_{2}'.format(X, Y, land))
+        master, products = syntheticInputs(directory, X, Y, land, seed)
+
+        # download: the motu client is replaced by a copy of the products
+        downloader = Downloader(fakeMotu(directory), 'user', 'password')
+        downloader.products = dict((product, product) for product in products)
+        download = os.path.join(directory, 'download')
+        jobs = [(download, '_{0}.nc'.format(product), product, '2017-01-01') for product in products]
+        self.measure('download', lambda: downloader.downloadAll(jobs, force_copy=True), **grid)
+
+        final = os.path.join(directory, 'final.nc')
+        slaves = [products['SST'], products['CHL'], products['SLA']]
+        colloc = Collocator(backend=collocator)
+        self.measure('collocate', lambda: colloc.CollocateAll(master, slaves, final, False), backend=collocator, **grid)
+
+        fuzzifier = self.measure('setData', lambda: Fuzzifier(final), **grid)
+        pixels = int(fuzzifier.ocean.sum())
+        for fishery, season, _, _ in RuleTable.seasons():
+            rule = dict(grid, fishery=fishery, season=season)
+            self.measure('setFuzzyRules', lambda: fuzzifier.setFuzzyRules(season, fishery), **rule)
+            # compile from scratch, not from the rule cache
+            Fuzzifier.ruleCache.entries.clear()
+            self.measure('compile', lambda: fuzzifier.compile(season, fishery), **rule)
+            for backend in backends:
+                lutDirectory = os.path.join(self.directory, 'lut')
+                if backend == 'lut':
+                    # build the table outside of the measurement
+                    fuzzifier.lookupTable(season, fishery, lutDirectory, verbose=False)
+                self.measure('run', lambda: fuzzifier.run(season, fishery, False, backend, lutDirectory), backend=backend, pixels=pixels, **rule)
+                if 'seconds' in self.records[-1]:
+                    self.records[-1]['pixels_per_second'] = pixels / max(self.records[-1]['seconds'], 1e-9)
+            output = os.path.join(directory, '{0}.nc'.format(fishery))
+            self.measure('writeData', lambda: fuzzifier.writeData(output, False), **rule)
+            if 'seconds' in self.records[-1]:
+                self.records[-1]['bytes'] = os.path.getsize(output)
+        return self.records
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark the PFZ pipeline on synthetic grids')
+    parser.add_argument('-g', '--grid', nargs='+', default=['300x400', '600x700'], help='grid sizes, as ROWSxCOLUMNS')
+    parser.add_argument('-l', '--land', type=float, nargs='+', default=[0.3], help='land fractions')
+    parser.add_argument('-b', '--backend', nargs='+', choices=['numpy', 'lut', 'skfuzzy'], default=['numpy'], help='inference backends, lookup tables are built untimed and kept in the directory')
+    parser.add_argument('-c', '--collocator', choices=['snap', 'numpy'], default='numpy', help='the collocation backend')
+    parser.add_argument('-r', '--repeat', type=int, default=1, help='runs of each measurement, the best is kept')
+    parser.add_argument('-o', '--output', help='JSON lines file for the results (default: stdout)')
+    parser.add_argument('-d', '--directory', help='keep the synthetic inputs in this directory')
+    parser.add_argument('--seed', type=int, default=0, help='seed of the synthetic fields')
+    parser.add_argument('--imports', help='only measure the import time of the modules and the heavy modules they load', action='store_true')
+    args = parser.parse_args()
+
+    if args.imports:
+        for record in importTimes(repeat=args.repeat):
+            print json.dumps(record, sort_keys=True)
+        sys.exit()
+
+    directory = args.directory or tempfile.mkdtemp()
+    benchmark = Benchmark(directory, args.repeat)
+    try:
+        for grid in args.grid:
+            X, Y = [int(n) for n in grid.split('x')]
+            for land in args.land:
+                benchmark.run(X, Y, land, args.backend, args.collocator, args.seed)
+    finally:
+        if args.directory is None:
+            shutil.rmtree(directory)
+
+    out = open(args.output, 'w') if args.output else sys.stdout
+    for record in benchmark.records:
+        out.write(json.dumps(record, sort_keys=True) + '\n')
+    if args.output:
+        out.close()
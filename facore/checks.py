@@ -0,0 +1,223 @@
+import os
+import sys
+import signal
+import shutil
+import argparse
+import tempfile
+import numpy as np
+import netCDF4 as cdf
+from bathymetry import Bathymetry
+from collocator import Collocator
+from downloader import Downloader
+from fuzzifier import Fuzzifier
+from lookup import LookupTable
+from ruletable import RuleTable
+from utilities import Utilities
+
+# Stand-in for the motu client, shared by the checks and the benchmark: the
+# product (-d) is copied from the source directory when it exists there,
+# otherwise it tells the client how to fail. Runs are counted per product in
+# the output directory.
+FAKE_MOTU = '''import os, sys, time, shutil, argparse
+source = {0!r}
+parser = argparse.ArgumentParser()
+for option in 'upmsdxXyYtTo':
+    parser.add_argument('-' + option)
+parser.add_argument('-v', action='append')
+parser.add_argument('-f')
+args = parser.parse_args()
+runs = os.path.join(args.o, args.d + '.runs')
+count = int(open(runs).read()) + 1 if os.path.isfile(runs) else 1
+open(runs, 'w').write(str(count))
+product = os.path.join(source, args.d + '.nc')
+if os.path.isfile(product):
+    shutil.copy(product, os.path.join(args.o, args.f))
+    sys.exit()
+if args.d == 'hang':
+    open(os.path.join(args.o, 'hang.pid'), 'a').write('{{0}}\\n'.format(os.getpid()))
+    time.sleep(3600)
+elif args.d == 'unauthorized':
+    print 'Error: 401 Unauthorized'
+    sys.exit(1)
+elif args.d == 'error' or (args.d == 'flaky' and count == 1):
+    print 'Error: the server did not answer'
+    sys.exit(2)
+open(os.path.join(args.o, args.f), 'w').write('data')
+'''
+
+# Cases of checkDownloads(): product of FAKE_MOTU, expected status of the
+# download and of each of its attempts
+DOWNLOAD_CASES = [('hang', 'timeout', ['timeout'] * 3),
+                  ('error', 'retryable', ['retryable'] * 3),
+                  ('unauthorized', 'fatal', ['fatal']),
+                  ('flaky', 'ok', ['retryable', 'ok'])]
+
+def fakeMotu(directory, source=None):
+    '''
+    Writes FAKE_MOTU to directory, copying products from source (default:
+    directory), and returns its path.
+    '''
+    script = os.path.join(directory, 'fake_motu.py')
+    with open(script, 'w') as f:
+        f.write(FAKE_MOTU.format(os.path.abspath(source or directory)))
+    return script
+
+def _alive(pid):
+    # running, not only waiting to be reaped
+    try:
+        os.kill(pid, 0)
+    except OSError:
+        return False
+    try:
+        with open('/proc/{0}/stat'.format(pid)) as f:
+            return f.read().split(')')[-1].split()[0] != 'Z'
+    except IOError:
+        return True
+
+def checkDownloads(timeout=1, verbose=False):
+    '''
+    Runs downloads against fake motu clients that hang, exit with an error,
+    reject the credentials, and fail once before succeeding, with a short
+    timeout and backoff. Returns the failed expectations, none when the
+    timeout kill, the retries and the retryable/fatal split work.
+    '''
+    directory = tempfile.mkdtemp()
+    failures = []
+    try:
+        downloader = Downloader(fakeMotu(directory), 'user', 'password', timeout, len(DOWNLOAD_CASES[0][2]), backoff=0.1, maxBackoff=0.2)
+        for product, status, attempts in DOWNLOAD_CASES:
+            downloader.products['CHL'] = product
+            result = downloader.download(directory, '{0}.nc'.format(product), 'CHL', '2017-01-01')
+            statuses = [attempt.status for attempt in result.attempts]
+            if verbose is True:
+                print '{0}: {1}, attempts {2}'.format(product, result.status, ', '.join(statuses))
+            if result.status != status or statuses != attempts:
+                failures.append('{0}: expected {1} after {2}, got {3} after {4}'.format(product, status, attempts, result.status, statuses))
+            if bool(result) != os.path.isfile(result.file):
+                failures.append('{0}: the file does not match the result'.format(product))
+        # a client that timed out is killed, not left running
+        pids = os.path.join(directory, 'hang.pid')
+        if not os.path.isfile(pids):
+            failures.append('hang: the client never started')
+        else:
+            with open(pids) as f:
+                for pid in f.read().split():
+                    if _alive(int(pid)):
+                        failures.append('hang: client {0} still running after the timeout'.format(pid))
+                        os.kill(int(pid), signal.SIGKILL)
+    finally:
+        shutil.rmtree(directory)
+    return failures
+
+def checkLookupTables(rules=(('Sardine', 'June'),), resolution=1, samples=20000, verbose=False):
+    '''
+    Builds lookup tables of rule bases with nodes where no rule fires, and
+    compares them against exact inference: the table must be NaN exactly
+    where inference is.
+    '''
+    failures = []
+    for fishery, season in rules:
+        engine = Fuzzifier(None).compile(season, fishery)
+        table = LookupTable.build(engine, resolution)
+        report = table.errorReport(engine, samples)
+        if verbose is True:
+            print '{0} {1}: {2} NaN nodes, max error {3:.4f}, NaN mismatch {4}'.format(season, fishery, int(np.isnan(table.values).sum()), report['max'], report['nan_mismatch'])
+        if report['nan_mismatch'] != 0:
+            failures.append('{0} {1}: {2} samples NaN in only one of the table and inference'.format(season, fishery, report['nan_mismatch']))
+    return failures
+
+def netcdf3Copy(source, target):
+    # the NetCDF3 file SNAP's NetCDF-BEAM writer makes of a collocation
+    with Utilities.netcdfLock:
+        src = cdf.Dataset(source, 'r')
+        dst = cdf.Dataset(target, 'w', format='NETCDF3_CLASSIC')
+        try:
+            for name, dimension in src.dimensions.items():
+                dst.createDimension(name, len(dimension))
+            for name, variable in src.variables.items():
+                attributes = dict((k, variable.getncattr(k)) for k in variable.ncattrs() if k != '_FillValue')
+                copy = dst.createVariable(name, variable.datatype, variable.dimensions, fill_value=getattr(variable, '_FillValue', None))
+                copy.setncatts(attributes)
+                copy[:] = variable[:]
+        finally:
+            src.close()
+            dst.close()
+
+def checkNetcdf3(X=60, Y=70, snappypath=None, verbose=False):
+    '''
+    Collocates synthetic inputs with SNAP, or when snappy is not available
+    with the numpy backend and a NetCDF3 copy like SNAP writes, and
+    fuzzifies every fishery in one streaming pass as fishalert -f ALL does.
+    The PFZs must equal those of run() on the same file.
+    '''
+    # benchmark uses the fake motu client of this module
+    from benchmark import syntheticInputs
+    directory = tempfile.mkdtemp()
+    failures = []
+    try:
+        master, products = syntheticInputs(directory, X, Y)
+        slaves = [products['SST'], products['CHL'], products['SLA']]
+        final = os.path.join(directory, 'final.nc')
+        collocator = Collocator(snappypath)
+        try:
+            import snappy
+            collocator.CollocateAll(master, slaves, final, False)
+        except ImportError:
+            if verbose is True:
+                print 'snappy is not available, writing a NetCDF3 collocation instead'
+            collocated = os.path.join(directory, 'collocated.nc')
+            Collocator(backend='numpy').CollocateAll(master, slaves, collocated, False)
+            netcdf3Copy(collocated, final)
+        bathymetry = Bathymetry.prepare(master, os.path.join(directory, 'bathymetry'))
+
+        jobs = []
+        for fishery in RuleTable.fisheries():
+            season = [season for f, season, _, _ in RuleTable.seasons() if f == fishery][0]
+            jobs.append((season, fishery, os.path.join(directory, '{0}.nc'.format(fishery))))
+        Fuzzifier(final, None, True, bathymetry).runAll(jobs, False)
+
+        fuzzifier = Fuzzifier(final, None, False, bathymetry)
+        for season, fishery, filename in jobs:
+            fuzzifier.run(season, fishery, False)
+            expected = os.path.join(directory, '_{0}.nc'.format(fishery))
+            fuzzifier.writeData(expected, False)
+            with Utilities.netcdfLock:
+                streamed = cdf.Dataset(filename, 'r')
+                computed = cdf.Dataset(expected, 'r')
+                try:
+                    a = streamed[fuzzifier.outputParameter][:]
+                    b = computed[fuzzifier.outputParameter][:]
+                finally:
+                    streamed.close()
+                    computed.close()
+            if verbose is True:
+                print '{0} {1}: {2} pixels'.format(season, fishery, a.count())
+            if not (np.array_equal(np.ma.getmaskarray(a), np.ma.getmaskarray(b)) and np.ma.allequal(a, b)):
+                failures.append('{0} {1}: the streamed PFZ differs from run()'.format(season, fishery))
+    except Exception as e:
+        failures.append('{0}: {1}'.format(type(e).__name__, e))
+    finally:
+        shutil.rmtree(directory)
+    return failures
+
+# name: check, each returns the list of its failures
+CHECKS = {'downloads': checkDownloads, 'lut': checkLookupTables, 'netcdf3': checkNetcdf3}
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Check the pipeline stages against fake clients and small inputs')
+    parser.add_argument('checks', nargs='*', help='checks to run, of {0} (default: all)'.format(', '.join(sorted(CHECKS))))
+    parser.add_argument("-v", "--verbose", help="enable verbose mode", action="store_true")
+    args = parser.parse_args()
+    for name in args.checks:
+        if name not in CHECKS:
+            parser.error('unknown check {0}'.format(name))
+
+    failed = False
+    for name in args.checks or sorted(CHECKS):
+        failures = CHECKS[name](verbose=args.verbose)
+        for failure in failures:
+            print 'FAILED {0}: {1}'.format(name, failure)
+        if not failures:
+            print 'ok {0}'.format(name)
+        failed = failed or bool(failures)
+    sys.exit(1 if failed else 0)
@@ -1,6 +1,15 @@
 from contextlib import contextmanager
 import os
 import sys
+import threading
+import numpy as np
+import netCDF4 as cdf
+from regrid import Regridder
+from snapworker import SnapWorkerClient
+from utilities import Utilities
+
+LATITUDE = ['lat', 'latitude']
+LONGITUDE = ['lon', 'longitude']
 
 # Define a context manager to suppress stdout and stderr. 
 # From: https://stackoverflow.com/questions/11130156/suppress-stdout-stderr-print-from-python-functions
@@ -13,30 +22,69 @@ class suppress_stdout_stderr(object):
     to stderr just before a script exits, and after the context manager has
     exited (at least, I think that is why it lets exceptions through).      
 
+    The file descriptors are those of the whole process, so uses from
+    several threads nest: the first one in redirects them and the last one
+    out restores them. A disabled one does nothing.
     '''
-    def __init__(self):
-        # Open a pair of null files
-        self.null_fds =  [os.open(os.devnull,os.O_RDWR) for x in range(2)]
-        # Save the actual stdout (1) and stderr (2) file descriptors.
-        self.save_fds = (os.dup(1), os.dup(2))
+    lock = threading.Lock()
+    depth = 0
+    save_fds = None
+
+    def __init__(self, enabled=True):
+        self.enabled = enabled
 
     def __enter__(self):
-        # Assign the null pointers to stdout and stderr.
-        os.dup2(self.null_fds[0],1)
-        os.dup2(self.null_fds[1],2)
+        if not self.enabled:
+            return
+        with suppress_stdout_stderr.lock:
+            if suppress_stdout_stderr.depth == 0:
+                # Save the actual stdout (1) and stderr (2) file descriptors,
+                # and assign a null file to both
+                null_fd = os.open(os.devnull, os.O_RDWR)
+                suppress_stdout_stderr.save_fds = (os.dup(1), os.dup(2))
+                os.dup2(null_fd, 1)
+                os.dup2(null_fd, 2)
+                os.close(null_fd)
+            suppress_stdout_stderr.depth += 1
 
     def __exit__(self, *_):
-        # Re-assign the real stdout/stderr back to (1) and (2)
-        os.dup2(self.save_fds[0],1)
-        os.dup2(self.save_fds[1],2)
-        # Close the null files
-        os.close(self.null_fds[0])
-        os.close(self.null_fds[1])
+        if not self.enabled:
+            return
+        with suppress_stdout_stderr.lock:
+            suppress_stdout_stderr.depth -= 1
+            if suppress_stdout_stderr.depth == 0:
+                # Re-assign the real stdout/stderr back to (1) and (2), and
+                # close the saved copies
+                for fd, save_fd in zip((1, 2), suppress_stdout_stderr.save_fds):
+                    os.dup2(save_fd, fd)
+                    os.close(save_fd)
+                suppress_stdout_stderr.save_fds = None
 
 class Collocator:
-    def __init__(self, snappypath):
+    '''
+    Collocates slave products onto the grid of a master product with
+    bilinear resampling, either through SNAP's CollocateOp ('snap') or in
+    process with NumPy/SciPy ('numpy'), which needs no JVM and no snappy.
+    The numpy backend computes the weights of each pair of grids once and,
+    with a weightsDirectory, saves them for the next runs. With a
+    workerAddress, the snap backend runs the jobs in a persistent SnapWorker
+    so the JVM starts once instead of on every run.
+    '''
+    # SNAP's warnings are dropped, unless the output goes somewhere it does
+    # not get in the way, like the log of a SnapWorker
+    suppressOutput = True
+
+    def __init__(self, snappypath=None, backend='snap', weightsDirectory=None, workerAddress=None):
         self.name = 'Collocator'
-        sys.path.append(snappypath) #/home/fedonman/.snap/snap-python
+        self.backend = backend
+        # regridding weights of the numpy backend, kept per grid signature
+        self.weightsDirectory = weightsDirectory
+        self.weights = {}
+        self.worker = None
+        if backend == 'snap' and workerAddress is not None:
+            self.worker = SnapWorkerClient(workerAddress, snappypath)
+        if snappypath is not None:
+            sys.path.append(snappypath) #/home/fedonman/.snap/snap-python
 
     def isSNAPproduct(self, prod):
         return 'snap.core.datamodel.Product' in str(type(prod))
@@ -56,31 +104,22 @@ class Collocator:
         return prod
 
     def Collocate(self, masterFile, slaveFile, targetFile, verbose=True):
+        if self.worker is not None:
+            return self.worker.call('Collocate', masterFile, slaveFile, targetFile, verbose)[0]
+        if self.backend == 'numpy':
+            return self.CollocateNumpy(masterFile, [slaveFile], targetFile, verbose)
         import snappy
         if verbose is True:
             print 'Collocating {0} and {1} into {2}'.format(slaveFile, masterFile, targetFile) 
         
         # Supress stdout because snappy raises warnings
-        with suppress_stdout_stderr():
+        with suppress_stdout_stderr(self.suppressOutput):
             # read master and slave products
             masterProduct = self.readProduct(masterFile)
             slaveProduct = self.readProduct(slaveFile)
 
-            # import necessary Java types
-            CollocateOp = snappy.jpy.get_type('org.esa.snap.collocation.CollocateOp')
-            ResamplingType = snappy.jpy.get_type('org.esa.snap.collocation.ResamplingType')
-
-            # create operator and set parameters
-            ColOp = CollocateOp()
-            ColOp.setParameterDefaultValues()
-            ColOp.setMasterProduct(masterProduct)
-            ColOp.setSlaveProduct(slaveProduct)
-            ColOp.setResamplingType(ResamplingType.BILINEAR_INTERPOLATION)
-            ColOp.setMasterComponentPattern('${ORIGINAL_NAME}')
-            ColOp.setSlaveComponentPattern('${ORIGINAL_NAME}')
-
             # Apply operator
-            targetProduct = ColOp.getTargetProduct()
+            targetProduct = self._collocateProducts(masterProduct, slaveProduct)
 
             # Write target product as netcdf file
             snappy.ProductIO.writeProduct(targetProduct, targetFile, 'NetCDF-BEAM')
@@ -88,12 +127,162 @@ class Collocator:
             # dispose resources
             masterProduct.dispose()
             slaveProduct.dispose()
-            del ColOp
-            del CollocateOp
-            del ResamplingType
             
             if verbose is True:
                 print 'Collocation successful.'
 
             # return target filename
-            return targetFile
\ No newline at end of file
+            return targetFile
+
+    def CollocateAll(self, masterFile, slaveFiles, targetFile, verbose=True):
+        '''
+        Collocates several slave products onto the master in one call. The
+        intermediate products stay in memory and only the target file is
+        written, without collocation flags. Sets self.report with the bytes
+        read and written, and the bytes a chain of pairwise Collocate calls
+        would have spent on intermediate files.
+        '''
+        if verbose is True:
+            print 'Collocating {0} and {1} into {2}'.format(', '.join(slaveFiles), masterFile, targetFile)
+
+        if self.worker is not None:
+            self.worker.call('CollocateAll', masterFile, slaveFiles, targetFile, False)
+        elif self.backend == 'numpy':
+            self.CollocateNumpy(masterFile, slaveFiles, targetFile, False)
+        else:
+            import snappy
+            with suppress_stdout_stderr(self.suppressOutput):
+                masterProduct = self.readProduct(masterFile)
+                products = [masterProduct]
+                targetProduct = masterProduct
+                # each target product is the master of the next collocation,
+                # without its flag band: the next CollocateOp adds its own
+                # under the same name and SNAP rejects the duplicate
+                for slaveFile in slaveFiles:
+                    slaveProduct = self.readProduct(slaveFile)
+                    products.append(slaveProduct)
+                    targetProduct = self._collocateProducts(targetProduct, slaveProduct)
+                    self._removeCollocationFlags(targetProduct)
+                snappy.ProductIO.writeProduct(targetProduct, targetFile, 'NetCDF-BEAM')
+                for product in products:
+                    product.dispose()
+
+        self.report = self.ioReport(masterFile, slaveFiles, targetFile)
+        if verbose is True:
+            print 'Collocation successful. Wrote {0:.1f} MB, saved {1:.1f} MB of intermediate I/O.'.format(self.report['written'] / 2.0 ** 20, self.report['saved'] / 2.0 ** 20)
+        return targetFile
+
+    def _collocateProducts(self, masterProduct, slaveProduct):
+        import snappy
+        # import necessary Java types, once per Collocator
+        if not hasattr(self, 'javaTypes'):
+            self.javaTypes = (snappy.jpy.get_type('org.esa.snap.collocation.CollocateOp'), snappy.jpy.get_type('org.esa.snap.collocation.ResamplingType'))
+        CollocateOp, ResamplingType = self.javaTypes
+
+        # create operator and set parameters
+        ColOp = CollocateOp()
+        ColOp.setParameterDefaultValues()
+        ColOp.setMasterProduct(masterProduct)
+        ColOp.setSlaveProduct(slaveProduct)
+        ColOp.setResamplingType(ResamplingType.BILINEAR_INTERPOLATION)
+        ColOp.setMasterComponentPattern('${ORIGINAL_NAME}')
+        ColOp.setSlaveComponentPattern('${ORIGINAL_NAME}')
+        return ColOp.getTargetProduct()
+
+    @staticmethod
+    def _removeCollocationFlags(product):
+        # in memory what Utilities.deleteCollocationFlags does to a file: the
+        # flag band goes, and its flag coding with it
+        for name in list(product.getBandNames()):
+            if name.startswith('collocation_flags'):
+                band = product.getBand(name)
+                coding = band.getFlagCoding()
+                product.removeBand(band)
+                if coding is not None:
+                    product.getFlagCodingGroup().remove(coding)
+
+    @staticmethod
+    def ioReport(masterFile, slaveFiles, targetFile):
+        # Data bytes of the target, and of the intermediate files that a chain
+        # of pairwise collocations writes and reads back: the master variables
+        # plus those of the slaves collocated so far, and a flag band (int32
+        # per pixel) in every file including the target
+        with Utilities.netcdfLock:
+            target = cdf.Dataset(targetFile, 'r')
+            try:
+                size = lambda name: target[name].size * target[name].dtype.itemsize
+                master = cdf.Dataset(masterFile, 'r')
+                layer = sum(size(name) for name in master.variables if name in target.variables)
+                master.close()
+                lat, lon = Collocator.coordinates(target)
+                flags = target[lat].size * target[lon].size * 4
+                saved = 0
+                for i, slaveFile in enumerate(slaveFiles):
+                    slave = cdf.Dataset(slaveFile, 'r')
+                    layer += sum(size(name) for name in slave.variables if name in target.variables and name not in (lat, lon))
+                    slave.close()
+                    if i < len(slaveFiles) - 1:
+                        saved += 2 * (layer + flags)
+                saved += flags
+                written = sum(size(name) for name in target.variables)
+            finally:
+                target.close()
+        return {'written': written, 'saved': saved, 'steps': len(slaveFiles)}
+
+    @staticmethod
+    def coordinates(dataset):
+        lat = [name for name in LATITUDE if name in dataset.variables][0]
+        lon = [name for name in LONGITUDE if name in dataset.variables][0]
+        return lat, lon
+
+    def CollocateNumpy(self, masterFile, slaveFiles, targetFile, verbose=True):
+        if verbose is True:
+            print 'Collocating {0} and {1} into {2}'.format(', '.join(slaveFiles), masterFile, targetFile)
+
+        # mostly I/O, the regridding is cheap next to it
+        with Utilities.netcdfLock:
+            master = cdf.Dataset(masterFile, 'r')
+            target = cdf.Dataset(targetFile, 'w')
+            try:
+                masterLat, masterLon = self.coordinates(master)
+
+                # master variables are copied as they are
+                for name, dimension in master.dimensions.items():
+                    target.createDimension(name, None if dimension.isunlimited() else len(dimension))
+                for name, variable in master.variables.items():
+                    attributes = dict((key, variable.getncattr(key)) for key in variable.ncattrs())
+                    fill = attributes.pop('_FillValue', None)
+                    copy = target.createVariable(name, variable.dtype, variable.dimensions, fill_value=fill)
+                    copy.setncatts(attributes)
+                    variable.set_auto_maskandscale(False)
+                    copy.set_auto_maskandscale(False)
+                    copy[:] = variable[:]
+
+                # slave fields (single time step) are resampled onto the master
+                # grid and keep their original names, like ${ORIGINAL_NAME} in SNAP
+                dimensions = master[masterLat].dimensions + master[masterLon].dimensions
+                for slaveFile in slaveFiles:
+                    slave = cdf.Dataset(slaveFile, 'r')
+                    try:
+                        slaveLat, slaveLon = self.coordinates(slave)
+                        regridder = Regridder.cached(slave[slaveLat][:], slave[slaveLon][:], master[masterLat][:], master[masterLon][:], self.weightsDirectory, self.weights)
+                        for name, variable in slave.variables.items():
+                            if name in (slaveLat, slaveLon) or variable.ndim < 2 or name in target.variables:
+                                continue
+                            if variable.dimensions[-2:] != slave[slaveLat].dimensions + slave[slaveLon].dimensions:
+                                continue
+                            if any(n != 1 for n in variable.shape[:-2]):
+                                continue
+                            values = regridder.regrid(variable[:].reshape(variable.shape[-2:]))
+                            resampled = target.createVariable(name, 'f4', dimensions, fill_value=np.nan)
+                            resampled.setncatts(dict((key, variable.getncattr(key)) for key in variable.ncattrs() if key not in ('_FillValue', 'missing_value', 'scale_factor', 'add_offset', 'valid_min', 'valid_max', 'valid_range')))
+                            resampled[:] = np.ma.masked_invalid(values)
+                    finally:
+                        slave.close()
+            finally:
+                master.close()
+                target.close()
+
+        if verbose is True:
+            print 'Collocation successful.'
+        return targetFile
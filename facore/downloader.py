@@ -2,14 +2,64 @@ import argparse
 import subprocess
 import signal
 import os
+import re
 import sys
+import time
+import random
+import tempfile
+import threading
 import datetime as dt
+from urlparse import urlparse
+from multiprocessing.pool import ThreadPool
+
+class Attempt:
+    def __init__(self, returncode, duration, output, status):
+        self.returncode = returncode
+        self.duration = duration
+        self.output = output
+        # 'ok', 'retryable', 'fatal' or 'timeout'
+        self.status = status
+
+class DownloadResult:
+    '''
+    Outcome of one Downloader.download call with every attempt it made.
+    Evaluates to True when the file was downloaded (or already existed).
+    '''
+    def __init__(self, parameter, date, file):
+        self.parameter = parameter
+        self.date = date
+        self.file = file
+        self.attempts = []
+        self.success = False
+        self.skipped = False
+
+    def __nonzero__(self):
+        return self.success
+
+    @property
+    def status(self):
+        if self.success:
+            return 'skipped' if self.skipped else 'ok'
+        return self.attempts[-1].status if self.attempts else 'failed'
 
 class Downloader:
-    def __init__(self, motupath, username, password):
+    # motu client messages that no retry can fix
+    fatalErrors = [r'\b40[134]\b', r'unauthori[sz]ed', r'authentication', r'no such file or directory', r'usage:', r'invalid', r'out of bounds', r'unknown (product|service|variable)']
+
+    def __init__(self, motupath, username, password, timeout=900, tries=3, backoff=30, maxBackoff=600, perHost=2):
         self.motuPath = motupath
         self.username = username
         self.password = password
+        # per attempt timeout and exponential backoff between attempts, in seconds
+        self.timeout = timeout
+        self.tries = tries
+        self.backoff = backoff
+        self.maxBackoff = maxBackoff
+        # requests at a time to each server, across downloadAll calls and
+        # the threads making them
+        self.perHost = perHost
+        self.limits = {}
+        self.lock = threading.Lock()
         self.urls = {'CHL': 'http://cmems-oc.isac.cnr.it/motu-web/Motu', 'SST': 'http://cmems.isac.cnr.it/mis-gateway-servlet/Motu', 'SLA': 'http://motu.sltac.cls.fr/motu-web/Motu'}
         self.services = {'CHL': 'OCEANCOLOUR_MED_CHL_L4_NRT_OBSERVATIONS_009_041-TDS', 'SST': 'SST_MED_SST_L4_NRT_OBSERVATIONS_010_004-TDS', 'SLA': 'SEALEVEL_MED_PHY_L4_NRT_OBSERVATIONS_008_050-TDS'}
         self.products = {'CHL': 'dataset-oc-med-chl-multi-l4-interp_1km_daily-rt-v02', 'SST': 'SST_MED_SST_L4_NRT_OBSERVATIONS_010_004_c_V2', 'SLA': 'dataset-duacs-nrt-medsea-merged-allsat-phy-l4-v3'}
@@ -20,38 +70,125 @@ class Downloader:
         variables = ''
         for v in self.variables[parameter]:
             variables += '-v {0} '.format(v)
-        cmd = 'python {0} -u {1} -p {2} -m {3} -s {4} -d {5} {6} -t "{7}" -T "{8}" {9} -o {10} -f {11}'.format(self.motuPath, self.username, self.password, self.urls[parameter], self.services[parameter], self.products[parameter], self.geo[parameter], date, date, variables, directory, filename)
+        cmd = '{0} {1} -u {2} -p {3} -m {4} -s {5} -d {6} {7} -t "{8}" -T "{9}" {10} -o {11} -f {12}'.format(sys.executable, self.motuPath, self.username, self.password, self.urls[parameter], self.services[parameter], self.products[parameter], self.geo[parameter], date, date, variables, directory, filename)
         return cmd
 
+    def classify(self, returncode, output):
+        if returncode == 0:
+            return 'ok'
+        for pattern in self.fatalErrors:
+            if re.search(pattern, output, re.IGNORECASE):
+                return 'fatal'
+        return 'retryable'
+
+    def _attempt(self, cmd):
+        # Output goes to a temporary file rather than a pipe, so a chatty
+        # client cannot block on a full pipe while we poll for the timeout.
+        # The client runs in its own process group so that a timeout kills
+        # the python process and not only the shell, and without our file
+        # descriptors: a NetCDF file another stage is writing would stay
+        # locked by HDF5 while the client runs.
+        killed = False
+        with tempfile.TemporaryFile() as output:
+            start = time.time()
+            p = subprocess.Popen(cmd, shell=True, stdout=output, stderr=subprocess.STDOUT, preexec_fn=os.setsid, close_fds=True)
+            while p.poll() is None:
+                if self.timeout is not None and time.time() - start > self.timeout:
+                    os.killpg(p.pid, signal.SIGKILL)
+                    p.wait()
+                    killed = True
+                    break
+                time.sleep(0.1)
+            duration = time.time() - start
+            output.seek(0)
+            text = output.read()
+        if killed:
+            return Attempt(p.returncode, duration, text, 'timeout')
+        return Attempt(p.returncode, duration, text, self.classify(p.returncode, text))
+
     def download(self, directory, filename, parameter, date, verbose=False, force_copy=False):
         if not os.path.exists(directory):
             os.makedirs(directory)
 
-        if os.path.isfile('{0}/{1}'.format(directory, filename)) and not force_copy:
+        file = os.path.join(directory, filename)
+        result = DownloadResult(parameter, date, file)
+        if os.path.isfile(file) and not force_copy:
             if verbose:
                 print '{0} has already been downloaded. Skipping...'.format(parameter)
-            return True;
-        
-        cmd = self._prepareCmd(directory, filename, parameter, date)
-        
+            result.success = result.skipped = True
+            return result
+
+        # download to a part file, an interrupted transfer must not look like a finished one
+        part = '_part_{0}'.format(filename)
+        cmd = self._prepareCmd(directory, part, parameter, date)
+
         if verbose is True:
             print 'Downloading {0}...'.format(parameter)
-        
-        tries = 0
-        while True:
-            p = subprocess.Popen(cmd, shell=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-            returncode = p.wait()
-            if returncode == 0:
+
+        for tries in range(1, self.tries + 1):
+            attempt = self._attempt(cmd)
+            result.attempts.append(attempt)
+            if attempt.status == 'ok' and os.path.isfile(os.path.join(directory, part)):
+                os.rename(os.path.join(directory, part), file)
+                result.success = True
                 if verbose is True:
                     print '{0} downloaded successfully'.format(parameter)
-                return True 
-            if returncode == 1:
-                tries += 1
-                if tries == 3:
-                    if verbose is True:
-                        print '{0} is not available'.format(parameter)
-                    return False
+                return result
+            if os.path.isfile(os.path.join(directory, part)):
+                os.remove(os.path.join(directory, part))
+            if attempt.status == 'fatal' or tries == self.tries:
+                break
+            # exponential backoff with full jitter
+            delay = random.uniform(0, min(self.maxBackoff, self.backoff * 2 ** (tries - 1)))
+            if verbose is True:
+                print '{0} attempt {1} failed ({2}), retrying in {3:.0f}s'.format(parameter, tries, attempt.status, delay)
+            time.sleep(delay)
 
+        if verbose is True:
+            print '{0} is not available ({1})'.format(parameter, result.status)
+        return result
+
+    def host(self, parameter):
+        return urlparse(self.urls[parameter]).netloc
+
+    def limit(self, parameter):
+        # semaphore of the parameter's server
+        host = self.host(parameter)
+        with self.lock:
+            if host not in self.limits:
+                self.limits[host] = threading.BoundedSemaphore(self.perHost)
+            return self.limits[host]
+
+    def downloadAll(self, jobs, workers=6, verbose=False, force_copy=False):
+        # Download several (directory, filename, parameter, date) jobs in
+        # parallel. The parameters come from different CMEMS servers, so the
+        # wall time becomes the slowest server instead of the sum of them,
+        # while each server gets at most perHost requests at a time, counting
+        # those of concurrent calls.
+        jobs = list(jobs)
+
+        def fetch(job):
+            directory, filename, parameter, date = job
+            with self.limit(parameter):
+                return self.download(directory, filename, parameter, date, verbose, force_copy)
+
+        if len(jobs) == 0:
+            return {}
+        pool = ThreadPool(min(workers, len(jobs)))
+        try:
+            results = pool.map(fetch, jobs)
+        finally:
+            pool.close()
+            pool.join()
+
+        # results keyed by (parameter, date)
+        results = dict(((parameter, str(date)), result) for (directory, filename, parameter, date), result in zip(jobs, results))
+        if verbose is True:
+            failed = sorted(key for key, result in results.items() if not result)
+            print 'Downloaded {0} of {1} products.'.format(len(results) - len(failed), len(results))
+            for parameter, date in failed:
+                print '{0} for {1} is not available ({2})'.format(parameter, date, results[(parameter, date)].status)
+        return results
 
 if __name__ == '__main__':
     parser = argparse.ArgumentParser(description='Download SST, SLA and CHL L4 daily data for Mediterranean Sea.')
@@ -60,9 +197,11 @@ if __name__ == '__main__':
     parser.add_argument('-u', '--username', help='CMEMS username')
     parser.add_argument('-x', '--password', help='CMEMS password')
     parser.add_argument('-p', '--parameters', choices=['ALL', 'CHL', 'SST', 'SLA'], default='ALL', help='the param to download')
-    parser.add_argument('-d', '--date', default='today', help='a date or range of dates')
+    parser.add_argument('--date', default='today', help='a date or range of dates')
     parser.add_argument("-v", "--verbose", help="enable verbose mode", action="store_true")
     parser.add_argument("-f", "--force-copy", help="force copy if file exists", action="store_true")
+    parser.add_argument('--timeout', type=int, default=900, help='seconds before an attempt is killed')
+    parser.add_argument('--tries', type=int, default=3, help='attempts per product')
     args = parser.parse_args()
 
     if not os.path.exists(args.directory):
@@ -84,15 +223,10 @@ if __name__ == '__main__':
     if args.force_copy:
         force_copy = True
 
-    downloader = Downloader(args.motupath, args.username, args.password)
-
-    if args.parameters == 'CHL':
-        downloader.download(args.directory, 'CHL.nc', 'CHL', date, verbose, force_copy)
-    elif args.parameters == 'SST':
-        downloader.download(args.directory, 'SST.nc', 'SST', date, verbose, force_copy)
-    elif args.parameters == 'SLA':
-        downloader.download(args.directory, 'SLA.nc', 'SLA', date, verbose, force_copy)
-    elif args.parameters == 'ALL':
-        downloader.download(args.directory, 'CHL.nc', 'CHL', date, verbose, force_copy)
-        downloader.download(args.directory, 'SST.nc', 'SST', date, verbose, force_copy)
-        downloader.download(args.directory, 'SLA.nc', 'SLA', date, verbose, force_copy)
\ No newline at end of file
+    downloader = Downloader(args.motupath, args.username, args.password, args.timeout, args.tries)
+
+    if args.parameters == 'ALL':
+        parameters = ['CHL', 'SST', 'SLA']
+    else:
+        parameters = [args.parameters]
+    downloader.downloadAll([(args.directory, '{0}.nc'.format(p), p, date) for p in parameters], verbose=verbose, force_copy=force_copy)
@@ -2,579 +2,562 @@ from __future__ import division
 import os
 import sys
 import argparse
+import math
+import time
+import operator
+import shutil
+import tempfile
+import threading
+import multiprocessing
+from multiprocessing.sharedctypes import RawArray
 import netCDF4 as cdf
 import numpy as np
-import matplotlib.pyplot as plt
-import skfuzzy as fuzz
-from skfuzzy import control as control
 from enum import Enum
-
-Fishery = {
-    'Anchovy': {
-        'Seasons': ['Summer', 'Early Autumn', 'Late Autumn', 'Winter'],
-        'Output File': 'Anchovy.nc'
-    },
-    'Sardine': {
-        'Seasons': ['June', 'September', 'December'],
-        'Output File': 'Sardine.nc'
-    }
-}
+from bathymetry import Bathymetry
+from inference import Inference
+from lookup import LookupTable
+from memo import Memo, Precision, quantize
+from metrics import Metrics
+from profiler import Profiler
+from rulecache import CompiledRules, RuleCache
+from ruletable import RuleTable, RULES_DIRECTORY
+from utilities import Utilities
+
+# State of the worker processes of a parallel run. The packed input and
+# output vectors are shared memory inherited from the parent, only the
+# block ranges are sent.
+_worker = {}
+
+def _initWorker(engine, inputs, output):
+    _worker['engine'] = engine
+    _worker['inputs'] = { param:np.frombuffer(array, dtype=np.float64) for param, array in inputs.items() }
+    _worker['output'] = np.frombuffer(output, dtype=np.float64)
+
+def _computeBlock(block):
+    start, stop = block
+    inputs = { param:value[start:stop] for param, value in _worker['inputs'].items() }
+    _worker['output'][start:stop] = _worker['engine'].compute(inputs)
+    return block
+
+def _skfuzzy():
+    # skfuzzy.control pulls in matplotlib and networkx, close to a second of
+    # startup, and is only needed by the skfuzzy backend and the plots
+    import skfuzzy as fuzz
+    import skfuzzy.control
+    return fuzz
+
+# Variables of the collocated file holding each parameter
+Variables = {'chl': 'CHL', 'sst': 'analysed_sst', 'sla': 'sla', 'depth': 'bathymetry'}
 
 class Fuzzifier:
-    def __init__(self, file):
+    # Rule tables, and the rule bases compiled from them shared by all
+    # instances of the process
+    rulesDirectory = RULES_DIRECTORY
+    ruleCache = RuleCache()
+    # pixels evaluated at once when streaming
+    blockPixels = 1 << 20
+    # Memoization of the engines on quantized input tuples (see Memo), off
+    # when memoCapacity is 0; memos are kept per rule base for the process
+    memoCapacity = 0
+    memoPrecision = None
+    memos = {}
+    memoLock = threading.Lock()
+    # Lookup tables of the process by directory, rule base and resolution,
+    # with the signature of the rules they were built from: a 4-D table is
+    # hundreds of MB and too slow to read from disk for every date
+    lookupTables = {}
+    lookupLock = threading.Lock()
+    # Encoding of the output variable: zlib level (0 for none), byte shuffle,
+    # chunk shape (None for the library default, or the blocks when
+    # streaming) and 'float32' or 'uint8' (whole percent, 255 for no data)
+    outputFormat = {'complevel': 4, 'shuffle': True, 'chunksizes': None, 'encoding': 'float32'}
+
+    def __init__(self, file=None, maskFile=None, stream=False, bathymetry=None):
         self.file = file
-        self.setData(file)
-
-    def setData(self, file):
+        if file is not None:
+            self.setData(file, maskFile, stream, bathymetry)
+
+    def setData(self, file, maskFile=None, stream=False, bathymetry=None):
+        # In stream mode only the grid is read here, the parameters are read
+        # block by block in runStreaming. With a shared Bathymetry of the
+        # same grid (the same lat and lon axes), the depth and the ocean mask
+        # are its memory-mapped arrays, otherwise the file's own are used.
+        self.file = file
+        self.maskFile = maskFile
         self.data = {}
-        data = cdf.Dataset(file, 'r+')
-        self.data['lon'] = data['lon'][:]
-        self.data['lat'] = data['lat'][:]
-        self.data['chl'] = data['CHL'][:, :]
-        self.data['sst'] = data['analysed_sst'][:, :]
-        self.data['sla'] = data['sla'][:, :]
-        self.data['depth'] = data['bathymetry'][:, :]
-        self.X = len(self.data['lat'])
-        self.Y = len(self.data['lon'])
-        self.PixelCount = self.X * self.Y
-        data.close()
+        with Utilities.netcdfLock:
+            data = cdf.Dataset(file, 'r')
+            self.data['lon'] = data['lon'][:]
+            self.data['lat'] = data['lat'][:]
+            # kept for the outputs, which only need the grid
+            self.coordinates = [(name, data[name].datatype, data[name].dimensions, dict((k, data[name].getncattr(k)) for k in data[name].ncattrs())) for name in ('lat', 'lon')]
+            self.X = len(self.data['lat'])
+            self.Y = len(self.data['lon'])
+            self.PixelCount = self.X * self.Y
+            self.bathymetry = bathymetry if bathymetry is not None and bathymetry.matches(self.data['lat'], self.data['lon']) else None
+            # pixels given to the inference since the data were set, for metrics
+            self.pixels = 0
+            # what the current results were computed with (see _provenance)
+            self.provenance = None
+            if not stream:
+                for param, name in Variables.items():
+                    if param == 'depth' and self.bathymetry is not None:
+                        self.data[param] = self.bathymetry.depth
+                    else:
+                        self.data[param] = data[name][:, :]
+            data.close()
+        if not stream:
+            self.setOceanMask(maskFile)
+
+    def setOceanMask(self, maskFile=None):
+        # Pixels with bathymetry, i.e. not land. The mask only depends on the
+        # bathymetry grid, so it can be saved next to bathymetry.nc and reused
+        # for every date.
+        self.ocean = None
+        if self.bathymetry is not None:
+            self.ocean = self.bathymetry.ocean
+        elif maskFile is not None and os.path.isfile(maskFile):
+            ocean = np.load(maskFile)
+            if ocean.shape == (self.X, self.Y):
+                self.ocean = ocean
+        if self.ocean is None:
+            self.ocean = ~np.ma.getmaskarray(self.data['depth']) & ~np.isnan(np.ma.getdata(self.data['depth']))
+            if maskFile is not None:
+                # concurrent runs may be saving the same mask
+                with Utilities.atomicWrite(maskFile) as f:
+                    np.save(f, self.ocean)
+        self.oceanIndices = {}
+
+    def oceanIndex(self, parameters):
+        # Flat indices of the ocean pixels where all the parameters have data,
+        # computed once per set of parameters
+        key = tuple(sorted(parameters))
+        if key not in self.oceanIndices:
+            index = np.flatnonzero(self.ocean)
+            valid = np.ones(len(index), dtype=bool)
+            for param in key:
+                values = self.data[param].ravel()[index]
+                valid &= ~np.ma.getmaskarray(values) & ~np.isnan(np.ma.getdata(values))
+            self.oceanIndices[key] = index[valid]
+        return self.oceanIndices[key]
+
+    def _packInputs(self, index):
+        return { param:np.ma.getdata(self.data[param]).ravel()[index].astype(np.float64) for param in self.usedParameters }
+
+    def setOutputFormat(self, complevel=4, shuffle=True, chunksizes=None, encoding='float32'):
+        if encoding not in ('float32', 'uint8'):
+            raise ValueError('Unknown output encoding {0}'.format(encoding))
+        self.outputFormat = {'complevel': complevel, 'shuffle': shuffle, 'chunksizes': chunksizes, 'encoding': encoding}
+
+    def _scatterResults(self, index, values):
+        self.results = np.full((self.X, self.Y), -999.)
+        self.results.flat[index] = np.where(np.isnan(values), -999, values)
 
     def setFuzzyRules(self, season, fishery):
+        # Build the skfuzzy rule base from the rule table: one rule per
+        # consequent term, OR-ing the AND-ed combinations of antecedent terms
+        fuzz = _skfuzzy()
+        table = RuleTable.load(RuleTable.filename(fishery, season, Fuzzifier.rulesDirectory), fishery, season)
         self.season = season
         self.fishery = fishery
-        self.usedParameters = []
+        self.usedParameters = list(table.inputs)
+        self.outputParameter = table.output.name
         self.antecedents = {}
-        self.consequent = None
+        for name, variable in table.inputs.items():
+            self.antecedents[name] = fuzz.control.Antecedent(variable.universe, name)
+            for term, abcd in variable.terms.items():
+                self.antecedents[name][term] = fuzz.trapmf(variable.universe, abcd)
+        self.consequent = fuzz.control.Consequent(table.output.universe, self.outputParameter)
+        for term, abcd in table.output.terms.items():
+            self.consequent[term] = fuzz.trapmf(table.output.universe, abcd)
         self.rules = list()
-        if fishery == 'Anchovy':
-            self.outputParameter = 'anchovy'
-            self.consequent = fuzz.control.Consequent(np.linspace(0, 100, 10), self.outputParameter)
-            self.consequent['low'] = fuzz.trapmf(self.consequent.universe, [0, 0, 20, 30])
-            self.consequent['medium'] = fuzz.trapmf(self.consequent.universe, [20, 30, 50, 60])
-            self.consequent['high'] = fuzz.trapmf(self.consequent.universe, [50, 60, 80, 90])
-            self.consequent['extreme'] = fuzz.trapmf(self.consequent.universe, [80, 90, 100, 100])
-            if season == 'Summer':
-                self.usedParameters = ['depth', 'sst', 'sla']
-                
-                self.antecedents['depth'] = fuzz.control.Antecedent(np.linspace(-5000, 0, 100), 'depth')
-                self.antecedents['sst'] = fuzz.control.Antecedent(np.linspace(273, 310, 37), 'sst')
-                self.antecedents['sla'] = fuzz.control.Antecedent(np.linspace(-1, 1, 20), 'sla')
-                
-                self.antecedents['depth']['deep'] = fuzz.trapmf(self.antecedents['depth'].universe, [-5000, -5000, -200, -100])
-                self.antecedents['depth']['ideal'] = fuzz.trapmf(self.antecedents['depth'].universe, [-200, -100, 0, 0])
-
-                self.antecedents['sst']['low'] = fuzz.trapmf(self.antecedents['sst'].universe, [273, 273, 285, 290])
-                self.antecedents['sst']['ideal_1'] = fuzz.trapmf(self.antecedents['sst'].universe, [285, 290, 295, 297])
-                self.antecedents['sst']['ideal_2'] = fuzz.trapmf(self.antecedents['sst'].universe, [295, 297, 298, 300])
-                self.antecedents['sst']['high'] = fuzz.trapmf(self.antecedents['sst'].universe, [298, 300, 310, 310])
-
-                self.antecedents['sla']['low'] = fuzz.trapmf(self.antecedents['sla'].universe, [-1, -1, -0.14, -0.12])
-                self.antecedents['sla']['ideal_1'] = fuzz.trapmf(self.antecedents['sla'].universe, [-0.14, -0.12, -0.06, -0.04])
-                self.antecedents['sla']['ideal_2'] = fuzz.trapmf(self.antecedents['sla'].universe, [-0.08, -0.06, -0.02, 0])
-                self.antecedents['sla']['high'] = fuzz.trapmf(self.antecedents['sla'].universe, [-0.02, 0, 1, 1])
-
-                self.rules.append(fuzz.control.Rule(
-                    (self.antecedents['sla']['ideal_1'] & self.antecedents['sst']['ideal_1'] & self.antecedents['depth']['ideal']) |
-                    (self.antecedents['sla']['ideal_2'] & self.antecedents['sst']['ideal_2'] & self.antecedents['depth']['ideal'])
-                , self.consequent['extreme']))
-                self.rules.append(fuzz.control.Rule(
-                    (self.antecedents['sla']['low'] & self.antecedents['sst']['ideal_1'] & self.antecedents['depth']['ideal']) |
-                    (self.antecedents['sla']['high'] & self.antecedents['sst']['ideal_1'] & self.antecedents['depth']['ideal']) |
-                    (self.antecedents['sla']['ideal_2'] & self.antecedents['sst']['ideal_1'] & self.antecedents['depth']['ideal']) |
-                    (self.antecedents['sla']['low'] & self.antecedents['sst']['ideal_2'] & self.antecedents['depth']['ideal']) |
-                    (self.antecedents['sla']['high'] & self.antecedents['sst']['ideal_2'] & self.antecedents['depth']['ideal']) |
-                    (self.antecedents['sla']['ideal_1'] & self.antecedents['sst']['ideal_2'] & self.antecedents['depth']['ideal']) |
-                    (self.antecedents['sla']['ideal_1'] & self.antecedents['sst']['low'] & self.antecedents['depth']['ideal']) |
-                    (self.antecedents['sla']['ideal_1'] & self.antecedents['sst']['high'] & self.antecedents['depth']['ideal']) |
-                    (self.antecedents['sla']['ideal_2'] & self.antecedents['sst']['low'] & self.antecedents['depth']['ideal']) |
-                    (self.antecedents['sla']['ideal_2'] & self.antecedents['sst']['high'] & self.antecedents['depth']['ideal']) |
-                    (self.antecedents['sla']['ideal_1'] & self.antecedents['sst']['ideal_1'] & self.antecedents['depth']['deep']) |
-                    (self.antecedents['sla']['ideal_2'] & self.antecedents['sst']['ideal_2'] & self.antecedents['depth']['deep'])
-                , self.consequent['high']))
-                self.rules.append(fuzz.control.Rule(
-                    (self.antecedents['sla']['low'] & self.antecedents['sst']['low'] & self.antecedents['depth']['ideal']) |
-                    (self.antecedents['sla']['low'] & self.antecedents['sst']['high'] & self.antecedents['depth']['ideal']) |
-                    (self.antecedents['sla']['high'] & self.antecedents['sst']['low'] & self.antecedents['depth']['ideal']) |
-                    (self.antecedents['sla']['high'] & self.antecedents['sst']['high'] & self.antecedents['depth']['ideal']) |
-                    (self.antecedents['sla']['low'] & self.antecedents['sst']['ideal_1'] & self.antecedents['depth']['deep']) |
-                    (self.antecedents['sla']['high'] & self.antecedents['sst']['ideal_1'] & self.antecedents['depth']['deep']) |
-                    (self.antecedents['sla']['ideal_2'] & self.antecedents['sst']['ideal_1'] & self.antecedents['depth']['deep']) |
-                    (self.antecedents['sla']['low'] & self.antecedents['sst']['ideal_2'] & self.antecedents['depth']['deep']) |
-                    (self.antecedents['sla']['high'] & self.antecedents['sst']['ideal_2'] & self.antecedents['depth']['deep']) |
-                    (self.antecedents['sla']['ideal_1'] & self.antecedents['sst']['ideal_2'] & self.antecedents['depth']['deep']) |
-                    (self.antecedents['sla']['ideal_1'] & self.antecedents['sst']['low'] & self.antecedents['depth']['deep']) |
-                    (self.antecedents['sla']['ideal_1'] & self.antecedents['sst']['high'] & self.antecedents['depth']['deep']) |
-                    (self.antecedents['sla']['ideal_2'] & self.antecedents['sst']['low'] & self.antecedents['depth']['deep']) |
-                    (self.antecedents['sla']['ideal_2'] & self.antecedents['sst']['high'] & self.antecedents['depth']['deep'])
-                , self.consequent['medium']))
-                self.rules.append(fuzz.control.Rule(
-                    (self.antecedents['sla']['low'] & self.antecedents['sst']['low'] & self.antecedents['depth']['deep']) |
-                    (self.antecedents['sla']['low'] & self.antecedents['sst']['high'] & self.antecedents['depth']['deep']) |
-                    (self.antecedents['sla']['high'] & self.antecedents['sst']['low'] & self.antecedents['depth']['deep']) |
-                    (self.antecedents['sla']['high'] & self.antecedents['sst']['high'] & self.antecedents['depth']['deep'])    
-                , self.consequent['low']))
-            elif season == 'Early Autumn':
-                self.usedParameters = ['depth', 'sla', 'chl']
-
-                self.antecedents['depth'] = fuzz.control.Antecedent(np.linspace(-5000, 0, 100), 'depth')
-                self.antecedents['sla'] = fuzz.control.Antecedent(np.linspace(-1, 1, 20), 'sla')
-                self.antecedents['chl'] = fuzz.control.Antecedent(np.linspace(0, 30, 30), 'chl')
-
-                self.antecedents['depth']['deep'] = fuzz.trapmf(self.antecedents['depth'].universe, [-5000, -5000, -360, -180])
-                self.antecedents['depth']['ideal'] = fuzz.trapmf(self.antecedents['depth'].universe, [-360, -180, 0, 0])
-
-                self.antecedents['sla']['low'] = fuzz.trapmf(self.antecedents['sla'].universe, [-1, -1, 0.03, 0.05])
-                self.antecedents['sla']['ideal'] = fuzz.trapmf(self.antecedents['sla'].universe, [0.03, 0.05, 0.12, 0.14])
-                self.antecedents['sla']['high'] = fuzz.trapmf(self.antecedents['sla'].universe, [0.12, 0.14, 1, 1])
-
-                self.antecedents['chl']['low'] = fuzz.trapmf(self.antecedents['chl'].universe, [0, 0, 0.4, 0.5])
-                self.antecedents['chl']['ideal'] = fuzz.trapmf(self.antecedents['chl'].universe, [0.4, 0.5, 7.4, 7.5])
-                self.antecedents['chl']['high'] = fuzz.trapmf(self.antecedents['chl'].universe, [7.4, 7.5, 30, 30])
-
-                self.rules.append(fuzz.control.Rule(
-                    (self.antecedents['chl']['ideal'] & self.antecedents['sla']['ideal'] & self.antecedents['depth']['ideal'])
-                , self.consequent['extreme']))
-                self.rules.append(fuzz.control.Rule(
-                    (self.antecedents['chl']['low'] & self.antecedents['sla']['ideal'] & self.antecedents['depth']['ideal']) |
-                    (self.antecedents['chl']['high'] & self.antecedents['sla']['ideal'] & self.antecedents['depth']['ideal']) |
-                    (self.antecedents['chl']['ideal'] & self.antecedents['sla']['high'] & self.antecedents['depth']['ideal']) |
-                    (self.antecedents['chl']['ideal'] & self.antecedents['sla']['low'] & self.antecedents['depth']['ideal']) |
-                    (self.antecedents['chl']['ideal'] & self.antecedents['sla']['ideal'] & self.antecedents['depth']['deep'])
-                , self.consequent['high']))
-                self.rules.append(fuzz.control.Rule(
-                    (self.antecedents['chl']['low'] & self.antecedents['sla']['low'] & self.antecedents['depth']['ideal']) |
-                    (self.antecedents['chl']['low'] & self.antecedents['sla']['high'] & self.antecedents['depth']['ideal']) |
-                    (self.antecedents['chl']['high'] & self.antecedents['sla']['low'] & self.antecedents['depth']['ideal']) |
-                    (self.antecedents['chl']['high'] & self.antecedents['sla']['high'] & self.antecedents['depth']['ideal']) |
-                    (self.antecedents['chl']['low'] & self.antecedents['sla']['ideal'] & self.antecedents['depth']['deep']) |
-                    (self.antecedents['chl']['high'] & self.antecedents['sla']['ideal'] & self.antecedents['depth']['deep']) |
-                    (self.antecedents['chl']['ideal'] & self.antecedents['sla']['high'] & self.antecedents['depth']['deep']) |
-                    (self.antecedents['chl']['ideal'] & self.antecedents['sla']['low'] & self.antecedents['depth']['deep'])
-                , self.consequent['medium']))
-                self.rules.append(fuzz.control.Rule(
-                    (self.antecedents['chl']['low'] & self.antecedents['sla']['low'] & self.antecedents['depth']['deep']) |
-                    (self.antecedents['chl']['low'] & self.antecedents['sla']['high'] & self.antecedents['depth']['deep']) |
-                    (self.antecedents['chl']['high'] & self.antecedents['sla']['low'] & self.antecedents['depth']['deep']) |
-                    (self.antecedents['chl']['high'] & self.antecedents['sla']['high'] & self.antecedents['depth']['deep'])    
-                , self.consequent['low']))
-            elif season == 'Late Autumn':
-                self.usedParameters = ['depth', 'sst', 'sla', 'chl']
-                
-                self.antecedents['depth'] = fuzz.control.Antecedent(np.linspace(-5000, 0, 100), 'depth')
-                self.antecedents['sst'] = fuzz.control.Antecedent(np.linspace(273, 310, 37), 'sst')
-                self.antecedents['sla'] = fuzz.control.Antecedent(np.linspace(-1, 1, 20), 'sla')
-                self.antecedents['chl'] = fuzz.control.Antecedent(np.linspace(0, 30, 30), 'chl')
-                
-                self.antecedents['depth']['deep'] = fuzz.trapmf(self.antecedents['depth'].universe, [-5000, -5000, -300, -150])
-                self.antecedents['depth']['ideal'] = fuzz.trapmf(self.antecedents['depth'].universe, [-300, -150, 0, 0])
-
-                self.antecedents['sst']['low'] = fuzz.trapmf(self.antecedents['sst'].universe, [273, 273, 288, 290])
-                self.antecedents['sst']['ideal'] = fuzz.trapmf(self.antecedents['sst'].universe, [288, 290, 292, 294])
-                self.antecedents['sst']['high'] = fuzz.trapmf(self.antecedents['sst'].universe, [292, 294, 310, 310])
-
-                self.antecedents['sla']['low'] = fuzz.trapmf(self.antecedents['sla'].universe, [-1, -1, -0.3, -0.05])
-                self.antecedents['sla']['ideal'] = fuzz.trapmf(self.antecedents['sla'].universe, [-0.03, -0.05, 0.05, 0.07])
-                self.antecedents['sla']['high'] = fuzz.trapmf(self.antecedents['sla'].universe, [0.05, 0.07, 1, 1])
-
-                self.antecedents['chl']['low'] = fuzz.trapmf(self.antecedents['chl'].universe, [0, 0, 0.26, 0.36])
-                self.antecedents['chl']['ideal'] = fuzz.trapmf(self.antecedents['chl'].universe, [0.26, 0.36, 2, 2.1])
-                self.antecedents['chl']['high'] = fuzz.trapmf(self.antecedents['chl'].universe, [2, 2.1, 30, 30])
-
-                self.rules.append(fuzz.control.Rule(
-                    (self.antecedents['chl']['ideal'] & self.antecedents['sst']['ideal'] & self.antecedents['sla']['ideal'] & self.antecedents['depth']['ideal'])
-                    , self.consequent['extreme']))
-                self.rules.append(fuzz.control.Rule(
-                    (self.antecedents['chl']['low'] & self.antecedents['sst']['ideal'] & self.antecedents['sla']['ideal'] & self.antecedents['depth']['ideal']) |
-                    (self.antecedents['chl']['high'] & self.antecedents['sst']['ideal'] & self.antecedents['sla']['ideal'] & self.antecedents['depth']['ideal']) |
-                    (self.antecedents['chl']['ideal'] & self.antecedents['sst']['low'] & self.antecedents['sla']['ideal'] & self.antecedents['depth']['ideal']) |
-                    (self.antecedents['chl']['ideal'] & self.antecedents['sst']['high'] & self.antecedents['sla']['ideal'] & self.antecedents['depth']['ideal']) |
-                    (self.antecedents['chl']['ideal'] & self.antecedents['sst']['ideal'] & self.antecedents['sla']['low'] & self.antecedents['depth']['ideal']) |
-                    (self.antecedents['chl']['ideal'] & self.antecedents['sst']['ideal'] & self.antecedents['sla']['high'] & self.antecedents['depth']['ideal']) |
-                    (self.antecedents['chl']['ideal'] & self.antecedents['sst']['ideal'] & self.antecedents['sla']['ideal'] & self.antecedents['depth']['deep'])
-                    , self.consequent['high']))
-                self.rules.append(fuzz.control.Rule(
-                    (self.antecedents['chl']['low'] & self.antecedents['sst']['low'] & self.antecedents['sla']['ideal'] & self.antecedents['depth']['ideal']) |
-                    (self.antecedents['chl']['low'] & self.antecedents['sst']['high'] & self.antecedents['sla']['ideal'] & self.antecedents['depth']['ideal']) |
-                    (self.antecedents['chl']['low'] & self.antecedents['sst']['ideal'] & self.antecedents['sla']['low'] & self.antecedents['depth']['ideal']) |
-                    (self.antecedents['chl']['low'] & self.antecedents['sst']['ideal'] & self.antecedents['sla']['high'] & self.antecedents['depth']['ideal']) |
-                    (self.antecedents['chl']['high'] & self.antecedents['sst']['low'] & self.antecedents['sla']['ideal'] & self.antecedents['depth']['ideal']) |
-                    (self.antecedents['chl']['high'] & self.antecedents['sst']['high'] & self.antecedents['sla']['ideal'] & self.antecedents['depth']['ideal']) |
-                    (self.antecedents['chl']['high'] & self.antecedents['sst']['ideal'] & self.antecedents['sla']['low'] & self.antecedents['depth']['ideal']) |
-                    (self.antecedents['chl']['high'] & self.antecedents['sst']['ideal'] & self.antecedents['sla']['high'] & self.antecedents['depth']['ideal']) |
-                    (self.antecedents['chl']['ideal'] & self.antecedents['sst']['low'] & self.antecedents['sla']['low'] & self.antecedents['depth']['ideal']) |
-                    (self.antecedents['chl']['ideal'] & self.antecedents['sst']['low'] & self.antecedents['sla']['high'] & self.antecedents['depth']['ideal']) |
-                    (self.antecedents['chl']['ideal'] & self.antecedents['sst']['high'] & self.antecedents['sla']['low'] & self.antecedents['depth']['ideal']) |
-                    (self.antecedents['chl']['ideal'] & self.antecedents['sst']['high'] & self.antecedents['sla']['high'] & self.antecedents['depth']['ideal']) |
-                    (self.antecedents['chl']['low'] & self.antecedents['sst']['ideal'] & self.antecedents['sla']['ideal'] & self.antecedents['depth']['deep']) |
-                    (self.antecedents['chl']['high'] & self.antecedents['sst']['ideal'] & self.antecedents['sla']['ideal'] & self.antecedents['depth']['deep']) |
-                    (self.antecedents['chl']['ideal'] & self.antecedents['sst']['low'] & self.antecedents['sla']['ideal'] & self.antecedents['depth']['deep']) |
-                    (self.antecedents['chl']['ideal'] & self.antecedents['sst']['high'] & self.antecedents['sla']['ideal'] & self.antecedents['depth']['deep']) |
-                    (self.antecedents['chl']['ideal'] & self.antecedents['sst']['ideal'] & self.antecedents['sla']['low'] & self.antecedents['depth']['deep']) |
-                    (self.antecedents['chl']['ideal'] & self.antecedents['sst']['ideal'] & self.antecedents['sla']['high'] & self.antecedents['depth']['deep'])
-                    , self.consequent['medium']))
-                self.ruls.append(fuzz.control.Rule(
-                    (self.antecedents['chl']['low'] & self.antecedents['sst']['low'] & self.antecedents['sla']['low'] & self.antecedents['depth']['ideal']) |
-                    (self.antecedents['chl']['low'] & self.antecedents['sst']['low'] & self.antecedents['sla']['high'] & self.antecedents['depth']['ideal']) |
-                    (self.antecedents['chl']['low'] & self.antecedents['sst']['high'] & self.antecedents['sla']['low'] & self.antecedents['depth']['ideal']) |
-                    (self.antecedents['chl']['low'] & self.antecedents['sst']['high'] & self.antecedents['sla']['high'] & self.antecedents['depth']['ideal']) |
-                    (self.antecedents['chl']['high'] & self.antecedents['sst']['low'] & self.antecedents['sla']['low'] & self.antecedents['depth']['ideal']) |
-                    (self.antecedents['chl']['high'] & self.antecedents['sst']['low'] & self.antecedents['sla']['high'] & self.antecedents['depth']['ideal']) |
-                    (self.antecedents['chl']['high'] & self.antecedents['sst']['high'] & self.antecedents['sla']['low'] & self.antecedents['depth']['ideal']) |
-                    (self.antecedents['chl']['high'] & self.antecedents['sst']['high'] & self.antecedents['sla']['high'] & self.antecedents['depth']['ideal']) |
-                    (self.antecedents['chl']['low'] & self.antecedents['sst']['low'] & self.antecedents['sla']['ideal'] & self.antecedents['depth']['deep']) |
-                    (self.antecedents['chl']['low'] & self.antecedents['sst']['high'] & self.antecedents['sla']['ideal'] & self.antecedents['depth']['deep']) |
-                    (self.antecedents['chl']['low'] & self.antecedents['sst']['ideal'] & self.antecedents['sla']['low'] & self.antecedents['depth']['deep']) |
-                    (self.antecedents['chl']['low'] & self.antecedents['sst']['ideal'] & self.antecedents['sla']['high'] & self.antecedents['depth']['deep']) |
-                    (self.antecedents['chl']['high'] & self.antecedents['sst']['low'] & self.antecedents['sla']['ideal'] & self.antecedents['depth']['deep']) |
-                    (self.antecedents['chl']['high'] & self.antecedents['sst']['high'] & self.antecedents['sla']['ideal'] & self.antecedents['depth']['deep']) |
-                    (self.antecedents['chl']['high'] & self.antecedents['sst']['ideal'] & self.antecedents['sla']['low'] & self.antecedents['depth']['deep']) |
-                    (self.antecedents['chl']['high'] & self.antecedents['sst']['ideal'] & self.antecedents['sla']['high'] & self.antecedents['depth']['deep']) |
-                    (self.antecedents['chl']['ideal'] & self.antecedents['sst']['low'] & self.antecedents['sla']['low'] & self.antecedents['depth']['deep']) |
-                    (self.antecedents['chl']['ideal'] & self.antecedents['sst']['low'] & self.antecedents['sla']['high'] & self.antecedents['depth']['deep']) |
-                    (self.antecedents['chl']['ideal'] & self.antecedents['sst']['high'] & self.antecedents['sla']['low'] & self.antecedents['depth']['deep']) |
-                    (self.antecedents['chl']['ideal'] & self.antecedents['sst']['high'] & self.antecedents['sla']['high'] & self.antecedents['depth']['deep'])
-                    , self.consequent['low']))
-            elif season == 'Winter':
-                self.usedParameters = ['depth', 'sst', 'chl']
-                
-                self.antecedents['depth'] = fuzz.control.Antecedent(np.linspace(-5000, 0, 100), 'depth')
-                self.antecedents['sst'] = fuzz.control.Antecedent(np.linspace(273, 310, 37), 'sst')
-                self.antecedents['chl'] = fuzz.control.Antecedent(np.linspace(0, 30, 30), 'chl')
-                
-                self.antecedents['depth']['deep'] = fuzz.trapmf(self.antecedents['depth'].universe, [-5000, -5000, -120, -60])
-                self.antecedents['depth']['ideal'] = fuzz.trapmf(self.antecedents['depth'].universe, [-120, -60, 0, 0])
-
-                self.antecedents['sst']['low'] = fuzz.trapmf(self.antecedents['sst'].universe, [273, 273, 279, 281])
-                self.antecedents['sst']['ideal'] = fuzz.trapmf(self.antecedents['sst'].universe, [279, 281, 287, 289])
-                self.antecedents['sst']['high'] = fuzz.trapmf(self.antecedents['sst'].universe, [287, 289, 310, 310])
-
-                self.antecedents['chl']['low'] = fuzz.trapmf(self.antecedents['chl'].universe, [0, 0, 0.8, 0.9])
-                self.antecedents['chl']['ideal'] = fuzz.trapmf(self.antecedents['chl'].universe, [0.8, 0.9, 5.4, 5.5])
-                self.antecedents['chl']['high'] = fuzz.trapmf(self.antecedents['chl'].universe, [5.4, 5.5, 30, 30])
-
-                self.rules.append(fuzz.control.Rule(
-                    (self.antecedents['chl']['ideal'] & self.antecedents['sst']['ideal'] & self.antecedents['depth']['ideal'])
-                , self.consequent['extreme']))
-                self.rules.append(fuzz.control.Rule(
-                    (self.antecedents['chl']['low'] & self.antecedents['sst']['ideal'] & self.antecedents['depth']['ideal']) |
-                    (self.antecedents['chl']['high'] & self.antecedents['sst']['ideal'] & self.antecedents['depth']['ideal']) |
-                    (self.antecedents['chl']['ideal'] & self.antecedents['sst']['high'] & self.antecedents['depth']['ideal']) |
-                    (self.antecedents['chl']['ideal'] & self.antecedents['sst']['low'] & self.antecedents['depth']['ideal']) |
-                    (self.antecedents['chl']['ideal'] & self.antecedents['sst']['ideal'] & self.antecedents['depth']['deep'])
-                , self.consequent['high']))
-                self.rules.append(fuzz.control.Rule(
-                    (self.antecedents['chl']['low'] & self.antecedents['sst']['low'] & self.antecedents['depth']['ideal']) |
-                    (self.antecedents['chl']['low'] & self.antecedents['sst']['high'] & self.antecedents['depth']['ideal']) |
-                    (self.antecedents['chl']['high'] & self.antecedents['sst']['low'] & self.antecedents['depth']['ideal']) |
-                    (self.antecedents['chl']['high'] & self.antecedents['sst']['high'] & self.antecedents['depth']['ideal']) |
-                    (self.antecedents['chl']['low'] & self.antecedents['sst']['ideal'] & self.antecedents['depth']['deep']) |
-                    (self.antecedents['chl']['high'] & self.antecedents['sst']['ideal'] & self.antecedents['depth']['deep']) |
-                    (self.antecedents['chl']['ideal'] & self.antecedents['sst']['high'] & self.antecedents['depth']['deep']) |
-                    (self.antecedents['chl']['ideal'] & self.antecedents['sst']['low'] & self.antecedents['depth']['deep'])
-                , self.consequent['medium']))
-                self.rules.append(fuzz.control.Rule(
-                    (self.antecedents['chl']['low'] & self.antecedents['sst']['low'] & self.antecedents['depth']['deep']) |
-                    (self.antecedents['chl']['low'] & self.antecedents['sst']['high'] & self.antecedents['depth']['deep']) |
-                    (self.antecedents['chl']['high'] & self.antecedents['sst']['low'] & self.antecedents['depth']['deep']) |
-                    (self.antecedents['chl']['high'] & self.antecedents['sst']['high'] & self.antecedents['depth']['deep'])    
-                , self.consequent['low']))
-        elif fishery == 'Sardine':
-            self.outputParameter = 'sardine'
-            self.consequent = fuzz.control.Consequent(np.linspace(0, 100, 10), self.outputParameter)
-            self.consequent['low'] = fuzz.trapmf(self.consequent.universe, [0, 0, 20, 30])
-            self.consequent['medium'] = fuzz.trapmf(self.consequent.universe, [20, 30, 50, 60])
-            self.consequent['high'] = fuzz.trapmf(self.consequent.universe, [50, 60, 80, 90])
-            self.consequent['extreme'] = fuzz.trapmf(self.consequent.universe, [80, 90, 100, 100])
-            if season == 'June':
-                self.usedParameters = ['depth', 'sst', 'sla', 'chl']
-                
-                self.antecedents['depth'] = fuzz.control.Antecedent(np.linspace(-5000, 0, 100), 'depth')
-                self.antecedents['sst'] = fuzz.control.Antecedent(np.linspace(273, 310, 37), 'sst')
-                self.antecedents['sla'] = fuzz.control.Antecedent(np.linspace(-1, 1, 20), 'sla')
-                
-                self.antecedents['depth']['deep'] = fuzz.trapmf(self.antecedents['depth'].universe, [-5000, -5000, -80, -65])
-                self.antecedents['depth']['ideal'] = fuzz.trapmf(self.antecedents['depth'].universe, [-80, -65, 0, 0])
-
-                self.antecedents['sst']['ideal'] = fuzz.trapmf(self.antecedents['sst'].universe, [273, 273, 290, 295])
-                self.antecedents['sst']['high'] = fuzz.trapmf(self.antecedents['sst'].universe, [290, 295, 310, 310])
-
-                self.antecedents['sla']['low_1'] = fuzz.trapmf(self.antecedents['sla'].universe, [-1, -1, -0.12, -0.1])
-                self.antecedents['sla']['ideal_1'] = fuzz.trapmf(self.antecedents['sla'].universe, [-0.12, -0.1, -0.04, -0.02])
-                self.antecedents['sla']['high_1'] = fuzz.trapmf(self.antecedents['sla'].universe, [-0.04, -0.02, 1, 1])
-                self.antecedents['sla']['low_2'] = fuzz.trapmf(self.antecedents['sla'].universe, [-1, -1, -0.05, -0.03])
-                self.antecedents['sla']['ideal_2'] = fuzz.trapmf(self.antecedents['sla'].universe, [-0.05, -0.03, 0, 0.02])
-                self.antecedents['sla']['high_2'] = fuzz.trapmf(self.antecedents['sla'].universe, [0.02, 0.04, 1, 1])
-
-                self.antecedents['chl']['low_1'] = fuzz.trapmf(self.antecedents['chl'].universe, [0, 0, 0.06, 0.08])
-                self.antecedents['chl']['ideal_1'] = fuzz.trapmf(self.antecedents['chl'].universe, [0.06, 0.08, 0.37,0.39])
-                self.antecedents['chl']['high_1'] = fuzz.trapmf(self.antecedents['chl'].universe, [0.37, 0.39, 30, 30])
-                self.antecedents['chl']['low_2'] = fuzz.trapmf(self.antecedents['chl'].universe, [0, 0, 0.98, 1])
-                self.antecedents['chl']['ideal_2'] = fuzz.trapmf(self.antecedents['chl'].universe, [0.98, 1, 15, 15.2])
-                self.antecedents['chl']['high_2'] = fuzz.trapmf(self.antecedents['chl'].universe, [15, 15.2, 30, 30])
-
-                self.rules.append(fuzz.control.Rule(
-                    (self.antecedents['depth']['ideal'] & self.antecedents['sst']['ideal'] & self.antecedents['sla']['ideal_1'] & self.antecedents['chl']['ideal_1']) |
-                    (self.antecedents['depth']['ideal'] & self.antecedents['sst']['ideal'] & self.antecedents['sla']['ideal_2'] & self.antecedents['chl']['ideal_2'])
-                    , self.consequent['extreme']))
-                
-                self.rules.append(fuzz.control.Rule(
-                    (self.antecedents['depth']['ideal'] & self.antecedents['sst']['ideal'] & self.antecedents['sla']['ideal_1'] & self.antecedents['chl']['low_1']) |
-                    (self.antecedents['depth']['ideal'] & self.antecedents['sst']['ideal'] & self.antecedents['sla']['ideal_1'] & self.antecedents['chl']['high_1']) |
-                    (self.antecedents['depth']['ideal'] & self.antecedents['sst']['ideal'] & self.antecedents['sla']['ideal_2'] & self.antecedents['chl']['low_2']) |
-                    (self.antecedents['depth']['ideal'] & self.antecedents['sst']['ideal'] & self.antecedents['sla']['ideal_2'] & self.antecedents['chl']['high_2']) |
-                    (self.antecedents['depth']['ideal'] & self.antecedents['sst']['ideal'] & self.antecedents['sla']['low_1'] & self.antecedents['chl']['ideal_1']) |
-                    (self.antecedents['depth']['ideal'] & self.antecedents['sst']['ideal'] & self.antecedents['sla']['high_1'] & self.antecedents['chl']['ideal_1']) |
-                    (self.antecedents['depth']['ideal'] & self.antecedents['sst']['ideal'] & self.antecedents['sla']['low_2'] & self.antecedents['chl']['ideal_2']) |
-                    (self.antecedents['depth']['ideal'] & self.antecedents['sst']['ideal'] & self.antecedents['sla']['high_2'] & self.antecedents['chl']['ideal_2']) |
-                    (self.antecedents['depth']['ideal'] & self.antecedents['sst']['high'] & self.antecedents['sla']['ideal_1'] & self.antecedents['chl']['ideal_1']) |
-                    (self.antecedents['depth']['ideal'] & self.antecedents['sst']['high'] & self.antecedents['sla']['ideal_2'] & self.antecedents['chl']['ideal_2'])
-                    , self.consequent['high']))
-
-                self.rules.append(fuzz.control.Rule(
-                    (self.antecedents['depth']['ideal'] & self.antecedents['sst']['high'] & self.antecedents['sla']['ideal_1'] & self.antecedents['chl']['low_1']) |
-                    (self.antecedents['depth']['ideal'] & self.antecedents['sst']['high'] & self.antecedents['sla']['ideal_1'] & self.antecedents['chl']['high_1']) |
-                    (self.antecedents['depth']['ideal'] & self.antecedents['sst']['high'] & self.antecedents['sla']['ideal_2'] & self.antecedents['chl']['low_2']) |
-                    (self.antecedents['depth']['ideal'] & self.antecedents['sst']['high'] & self.antecedents['sla']['ideal_2'] & self.antecedents['chl']['high_2']) |
-                    (self.antecedents['depth']['ideal'] & self.antecedents['sst']['high'] & self.antecedents['sla']['low_1'] & self.antecedents['chl']['ideal_1']) |
-                    (self.antecedents['depth']['ideal'] & self.antecedents['sst']['high'] & self.antecedents['sla']['high_1'] & self.antecedents['chl']['ideal_1']) |
-                    (self.antecedents['depth']['ideal'] & self.antecedents['sst']['high'] & self.antecedents['sla']['low_2'] & self.antecedents['chl']['ideal_2']) |
-                    (self.antecedents['depth']['ideal'] & self.antecedents['sst']['high'] & self.antecedents['sla']['high_2'] & self.antecedents['chl']['ideal_2']) |
-                    (self.antecedents['depth']['deep'] & self.antecedents['sst']['high'] & self.antecedents['sla']['ideal_1'] & self.antecedents['chl']['ideal_1']) |
-                    (self.antecedents['depth']['deep'] & self.antecedents['sst']['high'] & self.antecedents['sla']['ideal_2'] & self.antecedents['chl']['ideal_2'])
-                    , self.consequent['medium']))
-
-                self.rules.append(fuzz.control.Rule(
-                    (self.antecedents['depth']['deep'] & self.antecedents['sst']['high'] & self.antecedents['sla']['ideal_1'] & self.antecedents['chl']['low_1']) |
-                    (self.antecedents['depth']['deep'] & self.antecedents['sst']['high'] & self.antecedents['sla']['ideal_1'] & self.antecedents['chl']['high_1']) |
-                    (self.antecedents['depth']['deep'] & self.antecedents['sst']['high'] & self.antecedents['sla']['ideal_2'] & self.antecedents['chl']['low_2']) |
-                    (self.antecedents['depth']['deep'] & self.antecedents['sst']['high'] & self.antecedents['sla']['ideal_2'] & self.antecedents['chl']['high_2']) |
-                    (self.antecedents['depth']['deep'] & self.antecedents['sst']['high'] & self.antecedents['sla']['low_1'] & self.antecedents['chl']['ideal_1']) |
-                    (self.antecedents['depth']['deep'] & self.antecedents['sst']['high'] & self.antecedents['sla']['high_1'] & self.antecedents['chl']['ideal_1']) |
-                    (self.antecedents['depth']['deep'] & self.antecedents['sst']['high'] & self.antecedents['sla']['low_2'] & self.antecedents['chl']['ideal_2']) |
-                    (self.antecedents['depth']['deep'] & self.antecedents['sst']['high'] & self.antecedents['sla']['high_2'] & self.antecedents['chl']['ideal_2'])
-                    , self.consequent['low']))
-            elif season == 'September':
-                self.usedParameters = ['depth', 'sst', 'sla', 'chl']
-                
-                self.antecedents['depth'] = fuzz.control.Antecedent(np.linspace(-5000, 0, 100), 'depth')
-                self.antecedents['sst'] = fuzz.control.Antecedent(np.linspace(273, 310, 37), 'sst')
-                self.antecedents['sla'] = fuzz.control.Antecedent(np.linspace(-1, 1, 20), 'sla')
-                self.antecedents['chl'] = fuzz.control.Antecedent(np.linspace(0, 30, 30), 'chl')
-                
-                self.antecedents['depth']['deep'] = fuzz.trapmf(self.antecedents['depth'].universe, [-5000, -5000, -130, -110])
-                self.antecedents['depth']['ideal'] = fuzz.trapmf(self.antecedents['depth'].universe, [-130, -110, 0, 0])
-
-                self.antecedents['sst']['low'] = fuzz.trapmf(self.antecedents['sst'].universe, [273, 273, 291, 293])
-                self.antecedents['sst']['ideal'] = fuzz.trapmf(self.antecedents['sst'].universe, [291, 293, 299, 301])
-                self.antecedents['sst']['high'] = fuzz.trapmf(self.antecedents['sst'].universe, [299, 301, 310, 310])
-
-                self.antecedents['sla']['low'] = fuzz.trapmf(self.antecedents['sla'].universe, [-1, -1, 0, 0.02])
-                self.antecedents['sla']['ideal'] = fuzz.trapmf(self.antecedents['sla'].universe, [0, 0.02, 0.1, 0.12])
-                self.antecedents['sla']['high'] = fuzz.trapmf(self.antecedents['sla'].universe, [0.1, 0.12, 1, 1])
-
-                self.antecedents['chl']['low'] = fuzz.trapmf(self.antecedents['chl'].universe, [0, 0, 0.11, 0.13])
-                self.antecedents['chl']['ideal'] = fuzz.trapmf(self.antecedents['chl'].universe, [0.11, 0.13, 1.49, 1.51])
-                self.antecedents['chl']['high'] = fuzz.trapmf(self.antecedents['chl'].universe, [1.49, 1.51, 30, 30])
-
-                self.rules.append(fuzz.control.Rule(
-                    (self.antecedents['depth']['ideal'] & self.antecedents['sst']['ideal'] & self.antecedents['sla']['ideal'] & self.antecedents['chl']['ideal'])
-                    , self.consequent['extreme']))
-
-                self.rules.append(fuzz.control.Rule(
-                    self.antecedents['depth']['ideal'] & 
-                    ((self.antecedents['sst']['ideal'] & self.antecedents['sla']['ideal'] & self.antecedents['chl']['low']) |
-                    (self.antecedents['sst']['ideal'] & self.antecedents['sla']['ideal'] & self.antecedents['chl']['high']) |
-                    (self.antecedents['sst']['ideal'] & self.antecedents['sla']['low'] & self.antecedents['chl']['ideal']) |
-                    (self.antecedents['sst']['ideal'] & self.antecedents['sla']['high'] & self.antecedents['chl']['ideal']) |
-                    (self.antecedents['sst']['low'] & self.antecedents['sla']['ideal'] & self.antecedents['chl']['ideal']) |
-                    (self.antecedents['sst']['high'] & self.antecedents['sla']['ideal'] & self.antecedents['chl']['ideal']))
-                    , self.consequent['high']))
-
-                self.rules.append(fuzz.control.Rule(
-                    self.antecedents['depth']['ideal'] &
-                    ((self.antecedents['sst']['ideal'] & self.antecedents['sla']['low'] & self.antecedents['chl']['low']) |
-                    (self.antecedents['sst']['ideal'] & self.antecedents['sla']['high'] & self.antecedents['chl']['low']) |
-                    (self.antecedents['sst']['ideal'] & self.antecedents['sla']['low'] & self.antecedents['chl']['high']) |
-                    (self.antecedents['sst']['ideal'] & self.antecedents['sla']['high'] & self.antecedents['chl']['high']) |
-                    (self.antecedents['sst']['low'] & self.antecedents['sla']['low'] & self.antecedents['chl']['ideal']) |
-                    (self.antecedents['sst']['high'] & self.antecedents['sla']['low'] & self.antecedents['chl']['ideal']) |
-                    (self.antecedents['sst']['low'] & self.antecedents['sla']['high'] & self.antecedents['chl']['ideal']) |
-                    (self.antecedents['sst']['high'] & self.antecedents['sla']['high'] & self.antecedents['chl']['ideal']) |
-                    (self.antecedents['sst']['low'] & self.antecedents['sla']['ideal'] & self.antecedents['chl']['low']) |
-                    (self.antecedents['sst']['high'] & self.antecedents['sla']['ideal'] & self.antecedents['chl']['low']) |
-                    (self.antecedents['sst']['low'] & self.antecedents['sla']['ideal'] & self.antecedents['chl']['high']) |
-                    (self.antecedents['sst']['high'] & self.antecedents['sla']['ideal'] & self.antecedents['chl']['high']))
-                    , self.consequent['medium']))
-                self.rules.append(fuzz.control.Rule(
-                    self.antecedents['depth']['deep'] & 
-                    ((self.antecedents['sst']['ideal'] & self.antecedents['sla']['ideal'] & self.antecedents['chl']['low']) |
-                    (self.antecedents['sst']['ideal'] & self.antecedents['sla']['ideal'] & self.antecedents['chl']['high']) |
-                    (self.antecedents['sst']['ideal'] & self.antecedents['sla']['low'] & self.antecedents['chl']['ideal']) |
-                    (self.antecedents['sst']['ideal'] & self.antecedents['sla']['high'] & self.antecedents['chl']['ideal']) |
-                    (self.antecedents['sst']['low'] & self.antecedents['sla']['ideal'] & self.antecedents['chl']['ideal']) |
-                    (self.antecedents['sst']['high'] & self.antecedents['sla']['ideal'] & self.antecedents['chl']['ideal']))
-                    , self.consequent['medium']))
-
-                self.rules.append(fuzz.control.Rule(
-                    (self.antecedents['depth']['deep'] & self.antecedents['sst']['ideal'] & self.antecedents['sla']['low'] & self.antecedents['chl']['low']) |
-                    (self.antecedents['depth']['deep'] & self.antecedents['sst']['ideal'] & self.antecedents['sla']['high'] & self.antecedents['chl']['low']) |
-                    (self.antecedents['depth']['deep'] & self.antecedents['sst']['ideal'] & self.antecedents['sla']['low'] & self.antecedents['chl']['high']) |
-                    (self.antecedents['depth']['deep'] & self.antecedents['sst']['ideal'] & self.antecedents['sla']['high'] & self.antecedents['chl']['high']) |
-                    (self.antecedents['depth']['deep'] & self.antecedents['sst']['low'] & self.antecedents['sla']['low'] & self.antecedents['chl']['ideal']) |
-                    (self.antecedents['depth']['deep'] & self.antecedents['sst']['high'] & self.antecedents['sla']['low'] & self.antecedents['chl']['ideal']) |
-                    (self.antecedents['depth']['deep'] & self.antecedents['sst']['low'] & self.antecedents['sla']['high'] & self.antecedents['chl']['ideal']) |
-                    (self.antecedents['depth']['deep'] & self.antecedents['sst']['high'] & self.antecedents['sla']['high'] & self.antecedents['chl']['ideal']) |
-                    (self.antecedents['depth']['deep'] & self.antecedents['sst']['low'] & self.antecedents['sla']['ideal'] & self.antecedents['chl']['low']) |
-                    (self.antecedents['depth']['deep'] & self.antecedents['sst']['high'] & self.antecedents['sla']['ideal'] & self.antecedents['chl']['low']) |
-                    (self.antecedents['depth']['deep'] & self.antecedents['sst']['low'] & self.antecedents['sla']['ideal'] & self.antecedents['chl']['high']) |
-                    (self.antecedents['depth']['deep'] & self.antecedents['sst']['high'] & self.antecedents['sla']['ideal'] & self.antecedents['chl']['high']) |
-                    (self.antecedents['depth']['ideal'] & self.antecedents['sst']['low'] & self.antecedents['sla']['low'] & self.antecedents['chl']['low']) |
-                    (self.antecedents['depth']['ideal'] & self.antecedents['sst']['low'] & self.antecedents['sla']['high'] & self.antecedents['chl']['low']) |
-                    (self.antecedents['depth']['ideal'] & self.antecedents['sst']['low'] & self.antecedents['sla']['low'] & self.antecedents['chl']['high']) |
-                    (self.antecedents['depth']['ideal'] & self.antecedents['sst']['low'] & self.antecedents['sla']['high'] & self.antecedents['chl']['high']) |
-                    (self.antecedents['depth']['ideal'] & self.antecedents['sst']['high'] & self.antecedents['sla']['low'] & self.antecedents['chl']['low']) |
-                    (self.antecedents['depth']['ideal'] & self.antecedents['sst']['high'] & self.antecedents['sla']['low'] & self.antecedents['chl']['high']) |
-                    (self.antecedents['depth']['ideal'] & self.antecedents['sst']['high'] & self.antecedents['sla']['high'] & self.antecedents['chl']['low']) |
-                    (self.antecedents['depth']['ideal'] & self.antecedents['sst']['high'] & self.antecedents['sla']['high'] & self.antecedents['chl']['high']) |
-                    (self.antecedents['depth']['deep'] & self.antecedents['sst']['low'] & self.antecedents['sla']['low'] & self.antecedents['chl']['low']) |
-                    (self.antecedents['depth']['deep'] & self.antecedents['sst']['low'] & self.antecedents['sla']['high'] & self.antecedents['chl']['low']) |
-                    (self.antecedents['depth']['deep'] & self.antecedents['sst']['low'] & self.antecedents['sla']['low'] & self.antecedents['chl']['high']) |
-                    (self.antecedents['depth']['deep'] & self.antecedents['sst']['low'] & self.antecedents['sla']['high'] & self.antecedents['chl']['high']) |
-                    (self.antecedents['depth']['deep'] & self.antecedents['sst']['high'] & self.antecedents['sla']['low'] & self.antecedents['chl']['low']) |
-                    (self.antecedents['depth']['deep'] & self.antecedents['sst']['high'] & self.antecedents['sla']['low'] & self.antecedents['chl']['high']) |
-                    (self.antecedents['depth']['deep'] & self.antecedents['sst']['high'] & self.antecedents['sla']['high'] & self.antecedents['chl']['low']) |
-                    (self.antecedents['depth']['deep'] & self.antecedents['sst']['high'] & self.antecedents['sla']['high'] & self.antecedents['chl']['high'])
-                    , self.consequent['low']))
-            
-            elif season == 'December':
-                self.usedParameters = ['depth', 'sst', 'sla', 'chl']
-                
-                self.antecedents['depth'] = fuzz.control.Antecedent(np.linspace(-5000, 0, 100), 'depth')
-                self.antecedents['sst'] = fuzz.control.Antecedent(np.linspace(273, 310, 37), 'sst')
-                self.antecedents['sla'] = fuzz.control.Antecedent(np.linspace(-1, 1, 20), 'sla')
-                self.antecedents['chl'] = fuzz.control.Antecedent(np.linspace(0, 30, 30), 'chl')
-                
-                self.antecedents['depth']['deep'] = fuzz.trapmf(self.antecedents['depth'].universe, [-5000, -5000, -110, -90])
-                self.antecedents['depth']['ideal'] = fuzz.trapmf(self.antecedents['depth'].universe, [-110, -90, 0, 0])
-
-                self.antecedents['sst']['low'] = fuzz.trapmf(self.antecedents['sst'].universe, [273, 273, 285, 287])
-                self.antecedents['sst']['ideal'] = fuzz.trapmf(self.antecedents['sst'].universe, [285, 287, 290, 292])
-                self.antecedents['sst']['high'] = fuzz.trapmf(self.antecedents['sst'].universe, [290, 292, 310, 310])
-
-                self.antecedents['sla']['low'] = fuzz.trapmf(self.antecedents['sla'].universe, [-1, -1, -0.07, -0.05])
-                self.antecedents['sla']['ideal'] = fuzz.trapmf(self.antecedents['sla'].universe, [-0.07, -0.05, 0, 0.02])
-                self.antecedents['sla']['high'] = fuzz.trapmf(self.antecedents['sla'].universe, [0, 0.02, 1, 1])
-
-                self.antecedents['chl']['low'] = fuzz.trapmf(self.antecedents['chl'].universe, [0, 0, 0.43, 0.45])
-                self.antecedents['chl']['ideal'] = fuzz.trapmf(self.antecedents['chl'].universe, [0.43, 0.45, 4.5, 4.7])
-                self.antecedents['chl']['high'] = fuzz.trapmf(self.antecedents['chl'].universe, [4.5, 4.7, 30, 30])
-
-                self.rules.append(fuzz.control.Rule(
-                    (self.antecedents['depth']['ideal'] & self.antecedents['sst']['ideal'] & self.antecedents['sla']['ideal'] & self.antecedents['chl']['ideal'])
-                    , self.consequent['extreme']))
-
-                self.rules.append(fuzz.control.Rule(
-                    (self.antecedents['depth']['ideal'] & self.antecedents['sst']['ideal'] & self.antecedents['sla']['ideal'] & self.antecedents['chl']['low']) |
-                    (self.antecedents['depth']['ideal'] & self.antecedents['sst']['ideal'] & self.antecedents['sla']['ideal'] & self.antecedents['chl']['high']) |
-                    (self.antecedents['depth']['ideal'] & self.antecedents['sst']['ideal'] & self.antecedents['sla']['low'] & self.antecedents['chl']['ideal']) |
-                    (self.antecedents['depth']['ideal'] & self.antecedents['sst']['ideal'] & self.antecedents['sla']['high'] & self.antecedents['chl']['ideal']) |
-                    (self.antecedents['depth']['ideal'] & self.antecedents['sst']['low'] & self.antecedents['sla']['ideal'] & self.antecedents['chl']['ideal']) |
-                    (self.antecedents['depth']['ideal'] & self.antecedents['sst']['high'] & self.antecedents['sla']['ideal'] & self.antecedents['chl']['ideal']) |
-                    (self.antecedents['depth']['deep'] & self.antecedents['sst']['ideal'] & self.antecedents['sla']['ideal'] & self.antecedents['chl']['ideal'])
-                    , self.consequent['high']))
-
-                self.rules.append(fuzz.control.Rule(
-                    (self.antecedents['depth']['ideal'] & self.antecedents['sst']['ideal'] & self.antecedents['sla']['low'] & self.antecedents['chl']['low']) |
-                    (self.antecedents['depth']['ideal'] & self.antecedents['sst']['ideal'] & self.antecedents['sla']['high'] & self.antecedents['chl']['low']) |
-                    (self.antecedents['depth']['ideal'] & self.antecedents['sst']['ideal'] & self.antecedents['sla']['low'] & self.antecedents['chl']['high']) |
-                    (self.antecedents['depth']['ideal'] & self.antecedents['sst']['ideal'] & self.antecedents['sla']['high'] & self.antecedents['chl']['high']) |
-                    (self.antecedents['depth']['ideal'] & self.antecedents['sst']['low'] & self.antecedents['sla']['low'] & self.antecedents['chl']['ideal']) |
-                    (self.antecedents['depth']['ideal'] & self.antecedents['sst']['high'] & self.antecedents['sla']['low'] & self.antecedents['chl']['ideal']) |
-                    (self.antecedents['depth']['ideal'] & self.antecedents['sst']['low'] & self.antecedents['sla']['high'] & self.antecedents['chl']['ideal']) |
-                    (self.antecedents['depth']['ideal'] & self.antecedents['sst']['high'] & self.antecedents['sla']['high'] & self.antecedents['chl']['ideal']) |
-                    (self.antecedents['depth']['ideal'] & self.antecedents['sst']['low'] & self.antecedents['sla']['ideal'] & self.antecedents['chl']['low']) |
-                    (self.antecedents['depth']['ideal'] & self.antecedents['sst']['high'] & self.antecedents['sla']['ideal'] & self.antecedents['chl']['low']) |
-                    (self.antecedents['depth']['ideal'] & self.antecedents['sst']['low'] & self.antecedents['sla']['ideal'] & self.antecedents['chl']['high']) |
-                    (self.antecedents['depth']['ideal'] & self.antecedents['sst']['high'] & self.antecedents['sla']['ideal'] & self.antecedents['chl']['high']) |
-                    (self.antecedents['depth']['deep'] & self.antecedents['sst']['ideal'] & self.antecedents['sla']['ideal'] & self.antecedents['chl']['low']) |
-                    (self.antecedents['depth']['deep'] & self.antecedents['sst']['ideal'] & self.antecedents['sla']['ideal'] & self.antecedents['chl']['high']) |
-                    (self.antecedents['depth']['deep'] & self.antecedents['sst']['ideal'] & self.antecedents['sla']['low'] & self.antecedents['chl']['ideal']) |
-                    (self.antecedents['depth']['deep'] & self.antecedents['sst']['ideal'] & self.antecedents['sla']['high'] & self.antecedents['chl']['ideal']) |
-                    (self.antecedents['depth']['deep'] & self.antecedents['sst']['low'] & self.antecedents['sla']['ideal'] & self.antecedents['chl']['ideal']) |
-                    (self.antecedents['depth']['deep'] & self.antecedents['sst']['high'] & self.antecedents['sla']['ideal'] & self.antecedents['chl']['ideal'])
-                    , self.consequent['medium']))
-
-                self.rules.append(fuzz.control.Rule(
-                    (self.antecedents['depth']['deep'] & self.antecedents['sst']['ideal'] & self.antecedents['sla']['low'] & self.antecedents['chl']['low']) |
-                    (self.antecedents['depth']['deep'] & self.antecedents['sst']['ideal'] & self.antecedents['sla']['high'] & self.antecedents['chl']['low']) |
-                    (self.antecedents['depth']['deep'] & self.antecedents['sst']['ideal'] & self.antecedents['sla']['low'] & self.antecedents['chl']['high']) |
-                    (self.antecedents['depth']['deep'] & self.antecedents['sst']['ideal'] & self.antecedents['sla']['high'] & self.antecedents['chl']['high']) |
-                    (self.antecedents['depth']['deep'] & self.antecedents['sst']['low'] & self.antecedents['sla']['low'] & self.antecedents['chl']['ideal']) |
-                    (self.antecedents['depth']['deep'] & self.antecedents['sst']['high'] & self.antecedents['sla']['low'] & self.antecedents['chl']['ideal']) |
-                    (self.antecedents['depth']['deep'] & self.antecedents['sst']['low'] & self.antecedents['sla']['high'] & self.antecedents['chl']['ideal']) |
-                    (self.antecedents['depth']['deep'] & self.antecedents['sst']['high'] & self.antecedents['sla']['high'] & self.antecedents['chl']['ideal']) |
-                    (self.antecedents['depth']['deep'] & self.antecedents['sst']['low'] & self.antecedents['sla']['ideal'] & self.antecedents['chl']['low']) |
-                    (self.antecedents['depth']['deep'] & self.antecedents['sst']['high'] & self.antecedents['sla']['ideal'] & self.antecedents['chl']['low']) |
-                    (self.antecedents['depth']['deep'] & self.antecedents['sst']['low'] & self.antecedents['sla']['ideal'] & self.antecedents['chl']['high']) |
-                    (self.antecedents['depth']['deep'] & self.antecedents['sst']['high'] & self.antecedents['sla']['ideal'] & self.antecedents['chl']['high']) |
-                    (self.antecedents['depth']['ideal'] & self.antecedents['sst']['low'] & self.antecedents['sla']['low'] & self.antecedents['chl']['low']) |
-                    (self.antecedents['depth']['ideal'] & self.antecedents['sst']['low'] & self.antecedents['sla']['high'] & self.antecedents['chl']['low']) |
-                    (self.antecedents['depth']['ideal'] & self.antecedents['sst']['low'] & self.antecedents['sla']['low'] & self.antecedents['chl']['high']) |
-                    (self.antecedents['depth']['ideal'] & self.antecedents['sst']['low'] & self.antecedents['sla']['high'] & self.antecedents['chl']['high']) |
-                    (self.antecedents['depth']['ideal'] & self.antecedents['sst']['high'] & self.antecedents['sla']['low'] & self.antecedents['chl']['low']) |
-                    (self.antecedents['depth']['ideal'] & self.antecedents['sst']['high'] & self.antecedents['sla']['low'] & self.antecedents['chl']['high']) |
-                    (self.antecedents['depth']['ideal'] & self.antecedents['sst']['high'] & self.antecedents['sla']['high'] & self.antecedents['chl']['low']) |
-                    (self.antecedents['depth']['ideal'] & self.antecedents['sst']['high'] & self.antecedents['sla']['high'] & self.antecedents['chl']['high'])
-                    , self.consequent['low']))
-            
-    def run(self, season, fishery, verbose=True):
-        self.setFuzzyRules(season, fishery)
-        system = fuzz.control.ControlSystem(self.rules)
-        simulation = fuzz.control.ControlSystemSimulation(system)
-        self.results = np.zeros((self.X, self.Y))
+        for consequent in table.output.terms:
+            combinations = [combination for combination, term in table.rules if term == consequent]
+            if len(combinations) == 0:
+                continue
+            antecedent = reduce(operator.or_, [reduce(operator.and_, [self.antecedents[name][term] for name, term in zip(self.usedParameters, combination)]) for combination in combinations])
+            self.rules.append(fuzz.control.Rule(antecedent, self.consequent[consequent]))
+
+    def compile(self, season, fishery):
+        signature = RuleTable.signature(RuleTable.filename(fishery, season, Fuzzifier.rulesDirectory))
+        compiled = Fuzzifier.ruleCache.get((fishery, season), signature, lambda: self._compileRules(season, fishery))
+        self.season = season
+        self.fishery = fishery
+        self.usedParameters = compiled.usedParameters
+        self.outputParameter = compiled.outputParameter
+        self.compiledRules = compiled
+        return compiled.engine
+
+    def compileSystem(self, season, fishery):
+        self.compile(season, fishery)
+        # rule bases loaded from disk carry only the vectorized engine
+        if self.compiledRules.system is None:
+            self.setFuzzyRules(season, fishery)
+            self.compiledRules.system = _skfuzzy().control.ControlSystem(self.rules)
+        return self.compiledRules.system
+
+    def _compileRules(self, season, fishery):
+        # straight from the table, without building the skfuzzy objects
+        table = RuleTable.load(RuleTable.filename(fishery, season, Fuzzifier.rulesDirectory), fishery, season)
+        return CompiledRules(season, fishery, list(table.inputs), table.output.name, Inference(table))
+
+    def lookupTable(self, season, fishery, directory=None, resolution=2, verbose=True):
+        # a saved table is used while the rule table it was built from is
+        # unchanged, like the rule cache and the memos
+        engine = self.compile(season, fishery)
+        signature = RuleTable.signature(RuleTable.filename(fishery, season, Fuzzifier.rulesDirectory))
+        key = (directory, fishery, season, resolution)
+        with Fuzzifier.lookupLock:
+            table = Fuzzifier.lookupTables.get(key)
+            if table is not None and table.signature == signature:
+                return table
+            table = None
+            if directory is not None:
+                file = LookupTable.filename(directory, fishery, season, resolution)
+                if os.path.isfile(file):
+                    table = LookupTable.load(file, engine)
+                    if table.signature != signature:
+                        if verbose is True:
+                            print 'Rules of {0} {1} changed since the lookup table was built.'.format(season, fishery)
+                        table = None
+            if table is None:
+                if verbose is True:
+                    print 'Building lookup table for {0} {1}...'.format(season, fishery)
+                table = LookupTable.build(engine, resolution, verbose, signature)
+                if directory is not None:
+                    table.save(file)
+            Fuzzifier.lookupTables[key] = table
+            return table
+
+    def engine(self, season, fishery, backend='numpy', lutDirectory=None, lutResolution=2, verbose=True):
+        # vectorized engine of a backend, all share the compute(inputs) interface
+        if backend == 'numpy':
+            engine = self.compile(season, fishery)
+        elif backend == 'lut':
+            engine = self.lookupTable(season, fishery, lutDirectory, lutResolution, verbose)
+        else:
+            raise ValueError('Unknown inference backend {0}'.format(backend))
+        if Fuzzifier.memoCapacity > 0:
+            signature = RuleTable.signature(RuleTable.filename(fishery, season, Fuzzifier.rulesDirectory))
+            key = (fishery, season, backend, lutResolution, signature)
+            with Fuzzifier.memoLock:
+                if key not in Fuzzifier.memos:
+                    Fuzzifier.memos[key] = Memo(engine, Fuzzifier.memoPrecision, Fuzzifier.memoCapacity)
+                engine = Fuzzifier.memos[key]
+        return engine
+
+    def _provenance(self, season, fishery, backend, lutResolution):
+        # Saved as attributes of the PFZ variable, with its encoding: a later
+        # runDelta only reuses a PFZ of the same rules, backend and encoding
+        provenance = {'rules_signature': RuleTable.signature(RuleTable.filename(fishery, season, Fuzzifier.rulesDirectory)), 'backend': backend}
+        if backend == 'lut':
+            provenance['lut_resolution'] = lutResolution
+        return provenance
+
+    def run(self, season, fishery, verbose=True, backend='numpy', lutDirectory=None, lutResolution=2, workers=1):
         if verbose is True:
             print 'Generating PFZ...'
-        for x in range(self.X):
-            if verbose is True:
-                sys.stdout.write('Progress: {:2.1%}\r'.format((x * self.Y) / self.PixelCount))
+        if workers == 0:
+            workers = multiprocessing.cpu_count()
+        self.provenance = self._provenance(season, fishery, backend, lutResolution)
+        if backend == 'skfuzzy':
+            self._runSimulation(self.compileSystem(season, fishery), verbose)
+        else:
+            engine = self.engine(season, fishery, backend, lutDirectory, lutResolution, verbose)
+            self._runEngine(engine, verbose, workers)
+            if verbose is True and isinstance(engine, Memo):
+                print 'Memo: {hits} hits, {misses} misses ({hit_rate:.1%}), {entries} entries'.format(**engine.stats())
+        if verbose is True:
+            print 'PFZ generated successfully.'
+
+    def runDelta(self, season, fishery, previousInput, previousOutput, verbose=True, backend='numpy', lutDirectory=None, lutResolution=2, workers=1, precision=None):
+        '''
+        Like run(), given the collocated file and the PFZ of the previous day
+        for the same fishery and season: pixels whose inputs, quantized to
+        Precision (or the given dict), did not change keep the previous
+        result and only the rest are evaluated. The previous PFZ is only
+        used when it was computed with the same rules, backend and encoding. Reused pixels are as precise
+        as the stored PFZ and may also differ by what the rule base does
+        within one quantization step (none with precision 0). Statistics are
+        kept in deltaStats.
+        '''
+        if verbose is True:
+            print 'Generating PFZ...'
+        if workers == 0:
+            workers = multiprocessing.cpu_count()
+        engine = self.engine(season, fishery, backend, lutDirectory, lutResolution, verbose)
+        self.provenance = self._provenance(season, fishery, backend, lutResolution)
+        index = self.oceanIndex(self.usedParameters)
+        inputs = self._packInputs(index)
+        precision = dict(Precision, **(precision or {}))
+
+        results = np.full(len(index), np.nan)
+        reuse = np.zeros(len(index), dtype=bool)
+        previous = self._previousResults(previousInput, previousOutput, index)
+        if previous is not None:
+            values, previousInputs = previous
+            reuse = ~np.isnan(values)
+            for param in self.usedParameters:
+                reuse &= quantize(inputs[param], precision[param]) == quantize(previousInputs[param], precision[param])
+            results[reuse] = values[reuse]
+
+        changed = np.flatnonzero(~reuse)
+        if len(changed) > 0:
+            results[changed] = self._evaluate(engine, dict((param, value[changed]) for param, value in inputs.items()), len(changed), verbose, workers)
+        self._scatterResults(index, results)
+        self.deltaStats = {'pixels': len(index), 'reused': int(reuse.sum()), 'computed': len(changed)}
+        if verbose is True:
+            print 'PFZ generated successfully, {0} of {1} pixels reused from the previous day.'.format(self.deltaStats['reused'], self.deltaStats['pixels'])
+
+    def _previousResults(self, previousInput, previousOutput, index):
+        # previous PFZ (NaN where missing) and inputs at the packed pixels,
+        # None when they are not on the same grid or the PFZ was computed
+        # otherwise than the current one
+        if not (os.path.isfile(previousInput) and os.path.isfile(previousOutput)):
+            return None
+        expected = dict(self.provenance, encoding=self.outputFormat['encoding'])
+        with Utilities.netcdfLock:
+            output = cdf.Dataset(previousOutput, 'r')
+            data = cdf.Dataset(previousInput, 'r')
+            try:
+                if self.outputParameter not in output.variables or output[self.outputParameter].shape != (self.X, self.Y):
+                    return None
+                var = output[self.outputParameter]
+                if any(key not in var.ncattrs() or str(var.getncattr(key)) != str(value) for key, value in expected.items()):
+                    return None
+                if any(data[Variables[param]].shape != (self.X, self.Y) for param in self.usedParameters):
+                    return None
+                values = output[self.outputParameter][:].astype(np.float64)
+                values = np.ma.filled(np.ma.masked_equal(values, -999), np.nan).ravel()[index]
+                previousInputs = {}
+                for param in self.usedParameters:
+                    previousInputs[param] = np.ma.filled(data[Variables[param]][:].astype(np.float64), np.nan).ravel()[index]
+            finally:
+                output.close()
+                data.close()
+        return values, previousInputs
+
+    def _runEngine(self, engine, verbose=True, workers=1):
+        index = self.oceanIndex(self.usedParameters)
+        inputs = self._packInputs(index)
+        self._scatterResults(index, self._evaluate(engine, inputs, len(index), verbose, workers))
+
+    def _evaluate(self, engine, inputs, count, verbose=True, workers=1):
+        self.pixels += count
+        progress = None
+        if verbose is True:
+            def progress(fraction):
+                sys.stdout.write('Progress: {:2.1%}\r'.format(fraction))
                 sys.stdout.flush()
-            for y in range(self.Y):
-                data = { param:self.data[param].item(x,y) for param in self.usedParameters }
-                if any(np.isnan(value) for value in data.values()):
-                    self.results.itemset((x, y), -999)
-                else:
-                    for param, value in data.items():
-                        simulation.input[param] = value
-                    simulation.compute()
-                    self.results.itemset((x, y), simulation.output[self.outputParameter])
+        if workers > 1 and isinstance(engine, Memo):
+            # deduplicate here, only the missing tuples go to the workers
+            return engine.compute(inputs, progress, lambda points, progress: self._computeParallel(engine.engine, points, len(points[engine.parameters[0]]), workers, progress))
+        if workers > 1:
+            return self._computeParallel(engine, inputs, count, workers, progress)
+        return engine.compute(inputs, progress)
+
+    def _computeParallel(self, engine, inputs, count, workers, progress=None):
+        # Split the packed ocean pixels in blocks, a few per worker. Pixels are
+        # evaluated independently, so the merged results are identical to a
+        # serial run.
+        shared = {}
+        for param, value in inputs.items():
+            shared[param] = RawArray('d', count)
+            np.frombuffer(shared[param], dtype=np.float64)[:] = value
+        output = RawArray('d', count)
+        step = max(1, int(math.ceil(count / (workers * 4))))
+        blocks = [(start, min(start + step, count)) for start in range(0, count, step)]
+        # fork holding the netCDF lock, so that no other thread of the
+        # pipeline is inside HDF5 or has a file open that the workers would
+        # inherit, keeping its HDF5 lock until they exit
+        with Utilities.netcdfLock:
+            pool = multiprocessing.Pool(workers, _initWorker, (engine, shared, output))
+        try:
+            for done, _ in enumerate(pool.imap_unordered(_computeBlock, blocks)):
+                if progress is not None:
+                    progress((done + 1) / len(blocks))
+        finally:
+            pool.close()
+            pool.join()
+        return np.frombuffer(output, dtype=np.float64).copy()
+
+    def runStreaming(self, season, fishery, filename, verbose=True, backend='numpy', lutDirectory=None, lutResolution=2, blockRows=None):
+        '''
+        Evaluate the grid in blocks of rows and write every block straight to
+        the output file, so memory is bounded by the block size instead of
+        the grid size. The results are identical to run() and writeData().
+        '''
+        self.runAll([(season, fishery, filename)], verbose, backend, lutDirectory, lutResolution, blockRows)
+
+    def runAll(self, jobs, verbose=True, backend='numpy', lutDirectory=None, lutResolution=2, blockRows=None):
+        '''
+        Streaming evaluation of several (season, fishery, filename) rule
+        bases in one pass: each block of rows is read once and evaluated by
+        every rule base before the next one is read.
+        '''
+        if verbose is True:
+            print 'Generating PFZ...'
+        engines = []
+        for season, fishery, filename in jobs:
+            if backend == 'skfuzzy':
+                raise ValueError('Inference backend {0} cannot stream'.format(backend))
+            engine = self.engine(season, fishery, backend, lutDirectory, lutResolution, verbose)
+            engines.append((engine, self.usedParameters, self.outputParameter, fishery, filename, self._provenance(season, fishery, backend, lutResolution)))
+        parameters = sorted(set(param for _, used, _, _, _, _ in engines for param in used))
+
+        ocean = None
+        if self.bathymetry is not None:
+            ocean = self.bathymetry.ocean
+        elif self.maskFile is not None and os.path.isfile(self.maskFile):
+            ocean = np.load(self.maskFile, mmap_mode='r')
+            if ocean.shape != (self.X, self.Y):
+                ocean = None
+
+        # the blocks are read and written holding the netCDF lock, and
+        # evaluated without it
+        lock = Utilities.netcdfLock
+        with lock:
+            dsin = cdf.Dataset(self.file, 'r')
+            if blockRows is None:
+                blockRows = self.blockRows(dsin[Variables[parameters[0]]])
+        outputs = []
+        try:
+            with lock:
+                for engine, used, outputParameter, fishery, filename, provenance in engines:
+                    outputs.append(self._createOutput(filename, outputParameter, fishery, (min(blockRows, self.X), self.Y), provenance))
+            for start in range(0, self.X, blockRows):
+                stop = min(start + blockRows, self.X)
+                if verbose is True:
+                    sys.stdout.write('Progress: {:2.1%}\r'.format(start / self.X))
+                    sys.stdout.flush()
+                with lock:
+                    if ocean is not None:
+                        ocean_block = np.array(ocean[start:stop])
+                    else:
+                        depth = dsin[Variables['depth']][start:stop, :]
+                        ocean_block = ~np.ma.getmaskarray(depth) & ~np.isnan(np.ma.getdata(depth))
+                    blocks = {}
+                    present = {}
+                    for param in parameters:
+                        if param == 'depth' and self.bathymetry is not None:
+                            values = np.array(self.bathymetry.depth[start:stop])
+                        else:
+                            values = dsin[Variables[param]][start:stop, :]
+                        present[param] = ~np.ma.getmaskarray(values) & ~np.isnan(np.ma.getdata(values))
+                        blocks[param] = np.ma.getdata(values)
+                for (engine, used, _, _, _, _), (_, var) in zip(engines, outputs):
+                    valid = ocean_block.copy()
+                    for param in used:
+                        valid &= present[param]
+                    index = np.flatnonzero(valid)
+                    results = np.full((stop - start) * self.Y, -999.)
+                    if len(index) > 0:
+                        self.pixels += len(index)
+                        values = engine.compute(dict((param, blocks[param].ravel()[index].astype(np.float64)) for param in used))
+                        results[index] = np.where(np.isnan(values), -999, values)
+                    with lock:
+                        var[start:stop, :] = self._encode(results.reshape(stop - start, self.Y))
+        finally:
+            with lock:
+                dsin.close()
+                for dsout, _ in outputs:
+                    dsout.close()
+        self.results = None
         if verbose is True:
             print 'PFZ generated successfully.'
 
+    def blockRows(self, variable):
+        # whole chunks of rows, as many as fit in blockPixels; NetCDF3
+        # variables have no chunking
+        chunking = variable.chunking()
+        rows = 1 if chunking in (None, 'contiguous') else chunking[0]
+        return max(rows, self.blockPixels // (rows * self.Y) * rows)
+
+    def _runSimulation(self, system, verbose=True):
+        simulation = _skfuzzy().control.ControlSystemSimulation(system)
+        index = self.oceanIndex(self.usedParameters)
+        inputs = self._packInputs(index)
+        results = np.empty(len(index))
+        self.pixels += len(index)
+        for i in range(len(index)):
+            if verbose is True and i % self.Y == 0:
+                sys.stdout.write('Progress: {:2.1%}\r'.format(i / len(index)))
+                sys.stdout.flush()
+            for param in self.usedParameters:
+                simulation.input[param] = inputs[param][i]
+            simulation.compute()
+            results[i] = simulation.output[self.outputParameter]
+        self._scatterResults(index, results)
+
     def writeData(self, filename, verbose=True):
         if verbose is True:
             print 'Writing data to {0}'.format(filename)
-        dsin = cdf.Dataset(self.file)
-        dsout = cdf.Dataset(filename, 'w')
-        for dname, the_dim in dsin.dimensions.items():
-            dsout.createDimension(dname, len(the_dim))
-        for v_name, varin in dsin.variables.items():
-            if v_name == 'lat' or v_name == 'lon':
-                outVar = dsout.createVariable(v_name, varin.datatype, varin.dimensions)
-                outVar.setncatts({k: varin.getncattr(k) for k in varin.ncattrs()})    
-                outVar[:] = varin[:]
-        
-        var = dsout.createVariable(self.outputParameter, np.dtype('float32'), ('lat', 'lon'), fill_value=-999, zlib=True, least_significant_digit=1)
-        var.units = '%'
-        var.long_name = 'Possibility of {0} Fishing Zone'.format(self.fishery)
-        var.valid_range = np.array((0.0, 100.0))
-        var[:] = self.results[:]
-        dsin.close()
-        dsout.close()
+        with Utilities.netcdfLock:
+            dsout, var = self._createOutput(filename, self.outputParameter, self.fishery, provenance=self.provenance)
+            var[:] = self._encode(self.results)
+            dsout.close()
         if verbose is True:
             print 'Data written successfully'
 
+    def _createOutput(self, filename, outputParameter, fishery, chunksizes=None, provenance=None):
+        dsout = cdf.Dataset(filename, 'w')
+        for name, datatype, dimensions, attributes in self.coordinates:
+            for dname in dimensions:
+                if dname not in dsout.dimensions:
+                    dsout.createDimension(dname, len(self.data[name]))
+            outVar = dsout.createVariable(name, datatype, dimensions)
+            outVar.setncatts(attributes)
+            outVar[:] = self.data[name]
+
+        options = self.outputFormat
+        chunksizes = options['chunksizes'] or chunksizes
+        if chunksizes is not None:
+            # chunks cannot be larger than the grid
+            chunksizes = tuple(min(size, length) for size, length in zip(chunksizes, (self.X, self.Y)))
+        compression = dict(zlib=options['complevel'] > 0, complevel=max(options['complevel'], 1), shuffle=options['shuffle'], chunksizes=chunksizes)
+        if options['encoding'] == 'uint8':
+            var = dsout.createVariable(outputParameter, np.dtype('uint8'), ('lat', 'lon'), fill_value=255, **compression)
+            var.valid_range = np.array((0, 100), dtype=np.uint8)
+        else:
+            var = dsout.createVariable(outputParameter, np.dtype('float32'), ('lat', 'lon'), fill_value=-999, least_significant_digit=1, **compression)
+            var.valid_range = np.array((0.0, 100.0))
+        var.units = '%'
+        var.long_name = 'Possibility of {0} Fishing Zone'.format(fishery)
+        var.encoding = options['encoding']
+        if provenance is not None:
+            var.setncatts(provenance)
+        return dsout, var
+
+    def _encode(self, results):
+        if self.outputFormat['encoding'] == 'uint8':
+            return np.where(results == -999, 255, np.clip(np.round(results), 0, 100)).astype(np.uint8)
+        return results
+
+    def writeBenchmark(self, directory, formats):
+        '''
+        Write the current results with every output format (dicts of
+        setOutputFormat arguments) and report the write time and file size.
+        '''
+        if not os.path.exists(directory):
+            os.makedirs(directory)
+        saved = self.outputFormat
+        report = []
+        try:
+            for i, options in enumerate(formats):
+                self.setOutputFormat(**options)
+                filename = os.path.join(directory, 'format{0}.nc'.format(i))
+                start = time.time()
+                self.writeData(filename, False)
+                elapsed = time.time() - start
+                report.append(dict(options, seconds=elapsed, bytes=os.path.getsize(filename)))
+                os.remove(filename)
+        finally:
+            self.outputFormat = saved
+        return report
+
     def ViewMembershipRelationships(self, season, fishery):
         self.setFuzzyRules(season, fishery)
+        fuzz = _skfuzzy()
         system = fuzz.control.ControlSystem(self.rules)
         simulation = fuzz.control.ControlSystemSimulation(system)
         sst = np.linspace(273, 310, 100)
@@ -622,6 +605,7 @@ class Fuzzifier:
         plt.show()
 
     def printRules(self):
+        import matplotlib.pyplot as plt
         for rule in self.rules:
             rule.view()
         fig = plt.figure(figsize=(8, 8))
@@ -631,26 +615,79 @@ if __name__ == '__main__':
     parser = argparse.ArgumentParser(description='Fuzzy algorithm for detecting PFZs in Mediterranean Sea')
     parser.add_argument('-i', '--input', help='path to input file')
     parser.add_argument('-o', '--output', help='path to output file')
+    parser.add_argument('-m', '--mask', help='path to the saved ocean mask of the bathymetry grid')
+    parser.add_argument('--bathymetry', help='directory of the prepared shared bathymetry (see bathymetry.py), for the depth and the ocean mask')
     parser.add_argument('-s', '--season', help='the season')
     parser.add_argument('-f', '--fishery', help='the fishery')
+    parser.add_argument('-b', '--backend', choices=['numpy', 'lut', 'skfuzzy'], default='numpy', help='the inference backend')
+    parser.add_argument('-l', '--lut-directory', help='directory of precomputed lookup tables')
+    parser.add_argument('-r', '--lut-resolution', type=int, default=2, help='lookup table subdivisions of each universe step')
+    parser.add_argument('-w', '--workers', type=int, default=1, help='worker processes (0 for all cores)')
+    parser.add_argument('--stream', help='evaluate and write blocks of rows to bound memory', action='store_true')
+    parser.add_argument('--memo', type=int, default=0, help='memoize inference on quantized inputs, keeping at most this many tuples')
+    parser.add_argument('--complevel', type=int, default=4, help='zlib level of the output (0 for none)')
+    parser.add_argument('--no-shuffle', help='disable the shuffle filter of the output', action='store_true')
+    parser.add_argument('--chunks', type=int, nargs=2, help='chunk shape (rows columns) of the output')
+    parser.add_argument('--encoding', choices=['float32', 'uint8'], default='float32', help='float32, or whole percent in uint8')
+    parser.add_argument('--write-benchmark', help='report write time and size of the output formats instead of writing the output', action='store_true')
+    parser.add_argument('--block-rows', type=int, help='rows per block when streaming (default: whole chunks)')
+    parser.add_argument('--metrics', help='append the time, I/O and memory of every step to this JSON lines file')
+    parser.add_argument('--profile', help='sample the inference and save the time of each phase next to the output (runs in this process)', action='store_true')
     parser.add_argument("-v", "--verbose", help="enable verbose mode", action="store_true")
     args = parser.parse_args()
 
     if args.verbose:
         print 'Initializing fuzzifier...'
 
-    fuzzifier = Fuzzifier(args.input)
+    metrics = Metrics(args.metrics)
+    labels = {'fishery': args.fishery, 'season': args.season, 'backend': args.backend}
+    Fuzzifier.memoCapacity = args.memo
+    with metrics.stage('setData', **labels):
+        fuzzifier = Fuzzifier(args.input, args.mask, args.stream, Bathymetry(args.bathymetry) if args.bathymetry else None)
+    fuzzifier.setOutputFormat(args.complevel, not args.no_shuffle, args.chunks, args.encoding)
 
     if args.verbose:
         print 'Running fuzzy algorithm...'
     
-    fuzzifier.run(args.season, args.fishery)
-
-    if args.verbose:
-        print 'Fuzzy algorithm completed...'
-        print 'Writing results to {0}...'.format(args.output)
-
-    fuzzifier.writeData()
+    profiler = Profiler(enabled=args.profile)
+    if args.stream:
+        with metrics.stage('runStreaming', **labels) as measure, profiler:
+            fuzzifier.runStreaming(args.season, args.fishery, args.output, backend=args.backend, lutDirectory=args.lut_directory, lutResolution=args.lut_resolution, blockRows=args.block_rows)
+            measure.add(pixels=fuzzifier.pixels)
+    else:
+        # worker processes would run out of sight of the profiler
+        workers = 1 if args.profile else args.workers
+        with metrics.stage('run', **labels) as measure, profiler:
+            fuzzifier.run(args.season, args.fishery, backend=args.backend, lutDirectory=args.lut_directory, lutResolution=args.lut_resolution, workers=workers)
+            measure.add(pixels=fuzzifier.pixels)
+
+        if args.verbose:
+            print 'Fuzzy algorithm completed...'
+
+        if args.write_benchmark:
+            formats = []
+            for encoding in ['float32', 'uint8']:
+                for complevel in [0, 1, 4, 9]:
+                    for shuffle in [False, True] if complevel > 0 else [False]:
+                        for chunks in [None, (min(256, fuzzifier.X), min(256, fuzzifier.Y)), (1, fuzzifier.Y)]:
+                            formats.append({'complevel': complevel, 'shuffle': shuffle, 'chunksizes': chunks, 'encoding': encoding})
+            directory = tempfile.mkdtemp()
+            try:
+                print 'encoding\tcomplevel\tshuffle\tchunks\tseconds\tMB'
+                for row in fuzzifier.writeBenchmark(directory, formats):
+                    print '{0}\t{1}\t{2}\t{3}\t{4:.3f}\t{5:.2f}'.format(row['encoding'], row['complevel'], row['shuffle'], 'x'.join(str(n) for n in row['chunksizes']) if row['chunksizes'] else 'default', row['seconds'], row['bytes'] / 2 ** 20)
+            finally:
+                shutil.rmtree(directory)
+        else:
+            if args.verbose:
+                print 'Writing results to {0}...'.format(args.output)
+            with metrics.stage('writeData', **labels):
+                fuzzifier.writeData(args.output)
+
+    if args.profile:
+        print 'Profile: {0}'.format(profiler.summary())
+        if args.output is not None:
+            profiler.save(Profiler.filename(args.output), fishery=args.fishery, season=args.season, backend=args.backend, pixels=fuzzifier.pixels)
 
     if args.verbose:
         print 'PFZ generation completed!'
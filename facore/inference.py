@@ -0,0 +1,123 @@
+from __future__ import division
+import numpy as np
+from collections import OrderedDict
+
+class Inference:
+    '''
+    Vectorized Mamdani inference equivalent to skfuzzy's
+    ControlSystemSimulation with the default settings used by Fuzzifier
+    (min/max aggregation, max accumulation, clipping to universe bounds and
+    centroid defuzzification).
+
+    The rule table is compiled once into sampled memberships and a dense
+    rule activation tensor, so that a whole grid of pixels can be evaluated
+    as array operations instead of one compute() per pixel.
+    Results agree with skfuzzy within 1e-9 (in % of the output universe);
+    pixels where skfuzzy cannot defuzzify (no rule fires) are returned as NaN.
+    '''
+    def __init__(self, table, blockSize=65536):
+        self.output = table.output.name
+        self.blockSize = blockSize
+        self.compile(table)
+
+    def compile(self, table):
+        # antecedents: label -> (universe, {term: mf}), terms in table order
+        self.parameters = list(table.inputs)
+        self.antecedents = {}
+        for name, variable in table.inputs.items():
+            terms = OrderedDict((term, variable.membership(term)) for term in variable.terms)
+            self.antecedents[name] = (variable.universe, terms)
+
+        # skfuzzy ignores consequent terms that no rule activates
+        tensor = table.tensor()
+        self.universe = table.output.universe
+        self.terms = [(term, table.output.membership(term)) for term in tensor if tensor[term].any()]
+        self.rules = np.array([tensor[term].ravel() for term, _ in self.terms])
+
+    def fuzzify(self, inputs):
+        # membership of every antecedent term, after clipping to the universe like skfuzzy
+        memberships = {}
+        for param, (universe, terms) in self.antecedents.items():
+            value = np.fmax(np.fmin(inputs[param], universe.max()), universe.min())
+            memberships[param] = np.column_stack([np.interp(value, universe, mf) for mf in terms.values()])
+        return memberships
+
+    def activate(self, memberships):
+        # AND (min) over the inputs for every combination of terms, then
+        # OR (max) over the combinations of each consequent term
+        dimensions = len(self.parameters)
+        activation = None
+        for d, param in enumerate(self.parameters):
+            shape = [len(memberships[param])] + [1] * dimensions
+            shape[d + 1] = memberships[param].shape[1]
+            membership = memberships[param].reshape(shape)
+            activation = membership if activation is None else np.minimum(activation, membership)
+        activation = activation.reshape(len(activation), -1)
+        return np.column_stack([activation[:, rules].max(axis=1) for rules in self.rules])
+
+    def defuzzify(self, cuts):
+        # Centroid of the clipped and aggregated output set. The universe is
+        # upsampled with the points where each term crosses its cut level, as
+        # skfuzzy does, so the piecewise linear area is identical.
+        universe = self.universe
+        dx = np.diff(universe)
+        count = len(cuts)
+        points = [np.repeat(universe[np.newaxis, :], count, axis=0)]
+        for t, (label, mf) in enumerate(self.terms):
+            cut = cuts[:, t:t + 1]
+            above = np.where(cut == 0., mf[np.newaxis, :] > cut, mf[np.newaxis, :] >= cut)
+            crossing = above[:, :-1] != above[:, 1:]
+            with np.errstate(divide='ignore', invalid='ignore'):
+                x = universe[:-1] + (cut - mf[:-1]) * dx / np.diff(mf)
+            points.append(np.where(crossing, x, universe[0]))
+        x = np.sort(np.concatenate(points, axis=1), axis=1)
+
+        y = np.zeros_like(x)
+        for t, (label, mf) in enumerate(self.terms):
+            np.maximum(y, np.minimum(cuts[:, t:t + 1], np.interp(x, universe, mf)), y)
+
+        x1, x2, y1, y2 = x[:, :-1], x[:, 1:], y[:, :-1], y[:, 1:]
+        width = x2 - x1
+        with np.errstate(divide='ignore', invalid='ignore'):
+            moment = np.where(y1 == y2, 0.5 * (x1 + x2),
+                     np.where(y1 == 0., 2.0 / 3.0 * width + x1,
+                     np.where(y2 == 0., 1.0 / 3.0 * width + x1,
+                     (2.0 / 3.0 * width * (y2 + 0.5 * y1)) / (y1 + y2) + x1)))
+        area = np.where(y1 == y2, width * y1,
+               np.where(y1 == 0., 0.5 * width * y2,
+               np.where(y2 == 0., 0.5 * width * y1,
+               0.5 * width * (y1 + y2))))
+        skip = ((y1 == 0.) & (y2 == 0.)) | (x1 == x2)
+        moment[skip] = 0.
+        area[skip] = 0.
+
+        # cumulative sums keep skfuzzy's left to right summation order
+        sumMomentArea = np.cumsum(moment * area, axis=1)[:, -1]
+        sumArea = np.cumsum(area, axis=1)[:, -1]
+        result = sumMomentArea / np.fmax(sumArea, np.finfo(float).eps)
+        # skfuzzy refuses to defuzzify an empty output set
+        result[y.sum(axis=1) == 0] = np.nan
+        return result
+
+    def compute(self, inputs, progress=None):
+        '''
+        Evaluate the rule base for arrays of inputs (all of the same shape).
+        Returns a float64 array of that shape, NaN where any input is NaN or
+        no rule fires.
+        '''
+        shape = np.shape(inputs[self.parameters[0]])
+        values = dict((param, np.asarray(inputs[param], dtype=np.float64).ravel()) for param in self.parameters)
+        size = values[self.parameters[0]].size
+        results = np.full(size, np.nan)
+        valid = np.ones(size, dtype=bool)
+        for param in self.parameters:
+            valid &= ~np.isnan(values[param])
+        index = np.flatnonzero(valid)
+
+        for start in range(0, len(index), self.blockSize):
+            block = index[start:start + self.blockSize]
+            memberships = self.fuzzify(dict((param, values[param][block]) for param in self.parameters))
+            results[block] = self.defuzzify(self.activate(memberships))
+            if progress is not None:
+                progress(min(start + self.blockSize, len(index)) / len(index))
+        return results.reshape(shape)
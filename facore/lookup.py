@@ -0,0 +1,160 @@
+from __future__ import division
+import os
+import sys
+import argparse
+import numpy as np
+from utilities import Utilities
+
+class LookupTable:
+    '''
+    Precomputed N-D table of a fishery/season rule base, evaluated by
+    multilinear interpolation.
+
+    The axes contain every sample point of the antecedent universes (the
+    memberships are linear between them) subdivided `resolution` times, so
+    resolution 1 samples exactly the universe points. The signature of the
+    rule table it was built from (see RuleTable.signature) is saved with it,
+    so a table of edited rules can be told apart.
+
+    Nodes where no rule fires are NaN, and would spread to every pixel of
+    the cells around them; those pixels are evaluated by the exact engine
+    the table was built from, when it is given.
+    '''
+    def __init__(self, parameters, axes, values, resolution=None, signature=None, engine=None):
+        self.parameters = list(parameters)
+        self.axes = [np.asarray(axis, dtype=np.float64) for axis in axes]
+        self.values = np.asarray(values, dtype=np.float64)
+        self.resolution = resolution
+        self.signature = signature
+        self.engine = engine
+
+    @staticmethod
+    def build(engine, resolution=2, verbose=False, signature=None):
+        axes = []
+        for param in engine.parameters:
+            universe = engine.antecedents[param][0]
+            steps = np.linspace(0, 1, resolution + 1)[:-1]
+            axis = (universe[:-1, np.newaxis] + np.diff(universe)[:, np.newaxis] * steps).ravel()
+            axes.append(np.append(axis, universe[-1]))
+
+        # sample one slice of the first axis at a time to bound memory
+        values = np.empty([len(axis) for axis in axes])
+        for i, value in enumerate(axes[0]):
+            if verbose is True:
+                sys.stdout.write('Sampling: {:2.1%}\r'.format(i / len(axes[0])))
+                sys.stdout.flush()
+            grid = np.meshgrid(*([np.array([value])] + axes[1:]), indexing='ij')
+            values[i] = engine.compute(dict(zip(engine.parameters, grid)))[0]
+        return LookupTable(engine.parameters, axes, values, resolution, signature, engine)
+
+    @staticmethod
+    def filename(directory, fishery, season, resolution):
+        return os.path.join(directory, '{0}_{1}_{2}.npz'.format(fishery, season.replace(' ', ''), resolution))
+
+    @staticmethod
+    def load(file, engine=None):
+        data = np.load(file)
+        count = len(data['parameters'])
+        # tables saved before signatures were kept have none
+        signature = str(data['signature']) if 'signature' in data.files else None
+        return LookupTable([str(p) for p in data['parameters']], [data['axis{0}'.format(i)] for i in range(count)], data['values'], int(data['resolution']), signature, engine)
+
+    def save(self, file):
+        directory = os.path.dirname(file)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory)
+        axes = dict(('axis{0}'.format(i), axis) for i, axis in enumerate(self.axes))
+        if self.signature is not None:
+            axes['signature'] = np.array(self.signature)
+        # concurrent dates may be building the same table
+        with Utilities.atomicWrite(file) as f:
+            np.savez(f, parameters=np.array(self.parameters), values=self.values, resolution=self.resolution, **axes)
+
+    def compute(self, inputs, progress=None):
+        '''
+        Same interface as Inference.compute: interpolate the table at arrays
+        of inputs, NaN where any input is NaN. Pixels in cells with a NaN
+        corner are evaluated exactly.
+        '''
+        shape = np.shape(inputs[self.parameters[0]])
+        values = dict((param, np.asarray(inputs[param], dtype=np.float64).ravel()) for param in self.parameters)
+        index = []
+        weight = []
+        valid = np.ones(int(np.prod(shape)), dtype=bool)
+        for param, axis in zip(self.parameters, self.axes):
+            value = values[param]
+            valid &= ~np.isnan(value)
+            # clip to the table bounds like skfuzzy clips to the universe
+            value = np.clip(np.where(np.isnan(value), axis[0], value), axis[0], axis[-1])
+            i = np.clip(np.searchsorted(axis, value, side='right') - 1, 0, len(axis) - 2)
+            index.append(i)
+            weight.append((value - axis[i]) / (axis[i + 1] - axis[i]))
+
+        # sum over the 2^N corners of each cell
+        results = np.zeros(valid.shape)
+        for corner in range(2 ** len(self.axes)):
+            cornerIndex = []
+            cornerWeight = np.ones(valid.shape)
+            for d in range(len(self.axes)):
+                upper = (corner >> d) & 1
+                cornerIndex.append(index[d] + upper)
+                cornerWeight *= weight[d] if upper else 1 - weight[d]
+            results += cornerWeight * self.values[tuple(cornerIndex)]
+        results[~valid] = np.nan
+        exact = np.flatnonzero(valid & np.isnan(results))
+        if exact.size and self.engine is not None:
+            results[exact] = self.engine.compute(dict((param, values[param][exact]) for param in self.parameters))
+        if progress is not None:
+            progress(1.0)
+        return results.reshape(shape)
+
+    def errorReport(self, engine, samples=100000, inputs=None, seed=0):
+        '''
+        Compare the table against exact inference on random points of the
+        input space, or on the given inputs (e.g. real collocated pixels).
+        '''
+        if inputs is None:
+            random = np.random.RandomState(seed)
+            inputs = dict((param, random.uniform(axis[0], axis[-1], samples)) for param, axis in zip(self.parameters, self.axes))
+        exact = engine.compute(inputs).ravel()
+        approximate = self.compute(inputs).ravel()
+        both = ~np.isnan(exact) & ~np.isnan(approximate)
+        error = np.abs(exact[both] - approximate[both])
+        return {
+            'resolution': self.resolution,
+            'shape': self.values.shape,
+            'bytes': self.values.nbytes,
+            'samples': int(both.sum()),
+            'nan_mismatch': int((np.isnan(exact) != np.isnan(approximate)).sum()),
+            'max': float(error.max()) if error.size else 0.0,
+            'mean': float(error.mean()) if error.size else 0.0,
+            'rmse': float(np.sqrt((error ** 2).mean())) if error.size else 0.0,
+            'p99': float(np.percentile(error, 99)) if error.size else 0.0
+        }
+
+if __name__ == '__main__':
+    from fuzzifier import Fuzzifier
+    from ruletable import RuleTable
+    parser = argparse.ArgumentParser(description='Build PFZ lookup tables and report their error against exact inference')
+    parser.add_argument('-f', '--fishery', required=True, help='the fishery')
+    parser.add_argument('-s', '--season', required=True, help='the season')
+    parser.add_argument('-r', '--resolution', type=int, nargs='+', default=[1, 2], help='subdivisions of each universe step')
+    parser.add_argument('-d', '--directory', default='.', help='directory to save the tables')
+    parser.add_argument('-i', '--input', help='collocated file whose pixels are used for the error report')
+    parser.add_argument('-n', '--samples', type=int, default=100000, help='random samples for the error report')
+    parser.add_argument("-v", "--verbose", help="enable verbose mode", action="store_true")
+    args = parser.parse_args()
+
+    fuzzifier = Fuzzifier(args.input)
+    engine = fuzzifier.compile(args.season, args.fishery)
+    signature = RuleTable.signature(RuleTable.filename(args.fishery, args.season, Fuzzifier.rulesDirectory))
+    inputs = None
+    if args.input is not None:
+        inputs = { param:np.ma.filled(fuzzifier.data[param].astype(np.float64), np.nan) for param in engine.parameters }
+
+    print 'resolution\tshape\tMB\tmax\tmean\trmse\tp99\tnan mismatch'
+    for resolution in args.resolution:
+        table = LookupTable.build(engine, resolution, args.verbose, signature)
+        table.save(LookupTable.filename(args.directory, args.fishery, args.season, resolution))
+        report = table.errorReport(engine, args.samples, inputs)
+        print '{0}\t{1}\t{2:.1f}\t{3:.4f}\t{4:.4f}\t{5:.4f}\t{6:.4f}\t{7}'.format(resolution, 'x'.join(str(n) for n in report['shape']), report['bytes'] / 2 ** 20, report['max'], report['mean'], report['rmse'], report['p99'], report['nan_mismatch'])
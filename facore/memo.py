@@ -0,0 +1,95 @@
+from __future__ import division
+import threading
+import numpy as np
+from collections import OrderedDict
+
+# Precision of each parameter (about that of the L4 products) to which
+# inputs are quantized when pixels are compared or memoized
+Precision = {'chl': 0.01, 'sst': 0.01, 'sla': 0.001, 'depth': 1.0}
+
+def quantize(values, precision):
+    # integer steps of the precision, or the values themselves for precision 0
+    if precision > 0:
+        return np.round(values / precision)
+    return values
+
+class Memo:
+    '''
+    Memoized inference with the compute(inputs) interface of Inference and
+    LookupTable. The input tuple of every pixel is quantized to the
+    precision of each parameter, duplicate tuples are evaluated once and
+    results are kept in a bounded LRU cache across calls, which concurrent
+    calls share. Results are those
+    of the quantized inputs, so they may differ from exact inference by what
+    the rule base does within one quantization step.
+    '''
+    def __init__(self, engine, precision=None, capacity=1 << 20):
+        self.engine = engine
+        self.parameters = engine.parameters
+        self.precision = dict(Precision, **(precision or {}))
+        self.capacity = capacity
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        # tuples found in / missing from the cache, and pixels served
+        self.hits = 0
+        self.misses = 0
+        self.pixels = 0
+
+    def compute(self, inputs, progress=None, evaluate=None):
+        # evaluate(inputs, progress) replaces engine.compute for the missing
+        # tuples, e.g. to spread them over worker processes
+        shape = np.shape(inputs[self.parameters[0]])
+        values = [np.asarray(inputs[param], dtype=np.float64).ravel() for param in self.parameters]
+        results = np.full(values[0].size, np.nan)
+        valid = np.ones(values[0].size, dtype=bool)
+        for value in values:
+            valid &= ~np.isnan(value)
+        index = np.flatnonzero(valid)
+        if len(index) == 0:
+            return results.reshape(shape)
+
+        keys = np.column_stack([quantize(value[index], self.precision[param]) for param, value in zip(self.parameters, values)])
+        unique, inverse = np.unique(keys, axis=0, return_inverse=True)
+        tuples = [row.tobytes() for row in unique]
+        computed = np.empty(len(unique))
+        missing = []
+        with self.lock:
+            for i, key in enumerate(tuples):
+                if key in self.entries:
+                    self.hits += 1
+                    computed[i] = self.entries.pop(key)
+                    self.entries[key] = computed[i]
+                else:
+                    self.misses += 1
+                    missing.append(i)
+
+        if len(missing) > 0:
+            # evaluate the quantized tuples themselves, so a result does not
+            # depend on which pixel happened to be seen first
+            points = unique[missing]
+            representatives = {}
+            for d, param in enumerate(self.parameters):
+                precision = self.precision[param]
+                representatives[param] = points[:, d] * precision if precision > 0 else points[:, d]
+            computed[missing] = (evaluate or self.engine.compute)(representatives, progress)
+            with self.lock:
+                for i in missing:
+                    self.entries[tuples[i]] = computed[i]
+                while len(self.entries) > self.capacity:
+                    self.entries.popitem(last=False)
+
+        with self.lock:
+            self.pixels += len(index)
+        results[index] = computed[inverse]
+        return results.reshape(shape)
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / lookups if lookups else 0.0,
+            'pixels': self.pixels,
+            'evaluated_fraction': self.misses / self.pixels if self.pixels else 0.0,
+            'entries': len(self.entries)
+        }
@@ -0,0 +1,142 @@
+from __future__ import division
+import os
+import json
+import time
+import resource
+import threading
+from utilities import Utilities
+
+def _io():
+    # bytes read and written by the process through system calls, None where
+    # /proc is not available
+    try:
+        with open('/proc/self/io') as f:
+            fields = dict(line.split(':', 1) for line in f)
+        return int(fields['rchar']), int(fields['wchar'])
+    except (IOError, KeyError, ValueError):
+        return None
+
+def _cpu():
+    # user and system seconds of the process and of its waited children
+    return sum(os.times()[:4])
+
+def _peakRss():
+    # high-water marks in bytes of the process and of its largest waited
+    # child, ru_maxrss is in kilobytes on Linux
+    return (resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024,
+            resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss * 1024)
+
+class Stage:
+    '''
+    Context manager measuring one stage, see Metrics.stage. Counts only the
+    stage knows, like pixels or the size of the downloaded products, are
+    added with add(), other fields with set().
+    '''
+    def __init__(self, metrics, name, labels):
+        self.metrics = metrics
+        self.record = dict(labels, stage=name)
+
+    def add(self, **counts):
+        for key, value in counts.items():
+            self.record[key] = self.record.get(key, 0) + value
+
+    def set(self, **fields):
+        self.record.update(fields)
+
+    def __enter__(self):
+        self.start = (time.time(), _cpu(), _io())
+        return self
+
+    def __exit__(self, type, value, traceback):
+        wall, cpu, io = self.start
+        record = self.record
+        record['time'] = wall
+        record['seconds'] = time.time() - wall
+        record['cpu_seconds'] = _cpu() - cpu
+        end = _io()
+        if io is not None and end is not None:
+            self.add(bytes_read=end[0] - io[0], bytes_written=end[1] - io[1])
+        if record.get('pixels'):
+            record['pixels_per_second'] = record['pixels'] / max(record['seconds'], 1e-9)
+        record['peak_rss_bytes'], record['peak_rss_children_bytes'] = _peakRss()
+        if type is not None:
+            record['error'] = '{0}: {1}'.format(type.__name__, value)
+        self.metrics.add(record)
+        return False
+
+class Metrics:
+    '''
+    Records the wall and CPU time, bytes read and written, pixels evaluated
+    per second and peak RSS of every stage (per date, or any other labels).
+    Each record is appended to a JSON lines file as soon as the stage ends,
+    and the totals per stage can be written as a Prometheus textfile for
+    node_exporter's textfile collector.
+
+    CPU time, I/O and peak RSS are those of the whole process: stages that
+    run at the same time in other threads are included, and peak RSS is the
+    high-water mark so far. Child processes (motu, SNAP) count once they are
+    waited for, a persistent SNAP worker is not counted.
+    '''
+    def __init__(self, file=None, prometheus=None, prefix='fishalert'):
+        self.file = file
+        self.prometheus = prometheus
+        self.prefix = prefix
+        self.records = []
+        self.lock = threading.Lock()
+        for path in (file, prometheus):
+            if path is not None and os.path.dirname(path) and not os.path.exists(os.path.dirname(path)):
+                os.makedirs(os.path.dirname(path))
+
+    def stage(self, name, **labels):
+        return Stage(self, name, labels)
+
+    def add(self, record):
+        with self.lock:
+            self.records.append(record)
+            if self.file is not None:
+                with open(self.file, 'a') as f:
+                    f.write(json.dumps(record, sort_keys=True) + '\n')
+
+    def totals(self):
+        # sums per stage of the records so far
+        totals = {}
+        with self.lock:
+            for record in self.records:
+                total = totals.setdefault(record['stage'], {'runs': 0, 'errors': 0, 'seconds': 0, 'cpu_seconds': 0, 'bytes_read': 0, 'bytes_written': 0, 'pixels': 0})
+                total['runs'] += 1
+                total['errors'] += 'error' in record
+                for key in ('seconds', 'cpu_seconds', 'bytes_read', 'bytes_written', 'pixels'):
+                    total[key] += record.get(key, 0)
+        return totals
+
+    def writePrometheus(self, file=None):
+        '''
+        Writes the totals per stage of this run in the Prometheus text
+        format, replacing the file atomically as the textfile collector
+        expects.
+        '''
+        file = file or self.prometheus
+        if file is None:
+            return
+        metrics = [('stage_runs', 'runs', 'Stages run'),
+                   ('stage_errors', 'errors', 'Stages that raised an error'),
+                   ('stage_seconds', 'seconds', 'Wall time of the stages in seconds'),
+                   ('stage_cpu_seconds', 'cpu_seconds', 'CPU time of the stages in seconds'),
+                   ('stage_read_bytes', 'bytes_read', 'Bytes read by the stages'),
+                   ('stage_written_bytes', 'bytes_written', 'Bytes written by the stages'),
+                   ('stage_pixels', 'pixels', 'Pixels evaluated by the stages')]
+        totals = self.totals()
+        lines = []
+        for name, key, help in metrics:
+            lines.append('# HELP {0}_{1} {2} in the last run.'.format(self.prefix, name, help))
+            lines.append('# TYPE {0}_{1} gauge'.format(self.prefix, name))
+            for stage in sorted(totals):
+                lines.append('{0}_{1}{{stage="{2}"}} {3!r}'.format(self.prefix, name, stage, totals[stage][key]))
+        lines.append('# HELP {0}_peak_rss_bytes Peak resident memory of the last run.'.format(self.prefix))
+        lines.append('# TYPE {0}_peak_rss_bytes gauge'.format(self.prefix))
+        lines.append('{0}_peak_rss_bytes {1}'.format(self.prefix, max(_peakRss())))
+        lines.append('# HELP {0}_last_run_timestamp_seconds End of the last run.'.format(self.prefix))
+        lines.append('# TYPE {0}_last_run_timestamp_seconds gauge'.format(self.prefix))
+        lines.append('{0}_last_run_timestamp_seconds {1!r}'.format(self.prefix, time.time()))
+        with Utilities.atomicWrite(file, 'w') as f:
+            f.write('\n'.join(lines) + '\n')
@@ -0,0 +1,99 @@
+from __future__ import division
+import os
+import sys
+import json
+import time
+import threading
+from collections import Counter
+from utilities import Utilities
+
+# Functions of the inference phases, (file, function) -> phase. A sample is
+# counted in the outermost of them on the stack, so the membership
+# interpolation inside skfuzzy's defuzz counts as defuzzification.
+Phases = {
+    ('inference.py', 'fuzzify'): 'membership',
+    ('inference.py', 'activate'): 'rules',
+    ('inference.py', 'defuzzify'): 'defuzzification',
+    ('lookup.py', 'compute'): 'lookup',
+    ('controlsystem.py', '_update_to_current'): 'membership',
+    ('controlsystem.py', 'fuzz'): 'membership',
+    ('controlsystem.py', 'compute_rule'): 'rules',
+    ('controlsystem.py', 'defuzz'): 'defuzzification',
+}
+
+class Profiler:
+    '''
+    Sampling profiler of the inference. Used as a context manager around a
+    run, a thread samples the stack of the profiling thread every interval
+    and counts the sample in its phase (see Phases), or in 'overhead' for
+    everything else: packing the inputs, masks, memo lookups and the Python
+    side of skfuzzy. Samples are taken between bytecodes, so the time of a
+    long numpy call is counted in the function that made it. Work done by
+    worker processes is not seen. A disabled profiler does nothing.
+    '''
+    interval = 0.005
+    phases = ['membership', 'rules', 'defuzzification', 'lookup', 'overhead']
+
+    def __init__(self, interval=None, enabled=True):
+        self.interval = interval or Profiler.interval
+        self.enabled = enabled
+        self.samples = Counter()
+        self.functions = Counter()
+        self.seconds = 0
+
+    def __enter__(self):
+        if not self.enabled:
+            return self
+        self.thread = threading.current_thread().ident
+        self.running = True
+        self.sampler = threading.Thread(target=self._sample)
+        self.sampler.daemon = True
+        self.start = time.time()
+        self.sampler.start()
+        return self
+
+    def __exit__(self, type, value, traceback):
+        if not self.enabled:
+            return False
+        self.seconds += time.time() - self.start
+        self.running = False
+        self.sampler.join()
+        return False
+
+    def _sample(self):
+        while self.running:
+            time.sleep(self.interval)
+            frame = sys._current_frames().get(self.thread)
+            if frame is None:
+                continue
+            code = frame.f_code
+            self.functions['{0}:{1}'.format(os.path.basename(code.co_filename), code.co_name)] += 1
+            phase = 'overhead'
+            while frame is not None:
+                code = frame.f_code
+                phase = Phases.get((os.path.basename(code.co_filename), code.co_name), phase)
+                frame = frame.f_back
+            self.samples[phase] += 1
+
+    def report(self, **labels):
+        # seconds of each phase, estimated from its share of the samples
+        total = sum(self.samples.values())
+        phases = {}
+        for phase in self.phases:
+            fraction = self.samples[phase] / total if total else 0
+            phases[phase] = {'samples': self.samples[phase], 'fraction': fraction, 'seconds': fraction * self.seconds}
+        return dict(labels, seconds=self.seconds, samples=total, interval=self.interval, phases=phases,
+                    functions=self.functions.most_common(10))
+
+    def summary(self):
+        report = self.report()
+        return ', '.join('{0} {1:.1%}'.format(phase, report['phases'][phase]['fraction']) for phase in self.phases if self.samples[phase])
+
+    def save(self, file, **labels):
+        with Utilities.atomicWrite(file, 'w') as f:
+            json.dump(self.report(**labels), f, indent=2, sort_keys=True)
+
+    @staticmethod
+    def filename(output):
+        # the report of a PFZ file, next to it
+        return os.path.splitext(output)[0] + '.profile.json'
@@ -0,0 +1,126 @@
+from __future__ import division
+import os
+import hashlib
+import numpy as np
+import scipy.sparse as sparse
+from utilities import Utilities
+
+def axisWeights(source, target):
+    '''
+    Sparse (len(target), len(source)) matrix of 1-D linear interpolation
+    weights from the source to the target coordinates. Targets within half a
+    source cell of the first or last centre take the edge value, targets
+    further out get an empty row.
+    '''
+    source = np.asarray(source, dtype=np.float64)
+    target = np.asarray(target, dtype=np.float64)
+    descending = len(source) > 1 and source[0] > source[-1]
+    if descending:
+        source = source[::-1]
+    if len(source) == 1:
+        rows = np.flatnonzero(np.abs(target - source[0]) <= 0.5)
+        return sparse.csr_matrix((np.ones(len(rows)), (rows, np.zeros(len(rows), dtype=int))), shape=(len(target), 1))
+
+    half = 0.5 * np.diff(source[[0, 1, -2, -1]])[[0, 2]]
+    inside = (target >= source[0] - half[0]) & (target <= source[-1] + half[1])
+    value = np.clip(target, source[0], source[-1])
+    i = np.clip(np.searchsorted(source, value, side='right') - 1, 0, len(source) - 2)
+    w = (value - source[i]) / (source[i + 1] - source[i])
+
+    rows = np.flatnonzero(inside)
+    i, w = i[rows], w[rows]
+    columns = np.concatenate([i, i + 1])
+    if descending:
+        columns = len(source) - 1 - columns
+    weights = sparse.csr_matrix((np.concatenate([1 - w, w]), (np.concatenate([rows, rows]), columns)), shape=(len(target), len(source)))
+    # zero weights must not spread missing values of a neighbour
+    weights.eliminate_zeros()
+    return weights
+
+class Regridder:
+    '''
+    Bilinear regridding between regular lat/lon grids. Bilinear weights on a
+    regular grid are separable, so they are kept as one sparse matrix per
+    axis and a whole field is regridded with two sparse products:
+
+        target = Wlat . source . Wlon^T
+
+    Target pixels where any neighbour with a non-zero weight is missing, or
+    which fall outside the source grid, are NaN.
+    '''
+    def __init__(self, sourceLat, sourceLon, targetLat, targetLon):
+        self.shape = (len(targetLat), len(targetLon))
+        self.sourceShape = (len(sourceLat), len(sourceLon))
+        self.lat = axisWeights(sourceLat, targetLat)
+        self.lon = axisWeights(sourceLon, targetLon)
+
+    @staticmethod
+    def signature(sourceLat, sourceLon, targetLat, targetLon):
+        # the weights only depend on the four axes
+        digest = hashlib.sha1()
+        for axis in (sourceLat, sourceLon, targetLat, targetLon):
+            axis = np.ascontiguousarray(np.ma.filled(axis), dtype=np.float64)
+            digest.update(str(len(axis)))
+            digest.update(axis.tobytes())
+        return digest.hexdigest()
+
+    @staticmethod
+    def cached(sourceLat, sourceLon, targetLat, targetLon, directory=None, cache=None):
+        '''
+        Regridder for the axes, reused from the in-memory cache dict or from
+        the weights saved in directory when the same grids were seen before.
+        A provider changing its grid changes the signature, so stale weights
+        are never used.
+        '''
+        key = Regridder.signature(sourceLat, sourceLon, targetLat, targetLon)
+        if cache is not None and key in cache:
+            return cache[key]
+        regridder = None
+        file = os.path.join(directory, '{0}.npz'.format(key)) if directory is not None else None
+        if file is not None and os.path.isfile(file):
+            try:
+                regridder = Regridder.load(file)
+            except Exception:
+                regridder = None
+        if regridder is None:
+            regridder = Regridder(sourceLat, sourceLon, targetLat, targetLon)
+            if file is not None:
+                regridder.save(file)
+        if cache is not None:
+            cache[key] = regridder
+        return regridder
+
+    @staticmethod
+    def load(file):
+        data = np.load(file)
+        regridder = Regridder.__new__(Regridder)
+        regridder.shape = tuple(data['shape'])
+        regridder.sourceShape = tuple(data['sourceShape'])
+        regridder.lat = sparse.csr_matrix((data['latData'], data['latIndices'], data['latIndptr']), shape=(regridder.shape[0], regridder.sourceShape[0]))
+        regridder.lon = sparse.csr_matrix((data['lonData'], data['lonIndices'], data['lonIndptr']), shape=(regridder.shape[1], regridder.sourceShape[1]))
+        return regridder
+
+    def save(self, file):
+        directory = os.path.dirname(file)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory)
+        # concurrent dates may be saving the same weights
+        with Utilities.atomicWrite(file) as f:
+            np.savez(f, shape=self.shape, sourceShape=self.sourceShape,
+                     latData=self.lat.data, latIndices=self.lat.indices, latIndptr=self.lat.indptr,
+                     lonData=self.lon.data, lonIndices=self.lon.indices, lonIndptr=self.lon.indptr)
+
+    def regrid(self, values):
+        values = np.ma.filled(np.ma.asarray(values, dtype=np.float64), np.nan)
+        if values.shape != self.sourceShape:
+            raise ValueError('expected a {0} field, got {1}'.format(self.sourceShape, values.shape))
+        missing = np.isnan(values)
+        result = self._apply(np.where(missing, 0., values))
+        # any missing neighbour, or no neighbour at all, makes the pixel missing
+        invalid = self._apply(missing.astype(np.float64)) > 0
+        covered = np.outer(self.lat.getnnz(axis=1) > 0, self.lon.getnnz(axis=1) > 0)
+        result[invalid | ~covered] = np.nan
+        return result
+
+    def _apply(self, values):
+        return np.asarray(self.lon.dot(self.lat.dot(values).T).T)
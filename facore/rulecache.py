@@ -0,0 +1,83 @@
+import os
+import pickle
+import threading
+from collections import OrderedDict
+from utilities import Utilities
+
+class CompiledRules:
+    '''
+    A fishery/season rule base ready for inference: the vectorized engine and
+    the attributes Fuzzifier.setFuzzyRules would set. The skfuzzy
+    ControlSystem is kept in memory only, it is not pickled.
+    '''
+    def __init__(self, season, fishery, usedParameters, outputParameter, engine, system=None):
+        self.season = season
+        self.fishery = fishery
+        self.usedParameters = usedParameters
+        self.outputParameter = outputParameter
+        self.engine = engine
+        self.system = system
+
+    def __getstate__(self):
+        state = dict(self.__dict__)
+        state['system'] = None
+        return state
+
+class RuleCache:
+    '''
+    LRU cache of compiled rule bases keyed by (fishery, season). When a
+    directory is set, compiled rule bases are also pickled there, so that a
+    new process can skip building the skfuzzy objects. Entries, in memory
+    and on disk, are tagged with a signature of the rule definitions and
+    ignored when it changes. Safe to share between threads.
+    '''
+    def __init__(self, capacity=8, directory=None):
+        self.capacity = capacity
+        self.directory = directory
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def filename(self, key):
+        return os.path.join(self.directory, '{0}.pkl'.format('_'.join(key).replace(' ', '')))
+
+    def get(self, key, signature, build):
+        # a rule base missing for several threads is built once
+        with self.lock:
+            stored, entry = self.entries.pop(key, (None, None))
+            if entry is not None and stored == signature:
+                self.hits += 1
+            else:
+                self.misses += 1
+                entry = self.load(key, signature)
+                if entry is None:
+                    entry = build()
+                    self.save(key, signature, entry)
+            self.entries[key] = (signature, entry)
+            while len(self.entries) > self.capacity:
+                self.entries.popitem(last=False)
+            return entry
+
+    def load(self, key, signature):
+        if self.directory is None or not os.path.isfile(self.filename(key)):
+            return None
+        try:
+            with open(self.filename(key), 'rb') as f:
+                stored, entry = pickle.load(f)
+        except Exception:
+            return None
+        return entry if stored == signature else None
+
+    def save(self, key, signature, entry):
+        if self.directory is None:
+            return
+        if not os.path.exists(self.directory):
+            os.makedirs(self.directory)
+        # other processes may be reading the same file
+        with Utilities.atomicWrite(self.filename(key)) as f:
+            pickle.dump((signature, entry), f, pickle.HIGHEST_PROTOCOL)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
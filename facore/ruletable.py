@@ -0,0 +1,163 @@
+from __future__ import division
+import os
+import csv
+import hashlib
+import datetime
+import numpy as np
+from collections import OrderedDict
+
+# Rule tables shipped with facore
+RULES_DIRECTORY = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'rules')
+
+def trapezoid(x, abcd):
+    # Trapezoidal membership sampled exactly like skfuzzy.trapmf
+    a, b, c, d = abcd
+    y = np.ones(len(x))
+    idx = np.nonzero(x <= b)[0]
+    y[idx] = _triangle(x[idx], a, b, b)
+    idx = np.nonzero(x >= c)[0]
+    y[idx] = _triangle(x[idx], c, c, d)
+    y[x < a] = 0
+    y[x > d] = 0
+    return y
+
+def _triangle(x, a, b, c):
+    y = np.zeros(len(x))
+    if a != b:
+        idx = np.nonzero(np.logical_and(a < x, x < b))[0]
+        y[idx] = (x[idx] - a) / float(b - a)
+    if b != c:
+        idx = np.nonzero(np.logical_and(b < x, x < c))[0]
+        y[idx] = (c - x[idx]) / float(c - b)
+    y[x == b] = 1
+    return y
+
+class FuzzyVariable:
+    def __init__(self, name, universe):
+        self.name = name
+        self.universe = universe
+        self.terms = OrderedDict()
+
+    def membership(self, term):
+        return trapezoid(self.universe, self.terms[term])
+
+class RuleTable:
+    '''
+    Rule base of one fishery/season, read from a CSV rule table in which
+    every row is a record:
+
+        input,<variable>,<min>,<max>,<points>     antecedent universe (linspace)
+        output,<variable>,<min>,<max>,<points>    consequent universe
+        term,<variable>,<term>,<a>,<b>,<c>,<d>    trapezoidal membership
+        rule,<term>,...,<term>,<consequent term>  one combination of antecedent
+                                                  terms, in input order
+
+    Rules are AND-ed combinations of one term per input; combinations listed
+    for the same consequent term are OR-ed. Blank lines and lines starting
+    with # are ignored.
+    '''
+    def __init__(self, fishery, season, inputs, output, rules):
+        self.fishery = fishery
+        self.season = season
+        self.inputs = inputs
+        self.output = output
+        self.rules = rules
+
+    @staticmethod
+    def filename(fishery, season, directory=None):
+        return os.path.join(directory or RULES_DIRECTORY, '{0}_{1}.csv'.format(fishery, season.replace(' ', '')))
+
+    @staticmethod
+    def signature(file):
+        with open(file, 'rb') as f:
+            return hashlib.sha1(f.read()).hexdigest()
+
+    @staticmethod
+    def load(file, fishery=None, season=None):
+        inputs = OrderedDict()
+        output = None
+        rules = []
+        with open(file, 'rb') as f:
+            for line, row in enumerate(csv.reader(f), 1):
+                row = [cell.strip() for cell in row]
+                if len(row) == 0 or row[0] == '' or row[0].startswith('#'):
+                    continue
+                try:
+                    if row[0] in ('input', 'output'):
+                        variable = FuzzyVariable(row[1], np.linspace(float(row[2]), float(row[3]), int(row[4])))
+                        if row[0] == 'input':
+                            inputs[variable.name] = variable
+                        else:
+                            output = variable
+                    elif row[0] == 'term':
+                        abcd = [float(value) for value in row[3:7]]
+                        if len(abcd) != 4 or not abcd[0] <= abcd[1] <= abcd[2] <= abcd[3]:
+                            raise ValueError('membership needs a <= b <= c <= d')
+                        variable = output if output is not None and output.name == row[1] else inputs[row[1]]
+                        variable.terms[row[2]] = abcd
+                    elif row[0] == 'rule':
+                        rules.append((tuple(row[1:-1]), row[-1]))
+                    else:
+                        raise ValueError('unknown record {0}'.format(row[0]))
+                except (ValueError, IndexError, KeyError) as e:
+                    raise ValueError('{0}:{1}: {2}'.format(file, line, e))
+
+        table = RuleTable(fishery, season, inputs, output, rules)
+        table.validate(file)
+        return table
+
+    def validate(self, file):
+        if self.output is None or len(self.inputs) == 0:
+            raise ValueError('{0}: needs inputs and an output'.format(file))
+        for combination, consequent in self.rules:
+            if len(combination) != len(self.inputs):
+                raise ValueError('{0}: rule {1} needs one term per input'.format(file, ','.join(combination + (consequent,))))
+            for variable, term in zip(self.inputs.values(), combination):
+                if term not in variable.terms:
+                    raise ValueError('{0}: unknown term {1} of {2}'.format(file, term, variable.name))
+            if consequent not in self.output.terms:
+                raise ValueError('{0}: unknown term {1} of {2}'.format(file, consequent, self.output.name))
+
+    def tensor(self):
+        # Dense rule activation tensor: for every consequent term, a boolean
+        # array over all combinations of antecedent terms
+        shape = [len(variable.terms) for variable in self.inputs.values()]
+        tensor = OrderedDict((term, np.zeros(shape, dtype=bool)) for term in self.output.terms)
+        for combination, consequent in self.rules:
+            index = tuple(list(variable.terms).index(term) for variable, term in zip(self.inputs.values(), combination))
+            tensor[consequent][index] = True
+        return tensor
+
+    @staticmethod
+    def seasons(directory=None):
+        # Calendar of the rule bases: (fishery, season, (month, day), (month, day))
+        seasons = []
+        with open(os.path.join(directory or RULES_DIRECTORY, 'seasons.csv'), 'rb') as f:
+            for row in csv.DictReader(f):
+                start = tuple(int(value) for value in row['start'].split('-'))
+                end = tuple(int(value) for value in row['end'].split('-'))
+                seasons.append((row['fishery'], row['season'], start, end))
+        return seasons
+
+    @staticmethod
+    def fisheries(directory=None):
+        fisheries = []
+        for fishery, _, _, _ in RuleTable.seasons(directory):
+            if fishery not in fisheries:
+                fisheries.append(fishery)
+        return fisheries
+
+    @staticmethod
+    def season(date, fishery, directory=None):
+        # Season of the fishery on a date (YYYY-MM-DD or date), None if it has no rules
+        if not isinstance(date, datetime.date):
+            date = datetime.datetime.strptime(date, '%Y-%m-%d').date()
+        day = (date.month, date.day)
+        for name, season, start, end in RuleTable.seasons(directory):
+            if name != fishery:
+                continue
+            if start <= end and start <= day <= end:
+                return season
+            if start > end and (day >= start or day <= end):
+                return season
+        return None
@@ -0,0 +1,71 @@
+import sys
+import threading
+import traceback
+import Queue
+
+class Scheduler:
+    '''
+    Pipelines items (e.g. dates) through a sequence of stages. Every stage has
+    its own pool of threads, so while one item is in a later stage the next
+    items already run the earlier ones, each stage limited to its own
+    concurrency. A stage returns False to stop an item early; exceptions are
+    printed and stop only the item that raised them. The stages share the
+    process, so they read and write NetCDF files holding
+    Utilities.netcdfLock.
+    '''
+    def __init__(self, stages, done=None):
+        # stages: list of (name, function(item), concurrency)
+        self.stages = stages
+        self.done = done
+
+    def run(self, items):
+        items = list(items)
+        self.results = {}
+        if len(items) == 0:
+            return self.results
+        self.remaining = len(items)
+        self.lock = threading.Lock()
+        self.queues = [Queue.Queue() for _ in self.stages]
+        threads = []
+        for index, (name, function, concurrency) in enumerate(self.stages):
+            for _ in range(max(1, concurrency)):
+                thread = threading.Thread(target=self._work, args=(index,), name='{0}'.format(name))
+                thread.daemon = True
+                thread.start()
+                threads.append(thread)
+        for item in items:
+            self.queues[0].put(item)
+        # join with a timeout so that Ctrl-C still reaches the main thread
+        for thread in threads:
+            while thread.is_alive():
+                thread.join(1)
+        return self.results
+
+    def _work(self, index):
+        name, function, _ = self.stages[index]
+        while True:
+            item = self.queues[index].get()
+            if item is None:
+                return
+            try:
+                completed = function(item) is not False
+            except Exception:
+                sys.stderr.write('{0} failed for {1}:\n{2}'.format(name, item, traceback.format_exc()))
+                completed = False
+            if completed and index + 1 < len(self.stages):
+                self.queues[index + 1].put(item)
+            else:
+                self._finish(item, name, completed)
+
+    def _finish(self, item, name, completed):
+        # result: (last stage reached, whether it completed)
+        with self.lock:
+            self.results[item] = (name, completed)
+            self.remaining -= 1
+            finished = self.remaining == 0
+        if self.done is not None:
+            self.done(item, name, completed)
+        if finished:
+            for (_, _, concurrency), queue in zip(self.stages, self.queues):
+                for _ in range(max(1, concurrency)):
+                    queue.put(None)
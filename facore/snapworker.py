@@ -0,0 +1,161 @@
+import os
+import sys
+import time
+import errno
+import socket
+import argparse
+import threading
+import traceback
+import subprocess
+from multiprocessing.connection import Listener, Client
+
+class SnapWorker:
+    '''
+    Long-lived collocation process: snappy and the JVM are loaded once and
+    jobs arrive over a local (unix) socket, one connection per job, so
+    several jobs can run at once. Exits after `idle` seconds without jobs.
+    '''
+    def __init__(self, address, snappypath=None, backend='snap', jobs=2, idle=3600):
+        self.address = address
+        self.snappypath = snappypath
+        self.backend = backend
+        self.slots = threading.BoundedSemaphore(jobs)
+        self.idle = idle
+        self.lock = threading.Lock()
+        self.running = 0
+        self.lastJob = time.time()
+
+    def serve(self):
+        from collocator import Collocator
+        self.collocator = Collocator(self.snappypath, self.backend)
+        # the worker's output already goes to its log, so the jobs leave
+        # the file descriptors of the process alone
+        self.collocator.suppressOutput = False
+        if self.backend == 'snap':
+            # pay the JVM startup now rather than on the first job
+            import snappy
+        if os.path.exists(self.address):
+            os.remove(self.address)
+        listener = Listener(self.address, 'AF_UNIX')
+        os.chmod(self.address, 0600)
+        watchdog = threading.Thread(target=self._watchdog)
+        watchdog.daemon = True
+        watchdog.start()
+        while True:
+            connection = listener.accept()
+            thread = threading.Thread(target=self._handle, args=(connection,))
+            thread.daemon = True
+            thread.start()
+
+    def _handle(self, connection):
+        with self.lock:
+            self.running += 1
+        try:
+            method, args = connection.recv()
+            with self.slots:
+                try:
+                    result = getattr(self.collocator, method)(*args)
+                    connection.send(('ok', result, getattr(self.collocator, 'report', None)))
+                except Exception:
+                    connection.send(('error', traceback.format_exc(), None))
+        except (EOFError, IOError):
+            pass
+        finally:
+            connection.close()
+            with self.lock:
+                self.running -= 1
+                self.lastJob = time.time()
+
+    def _watchdog(self):
+        while True:
+            time.sleep(10)
+            with self.lock:
+                if self.running == 0 and time.time() - self.lastJob > self.idle:
+                    if os.path.exists(self.address):
+                        os.remove(self.address)
+                    os._exit(0)
+
+class SnapWorkerClient:
+    '''
+    Sends Collocator calls to a SnapWorker, starting one when none listens
+    on the address and restarting it when it crashed during a job.
+    '''
+    def __init__(self, address, snappypath=None, backend='snap', jobs=2, timeout=120):
+        self.address = address
+        self.snappypath = snappypath
+        self.backend = backend
+        self.jobs = jobs
+        # seconds to wait for a starting worker
+        self.timeout = timeout
+        self.process = None
+        self.lock = threading.Lock()
+
+    def start(self):
+        script = os.path.splitext(os.path.abspath(__file__))[0] + '.py'
+        command = [sys.executable, script, '-a', self.address, '-b', self.backend, '-j', str(self.jobs)]
+        if self.snappypath is not None:
+            command += ['-s', self.snappypath]
+        directory = os.path.dirname(os.path.abspath(self.address))
+        if not os.path.exists(directory):
+            os.makedirs(directory)
+        log = open('{0}.log'.format(self.address), 'a')
+        # a new session, so the worker outlives the current run, and none of
+        # our file descriptors, whose HDF5 locks it would keep
+        self.process = subprocess.Popen(command, stdout=log, stderr=subprocess.STDOUT, preexec_fn=os.setsid, close_fds=True)
+        log.close()
+
+    def listening(self):
+        # probe with a plain socket, multiprocessing's Client keeps retrying
+        # a refused address for 20 seconds
+        probe = socket.socket(socket.AF_UNIX)
+        try:
+            probe.connect(self.address)
+            return True
+        except socket.error as e:
+            if e.errno not in (errno.ENOENT, errno.ECONNREFUSED):
+                raise
+            return False
+        finally:
+            probe.close()
+
+    def connect(self):
+        with self.lock:
+            if not self.listening():
+                if self.process is None or self.process.poll() is not None:
+                    self.start()
+                deadline = time.time() + self.timeout
+                while not self.listening():
+                    if self.process.poll() is not None:
+                        raise RuntimeError('SNAP worker exited with code {0}, see {1}.log'.format(self.process.returncode, self.address))
+                    if time.time() > deadline:
+                        raise RuntimeError('SNAP worker did not start in {0}s, see {1}.log'.format(self.timeout, self.address))
+                    time.sleep(0.5)
+            return Client(self.address, 'AF_UNIX')
+
+    def call(self, method, *args):
+        # a job lost with a crashed worker is sent once more to a new worker
+        for tries in range(2):
+            connection = self.connect()
+            try:
+                connection.send((method, args))
+                status, result, report = connection.recv()
+            except (EOFError, IOError):
+                if tries == 1:
+                    raise RuntimeError('SNAP worker crashed during {0}'.format(method))
+                continue
+            finally:
+                connection.close()
+            if status == 'error':
+                raise RuntimeError('SNAP worker failed:\n{0}'.format(result))
+            return result, report
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Persistent SNAP collocation worker')
+    parser.add_argument('-a', '--address', required=True, help='unix socket to listen on')
+    parser.add_argument('-s', '--snappypath', help='the path to snappy')
+    parser.add_argument('-b', '--backend', choices=['snap', 'numpy'], default='snap', help='the collocation backend')
+    parser.add_argument('-j', '--jobs', type=int, default=2, help='jobs run at once')
+    parser.add_argument('-i', '--idle', type=int, default=3600, help='seconds without jobs before exiting')
+    args = parser.parse_args()
+
+    SnapWorker(args.address, args.snappypath, args.backend, args.jobs, args.idle).serve()
@@ -1,14 +1,69 @@
 import netCDF4 as cdf
+import os
 import argparse
+import hashlib
 import random
 import string
+import tempfile
+import threading
+from contextlib import contextmanager
+
+# the process umask, read once: reading it means setting it
+_umask = os.umask(0)
+os.umask(_umask)
 
 class Utilities:
+    # netCDF4 releases the GIL during its calls, but the HDF5 library beneath
+    # it is not thread safe: threads of one process (the pipeline stages, the
+    # jobs of a SNAP worker) only open, read, write and close NetCDF files
+    # while holding this lock
+    netcdfLock = threading.RLock()
+
+    @staticmethod
+    @contextmanager
+    def atomicWrite(file, mode='wb'):
+        '''
+        File object to write file with: the data go to a temporary file in
+        the same directory, renamed over file when the block ends without an
+        error and removed otherwise. Readers, other processes and concurrent
+        writers only ever see a complete file, with the permissions open()
+        would have given it.
+        '''
+        handle, temp = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(file)), prefix='_part_{0}.'.format(os.path.basename(file)))
+        try:
+            with os.fdopen(handle, mode) as f:
+                yield f
+            os.chmod(temp, 0666 & ~_umask)
+            os.rename(temp, file)
+        except BaseException:
+            if os.path.exists(temp):
+                os.remove(temp)
+            raise
+
     @staticmethod
     def deleteCollocationFlags(file):
-        dsin = cdf.Dataset(file, 'r+')
-        dsin.renameVariable('collocation_flags', 'collocation_flags_'.join(random.choice(string.ascii_uppercase + string.digits) for _ in range(5)))
-        dsin.close()
+        with Utilities.netcdfLock:
+            dsin = cdf.Dataset(file, 'r+')
+            # only SNAP writes collocation flags
+            if 'collocation_flags' in dsin.variables:
+                dsin.renameVariable('collocation_flags', 'collocation_flags_'.join(random.choice(string.ascii_uppercase + string.digits) for _ in range(5)))
+            dsin.close()
+
+    @staticmethod
+    def contentHash(file):
+        # Hash of the variables' names, types, shapes and raw values. Global
+        # attributes such as the download history are left out, so fetching
+        # the same data again gives the same hash.
+        digest = hashlib.sha1()
+        with Utilities.netcdfLock:
+            dsin = cdf.Dataset(file, 'r')
+            for name in sorted(dsin.variables):
+                variable = dsin.variables[name]
+                variable.set_auto_maskandscale(False)
+                digest.update('{0}:{1}:{2};'.format(name, variable.dtype, variable.shape))
+                digest.update(variable[:].tobytes())
+            dsin.close()
+        return digest.hexdigest()
 
 if __name__ == '__main__':
     parser = argparse.ArgumentParser(description='Utility functions needed in the generation of PFZs')
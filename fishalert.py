@@ -2,63 +2,258 @@ from facore import *
 import config
 import os
 import sys
+import json
 import datetime
 import argparse
-import time
-from shutil import copy
+
+# Inputs of every date, named like the fuzzifier parameters
+INPUTS = ['chl', 'sst', 'sla', 'depth']
 
 def date_to_season(date, fishery):
-    year, month, day = date.split('-')
-    month = int(month)
-    day = int(day)
-    if fishery == 'Anchovy':
-        if month == 12 or month == 1 or month == 2:
-            return 'Winter'
-        elif month == 3 or month == 4 or month == 5:
-            return None
-        elif month == 6 or month == 7 or month == 8:
-            return 'Summer'
-        elif month == 9 or (month == 10 and day < 15):
-            return 'Early Autumn'
-        elif (month == 10 and day >= 15) or month == 11:
-            return 'Late Autumn'
-    elif fishery == 'Sardine':
-        if month == 5 or month == 6 or month == 7:
-            return 'June'
-        elif month == 8 or month == 9 or month == 10:
-            return 'September'
-        elif month == 11 or month == 12 or month == 1:
-            return 'December'
+    # seasons are defined with the rule tables, see facore/rules/seasons.csv
+    return RuleTable.season(date, fishery)
+
+def parse_date(value):
+    if value == 'today':
+        return datetime.date.today()
+    return datetime.datetime.strptime(value, '%Y-%m-%d').date()
+
+def date_files(workspace_directory, date):
+    directory = os.path.join(workspace_directory, date)
+    files = {'directory': directory}
+    for key, name in [('depth', 'bathymetry.nc'), ('chl', 'CHL.nc'), ('sst', 'SST.nc'), ('sla', 'SLA.nc'), ('temp1', '_temp1.nc'), ('temp2', '_temp2.nc'), ('final', 'final.nc')]:
+        files[key] = os.path.join(directory, name)
+    return files
+
+def partial_file(file):
+    # stages write here and rename when done, so a crash never leaves a
+    # truncated file that a resumed run would take as complete
+    return os.path.join(os.path.dirname(file), '_part_' + os.path.basename(file))
+
+def read_manifest(files):
+    # Per date record of the content hashes of the inputs, and of the inputs
+    # final.nc and every PFZ were computed from
+    file = os.path.join(files['directory'], 'manifest.json')
+    if not os.path.isfile(file):
+        return {'inputs': {}, 'final': None, 'outputs': {}}
+    with open(file) as f:
+        return json.load(f)
+
+def write_manifest(files, manifest):
+    with Utilities.atomicWrite(os.path.join(files['directory'], 'manifest.json'), 'w') as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+
+def computed_from_final(files, fish):
+    # a PFZ may seed a delta run of the next day only if it was computed from
+    # the final.nc that is on disk now
+    manifest = read_manifest(files)
+    sources = manifest['outputs'].get(fish)
+    if sources is None or manifest['final'] is None:
+        return False
+    return all(manifest['final'].get(key) == value for key, value in sources['inputs'].items())
+
+def input_hashes(context, files):
+    # the shared bathymetry was hashed once when it was prepared
+    hashes = dict((key, Utilities.contentHash(files[key])) for key in INPUTS if key != 'depth')
+    hashes['depth'] = context['bathymetry'].signature
+    return hashes
+
+def needs_work(context, date):
+    # Cheap look at a date before anything is built, downloaded, hashed or
+    # loaded: work is left when a fishery in season has no PFZ or one of
+    # another season, an input was written after the manifest, or products
+    # are refreshed. The stages still compare content hashes when they run.
+    files = date_files(context['workspace'], date)
+    if context['args'].refresh:
+        return True
+    manifest = read_manifest(files)
+    for fish in context['fishery']:
+        season = date_to_season(date, fish)
+        if season is None:
+            continue
+        if not os.path.isfile(os.path.join(files['directory'], '{0}.nc'.format(fish))):
+            return True
+        if fish in manifest['outputs'] and manifest['outputs'][fish]['season'] != season:
+            return True
+    manifest_file = os.path.join(files['directory'], 'manifest.json')
+    written = os.path.getmtime(manifest_file) if os.path.isfile(manifest_file) else None
+    for file in [files['chl'], files['sst'], files['sla'], context['bathymetry_file']]:
+        if os.path.isfile(file) and (written is None or os.path.getmtime(file) > written):
+            return True
+    return False
+
+def measured(context, name, stage):
+    # a stage of a date recorded in the metrics, the stage adds its own counts
+    # (pixels, downloaded bytes) to the record it is given
+    def run(date):
+        with context['metrics'].stage(name, date=date) as measure:
+            completed = stage(context, date, measure) is not False
+            measure.set(completed=completed)
+        return completed
+    return run
+
+def download_stage(context, date, measure):
+    files = date_files(context['workspace'], date)
+    if not os.path.exists(files['directory']):
+        os.makedirs(files['directory'])
+
+    # the three products come from different servers, fetch them together;
+    # reprocessed products are fetched again with --refresh
+    refresh = context['args'].refresh or []
+    jobs = [(files['directory'], '{0}.nc'.format(p), p, date) for p in ['CHL', 'SST', 'SLA'] if p in refresh or not os.path.isfile(files[p.lower()])]
+    results = context['downloader'].downloadAll(jobs, verbose=True, force_copy=len(refresh) > 0)
+    # size of the products fetched, apart from the I/O of the motu clients
+    measure.add(bytes_downloaded=sum(os.path.getsize(result.file) for result in results.values() if result and not result.skipped))
+
+    # Not all environmental data are available
+    if not (os.path.isfile(files['chl']) and os.path.isfile(files['sst']) and os.path.isfile(files['sla'])):
+        if context['verbose'] is True:
+            print 'Not all environmental data are available for {0}. PFZ generation is not possible.'.format(date)
+        return False
+    return True
+
+def collocate_stage(context, date, measure):
+    # Collocate files into one
+    files = date_files(context['workspace'], date)
+    manifest = read_manifest(files)
+    manifest['inputs'] = input_hashes(context, files)
+    if os.path.isfile(files['final']) and manifest['final'] is None:
+        # collocated before manifests were kept
+        manifest['final'] = manifest['inputs']
+    if not os.path.isfile(files['final']) or manifest['final'] != manifest['inputs']:
+        # one call, the intermediate products never touch the disk and the
+        # shared bathymetry is read in place as the master
+        context['collocator'].CollocateAll(context['bathymetry'].file, [files['sst'], files['chl'], files['sla']], partial_file(files['final']), context['verbose'])
+        os.rename(partial_file(files['final']), files['final'])
+        manifest['final'] = manifest['inputs']
+    elif context['verbose'] is True:
+        print 'Collocated data for {0} are up to date. Skipping...'.format(date)
+    write_manifest(files, manifest)
+    return True
+
+def fuzzify_stage(context, date, measure):
+    files = date_files(context['workspace'], date)
+    args = context['args']
+    manifest = read_manifest(files)
+    if len(manifest['inputs']) == 0:
+        manifest['inputs'] = input_hashes(context, files)
+    # For each fishery find the corresponding season
+    jobs = []
+    for fish in context['fishery']:
+        season = date_to_season(date, fish)
+        if season is not None:
+            output_file = os.path.join(files['directory'], '{0}.nc'.format(fish))
+            # a PFZ only depends on the inputs its rule base uses, and on the
+            # bathymetry through the ocean mask
+            used = Fuzzifier().compile(season, fish).parameters
+            sources = {'season': season, 'inputs': dict((key, manifest['inputs'][key]) for key in set(used + ['depth']))}
+            if os.path.isfile(output_file):
+                if fish not in manifest['outputs']:
+                    # computed before manifests were kept
+                    manifest['outputs'][fish] = sources
+                if manifest['outputs'][fish] == sources:
+                    if context['verbose'] is True:
+                        print 'PFZ for {0} on {1} is up to date. Skipping...'.format(fish, date)
+                    continue
+            jobs.append((season, fish, output_file))
+            manifest['outputs'][fish] = sources
         else:
-            return None
+            if context['verbose'] is True:
+                print 'PFZ rules for {0} not available on {1}'.format(fish, date)
+    if len(jobs) == 0:
+        write_manifest(files, manifest)
+        return True
+
+    # Several fisheries are evaluated in one pass over the collocated data,
+    # as is --stream, unless the pixels are spread over worker processes or
+    # each rule base is profiled on its own
+    single_pass = args.backend != 'skfuzzy' and not args.delta and not args.profile and (args.stream or (len(jobs) > 1 and args.workers == 1))
+    # worker processes would run out of sight of the profiler
+    workers = 1 if args.profile else args.workers
+    previous_date = (parse_date(date) - datetime.timedelta(days=1)).isoformat()
+    previous = date_files(context['workspace'], previous_date)
+    # Create Fuzzifier using the collocated environmental data
+    fuzzifier = Fuzzifier(files['final'], None, single_pass, context['bathymetry'])
+    fuzzifier.setOutputFormat(args.complevel, encoding=args.encoding)
+    if single_pass:
+        fuzzifier.runAll([(season, fish, partial_file(output_file)) for season, fish, output_file in jobs], backend=args.backend, lutDirectory=context['lut'])
     else:
-        return None
+        for season, fish, output_file in jobs:
+            previous_output = os.path.join(previous['directory'], '{0}.nc'.format(fish))
+            profiler = Profiler(enabled=args.profile)
+            pixels = fuzzifier.pixels
+            with profiler:
+                if args.delta and args.backend != 'skfuzzy' and date_to_season(previous_date, fish) == season and computed_from_final(previous, fish):
+                    # reuse the previous day's PFZ where the inputs did not change
+                    fuzzifier.runDelta(season, fish, previous['final'], previous_output, backend=args.backend, lutDirectory=context['lut'], workers=workers)
+                else:
+                    # run the fuzzification process
+                    fuzzifier.run(season, fish, backend=args.backend, lutDirectory=context['lut'], workers=workers)
+            if args.profile:
+                profiler.save(Profiler.filename(output_file), fishery=fish, season=season, date=date, backend=args.backend, pixels=fuzzifier.pixels - pixels)
+                if context['verbose'] is True:
+                    print 'Profile of {0} {1}: {2}'.format(fish, season, profiler.summary())
+            # write the results to file
+            fuzzifier.writeData(partial_file(output_file))
+    for season, fish, output_file in jobs:
+        os.rename(partial_file(output_file), output_file)
+    measure.add(pixels=fuzzifier.pixels)
+    measure.set(fisheries=[fish for season, fish, output_file in jobs])
+    write_manifest(files, manifest)
+    return True
+
+def erase_files(context, date):
+    files = date_files(context['workspace'], date)
+    if context['verbose'] is True:
+        print 'Deleting temporary files...'
+    for key in ['chl', 'sst', 'sla', 'depth', 'temp1', 'temp2', 'final']:
+        if os.path.isfile(files[key]):
+            os.remove(files[key])
+    if context['verbose'] is True:
+        print 'Temporary files deleted.'
 
 if __name__ == '__main__':
     parser = argparse.ArgumentParser(description='Calculate Possible Fishing Zones in the Mediterranean Sea.')
-    parser.add_argument('-f', '--fishery', choices=['ALL', 'Anchovy', 'Sardine'], default='Anchovy', help='fishery')
+    parser.add_argument('-f', '--fishery', choices=['ALL'] + RuleTable.fisheries(), default='Anchovy', help='fishery')
     parser.add_argument('-d', '--date', default='today', help='a date')
+    parser.add_argument('-s', '--start', help='first date (YYYY-MM-DD) of a range to process, overrides --date')
+    parser.add_argument('-t', '--end', help='last date (YYYY-MM-DD) of the range, defaults to today')
     parser.add_argument('-v', '--verbose', help='enable verbose mode', action='store_true')
     parser.add_argument('-e', '--erase-files', help='erase temporary files', action='store_true')
     parser.add_argument('-p', '--previous-day', help='calculate PFZ for previous date if not all data are available', action='store_true')
+    parser.add_argument('-r', '--refresh', nargs='+', choices=['CHL', 'SST', 'SLA'], help='download reprocessed products again, only what depends on them is recomputed')
+    parser.add_argument('-b', '--backend', choices=['numpy', 'lut', 'skfuzzy'], default='numpy', help='the inference backend')
+    parser.add_argument('-c', '--collocator', choices=['snap', 'numpy'], default='snap', help='the collocation backend')
+    parser.add_argument('--snap-worker', help='keep SNAP loaded in a persistent worker between runs', action='store_true')
+    parser.add_argument('--stream', help='fuzzify in blocks of rows to bound memory (numpy and lut backends)', action='store_true')
+    parser.add_argument('--delta', help="evaluate only the pixels whose inputs changed since the previous day's run", action='store_true')
+    parser.add_argument('--memo', type=int, default=0, help='memoize inference on quantized inputs, keeping at most this many tuples across dates')
+    parser.add_argument('--complevel', type=int, default=4, help='zlib level of the PFZ files (0 for none)')
+    parser.add_argument('--encoding', choices=['float32', 'uint8'], default='float32', help='PFZ as float32, or whole percent in uint8')
+    parser.add_argument('-w', '--workers', type=int, default=1, help='worker processes for the fuzzification (0 for all cores)')
+    parser.add_argument('--profile', help='sample the inference and save the time of each phase next to every PFZ file', action='store_true')
+    parser.add_argument('--metrics', help='JSON lines file of the time, I/O and memory of every stage (default: metrics.jsonl in the workspace)')
+    parser.add_argument('--prometheus', help='also write the totals of the run to this Prometheus textfile')
+    parser.add_argument('--download-jobs', type=int, default=2, help='dates downloaded concurrently')
+    parser.add_argument('--collocate-jobs', type=int, default=1, help='dates collocated concurrently')
+    parser.add_argument('--fuzzify-jobs', type=int, default=1, help='dates fuzzified concurrently')
     args = parser.parse_args()
 
-    if args.date == 'today':
-        date = '{0}'.format(datetime.date.today().isoformat())
-    else:
-        try:
-            date = '{0}'.format(datetime.datetime.strptime(args.date, '%Y-%m-%d').date())
-        except ValueError:
-            sys.exit('Incorrect date, should be YYYY-MM-DD or today (default)')
+    try:
+        if args.start is not None:
+            start = parse_date(args.start)
+            end = parse_date(args.end or 'today')
+        else:
+            start = end = parse_date(args.date)
+    except ValueError:
+        sys.exit('Incorrect date, should be YYYY-MM-DD or today (default)')
+    dates = [(start + datetime.timedelta(days=n)).isoformat() for n in range((end - start).days + 1)]
 
     fishery = list()
-    if args.fishery == 'Anchovy':
-        fishery.append('Anchovy')
-    elif args.fishery == 'Sardine':
-        fishery.append('Sardine')
-    elif args.fishery == 'ALL':
-        fishery.append('Anchovy')
-        fishery.append('Sardine')
+    if args.fishery == 'ALL':
+        fishery.extend(RuleTable.fisheries())
+    else:
+        fishery.append(args.fishery)
 
     verbose = False
     if args.verbose:
@@ -68,10 +263,6 @@ if __name__ == '__main__':
     if args.previous_day:
         download_previous_day = True
 
-    erase_files = False
-    if args.erase_files:
-        erase_files = True
-
     settings = config.settings
     fish_alert_directory = os.path.dirname(os.path.abspath(__file__))
     workspace_directory = config.settings['workspace']
@@ -79,101 +270,68 @@ if __name__ == '__main__':
     username = config.settings['cmems_username']
     password = config.settings['cmems_password']
     snappy_path = config.settings['snappypath']
+    lut_directory = os.path.join(workspace_directory, 'lut')
+    bathymetry_file = '{0}/assets/bathymetry.nc'.format(fish_alert_directory)
+    Fuzzifier.ruleCache.directory = os.path.join(workspace_directory, 'cache', 'rules')
+    Fuzzifier.memoCapacity = args.memo
+    worker_address = os.path.join(workspace_directory, 'snapworker.sock') if args.snap_worker else None
+
+    if not os.path.isfile(bathymetry_file):
+        sys.exit('Bathymetry file not available. Should be in assets/bathymetry.nc')
 
     if not os.path.exists(workspace_directory):
         os.makedirs(workspace_directory)
 
-    os.chdir(workspace_directory)
-
-    current_date_directory = os.path.join(workspace_directory, date)
-    if not os.path.exists(current_date_directory):
-        os.makedirs(current_date_directory)
+    context = {
+        'args': args,
+        'verbose': verbose,
+        'fishery': fishery,
+        'workspace': workspace_directory,
+        'bathymetry_file': bathymetry_file,
+        'lut': lut_directory,
+        'metrics': Metrics(args.metrics or os.path.join(workspace_directory, 'metrics.jsonl'), args.prometheus)
+    }
 
-    os.chdir(current_date_directory)
-    
-    if not os.path.isfile('bathymetry.nc'):
-        if os.path.isfile('{0}/assets/bathymetry.nc'.format(fish_alert_directory)):
-            copy('{0}/assets/bathymetry.nc'.format(fish_alert_directory), '.')
-        else:
-            sys.exit('Bathymetry file not available. Should be in assets/bathymetry.nc')
-    
-    depth_file = 'bathymetry.nc'
-    chl_file = 'CHL.nc'
-    sst_file = 'SST.nc'
-    sla_file = 'SLA.nc'
-    temp1_file = '_temp1.nc'
-    temp2_file = '_temp2.nc'
-    final_file = 'final.nc'
-
-    downloader = Downloader(motu_path, username, password)
-    if not os.path.isfile(chl_file):
-        downloader.download(current_date_directory, chl_file, 'CHL', date, True)
-    if not os.path.isfile(sst_file):
-        downloader.download(current_date_directory, sst_file, 'SST', date, True)
-    if not os.path.isfile(sla_file):
-        downloader.download(current_date_directory, sla_file, 'SLA', date, True)
-    
-    # All environmental data are available
-    if os.path.isfile(chl_file) and os.path.isfile(sst_file) and os.path.isfile(sla_file):
-        # Collocate files into one
-        collocator = Collocator(snappy_path)
-        if not os.path.isfile(temp1_file):
-            collocator.Collocate(depth_file, sst_file, temp1_file)
-            Utilities.deleteCollocationFlags(temp1_file)
-            time.sleep(1)
-        if not os.path.isfile(temp2_file):
-            collocator.Collocate(temp1_file, chl_file, temp2_file)
-            Utilities.deleteCollocationFlags(temp2_file)
-            time.sleep(1)
-        if not os.path.isfile(final_file):
-            collocator.Collocate(temp2_file, sla_file, final_file)
-            Utilities.deleteCollocationFlags(final_file)
-            time.sleep(1)
-        
-        # Create Fuzzifier using the collocated environmental data
-        fuzzifier = Fuzzifier(final_file)
-        # For each fishery
-        for fish in fishery:
-            # find the corresponding season
-            season = date_to_season(date, fish)
-            if season is not None:
-                if os.path.isfile('{0}.nc'.format(fish)):
-                    if verbose is True:
-                        print 'PFZ for {0} on {1} already exists. Skipping...'.format(fish, date)
-                    continue
-                # run the fuzzification process
-                fuzzifier.run(season, fish)
-                # write the results to file
-                fuzzifier.writeData('{0}.nc'.format(fish))
-            else:
-                if verbose is True:
-                    print 'PFZ rules for {0} not available on {1}'.format(fish, date)
-    
-    # Not all environmental data are available
-    else:
-        if verbose is True:
-            print 'Not all environmental data are available for {0}. PFZ generation is not possible.'.format(date)
-    
-    # Delete temporary files if flag is set
-    if erase_files is True:
-        if verbose is True:
-            print 'Deleting temporary files...'
-        if os.path.isfile(chl_file):
-            os.remove(chl_file)
-        if os.path.isfile(sst_file):
-            os.remove(sst_file)
-        if os.path.isfile(sla_file):
-            os.remove(sla_file)
-        if os.path.isfile(depth_file):
-            os.remove(depth_file)
-        if os.path.isfile(temp1_file):
-            os.remove(temp1_file)
-        if os.path.isfile(temp2_file):
-            os.remove(temp2_file)
-        if os.path.isfile(final_file):
-            os.remove(final_file)
+    # Plan first: redundant runs stop here, before the pipeline is built
+    with context['metrics'].stage('plan', dates=len(dates)) as measure:
+        pending = [date for date in dates if needs_work(context, date)]
+        measure.set(pending=len(pending))
+    if len(pending) == 0:
+        context['metrics'].writePrometheus()
         if verbose is True:
-            print 'Temporary files deleted.'
+            print 'All PFZ are up to date. Nothing to do.'
+        sys.exit()
+
+    # one shared conversion of the bathymetry, memory-mapped by every date
+    context['bathymetry'] = Bathymetry.prepare(bathymetry_file, os.path.join(workspace_directory, 'cache', 'bathymetry'))
+    context['downloader'] = Downloader(motu_path, username, password)
+    context['collocator'] = Collocator(snappy_path, args.collocator, os.path.join(workspace_directory, 'cache', 'weights'), worker_address)
+
+    # Delete temporary files if flag is set, whether the date completed or not
+    def done(date, stage, completed):
+        if args.erase_files:
+            erase_files(context, date)
+
+    # Dates are pipelined: while one date is fuzzified the next ones are
+    # already collocating and downloading. Finished stages leave their files
+    # in the date directory, so rerunning after a crash resumes where it stopped.
+    scheduler = Scheduler([
+        ('download', measured(context, 'download', download_stage), args.download_jobs),
+        ('collocate', measured(context, 'collocate', collocate_stage), args.collocate_jobs),
+        ('fuzzify', measured(context, 'fuzzify', fuzzify_stage), args.fuzzify_jobs)
+    ], done)
+    with context['metrics'].stage('run', dates=len(pending)) as measure:
+        results = scheduler.run(pending)
+        measure.set(dates_completed=sum(1 for stage, completed in results.values() if completed))
+    context['metrics'].writePrometheus()
+
+    if verbose is True and len(dates) > 1:
+        for date in dates:
+            if date not in results:
+                print '{0}: up to date'.format(date)
+                continue
+            stage, completed = results[date]
+            print '{0}: {1}'.format(date, 'done' if completed else 'stopped at {0}'.format(stage))
 
 ''' 
 TODO